@@ -0,0 +1,410 @@
+"""
+Arquivamento por mês de mensagens e orçamentos antigos
+
+Linhas com created_at mais antigo que STARKE_ARCHIVE_AFTER_DAYS são movidas
+do banco principal ("hot") para arquivos mensais em <dir do banco>/archive/
+(ex: archive/2025-03.sqlite3). Consultas, contagens, backups e VACUUM do
+banco principal passam a tocar apenas os dados recentes.
+
+As listagens só anexam (ATTACH) os arquivos mensais quando o intervalo de
+datas pedido (from/to) cobre algum mês arquivado. Intervalos com mais
+meses do que cabem em uma conexão são lidos em lotes (uma conexão por
+lote) e as páginas de cada lote são intercaladas por created_at.
+
+A busca por id (get_archived) procura nos arquivos mensais quando a linha
+não está no banco principal. Linhas arquivadas são somente leitura: PUT,
+PATCH e DELETE continuam vendo apenas o banco principal.
+"""
+import heapq
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from itertools import islice
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import quote
+
+from _changes import last_seq, mark_archived
+from _db import TABLE_SCHEMAS, _ensure_db_path, create_tables, get_db, read_db
+from _packing import unpack_cursor, unpack_dict
+
+# Idade mínima (dias) para uma linha ser arquivada
+ARCHIVE_AFTER_DAYS = int(os.getenv('STARKE_ARCHIVE_AFTER_DAYS', '365'))
+
+# SQLite permite 10 bancos anexados por conexão - reserva um de folga;
+# intervalos com mais meses são lidos em lotes desse tamanho
+MAX_ATTACHED_ARCHIVES = 9
+
+_ARCHIVE_FILE_RE = re.compile(r'^(\d{4}-\d{2})\.sqlite3$')
+
+
+class ArchiveRangeError(ValueError):
+    """Mais arquivos do que podem ser anexados a uma conexão (ver attached_archives)"""
+
+
+def get_archive_dir() -> str:
+    """Diretório dos arquivos mensais (STARKE_ARCHIVE_DIR ou <dir do banco>/archive)"""
+    return os.getenv('STARKE_ARCHIVE_DIR') or os.path.join(
+        os.path.dirname(_ensure_db_path()), 'archive'
+    )
+
+
+def _archive_path(month: str) -> str:
+    return os.path.join(get_archive_dir(), f'{month}.sqlite3')
+
+
+def list_archive_months() -> list:
+    """Meses (YYYY-MM) que possuem arquivo de arquivamento, em ordem crescente"""
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        match = _ARCHIVE_FILE_RE.match(name)
+        if match:
+            months.append(match.group(1))
+    return sorted(months)
+
+
+def get_archive_info() -> dict:
+    """Resumo dos arquivos mensais (mês e tamanho em bytes)"""
+    months = list_archive_months()
+    return {
+        'dir': get_archive_dir(),
+        'after_days': ARCHIVE_AFTER_DAYS,
+        'months': [
+            {'month': month, 'size': os.path.getsize(_archive_path(month))}
+            for month in months
+        ],
+    }
+
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    if mon == 12:
+        return f'{year + 1:04d}-01'
+    return f'{year:04d}-{mon + 1:02d}'
+
+
+def parse_date_range(date_from: Optional[str], date_to: Optional[str]):
+    """
+    Valida e normaliza o intervalo de datas de uma listagem.
+
+    Aceita datas (YYYY-MM-DD, ou YYYYMMDD) ou datas/horas ISO 8601. Uma data
+    sem hora em `to` inclui o dia inteiro.
+
+    Retorna:
+        tuple: (início inclusivo, fim exclusivo) como strings ISO, ou None
+
+    Raises:
+        ValueError: Se alguma das datas for inválida (ou não for string)
+    """
+    for value in (date_from, date_to):
+        if value is not None and not isinstance(value, str):
+            raise ValueError('Data deve ser uma string ISO 8601')
+    start = end = None
+    if date_from:
+        start = datetime.fromisoformat(date_from).isoformat()
+    if date_to:
+        try:
+            # Só data (em qualquer forma aceita pelo ISO 8601): inclui o dia inteiro
+            end = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+        except ValueError:
+            end = datetime.fromisoformat(date_to).isoformat()
+    return start, end
+
+
+def _months_for_range(start: Optional[str], end: Optional[str]) -> list:
+    """Meses arquivados que se sobrepõem ao intervalo [start, end)"""
+    if start is None and end is None:
+        return []
+    months = []
+    for month in list_archive_months():
+        month_start, month_end = month, _next_month(month)
+        if start is not None and month_end <= start[:7]:
+            continue
+        if end is not None and month_start > end[:7]:
+            continue
+        months.append(month)
+    return months
+
+
+@contextmanager
+def attached_archives(db, months):
+    """
+    Anexa os arquivos mensais à conexão durante o bloco.
+
+    Retorna:
+        list: Aliases dos bancos anexados (arch_0, arch_1, ...)
+    """
+    if len(months) > MAX_ATTACHED_ARCHIVES:
+        raise ArchiveRangeError(
+            f'Intervalo abrange {len(months)} meses arquivados (máximo: {MAX_ATTACHED_ARCHIVES})'
+        )
+    aliases = []
+    try:
+        for index, month in enumerate(months):
+            alias = f'arch_{index}'
+            db.execute(f'ATTACH DATABASE ? AS {alias}', (_archive_path(month),))
+            aliases.append(alias)
+        yield aliases
+    finally:
+        for alias in aliases:
+            try:
+                db.execute(f'DETACH DATABASE {alias}')
+            except sqlite3.Error:
+                pass
+
+
+@contextmanager
+def open_records(db, table, columns, page_size, offset, date_from=None, date_to=None, tuples=False):
+    """
+    Abre a consulta de uma página de registros, incluindo meses arquivados só quando necessário.
+
+    O cursor é entregue sem fetchall(), para que as linhas possam ser
+    consumidas uma a uma; ele é fechado (e os arquivos desanexados) ao
+    sair do bloco.
+
+    Args:
+        db: Conexão aberta com o banco principal
+        table: 'messages' ou 'budgets'
+        columns: Colunas selecionadas (string SQL)
+        page_size, offset: Paginação
+        date_from, date_to: Intervalo normalizado por parse_date_range
+        tuples: True para o cursor devolver tuplas em vez de sqlite3.Row
+
+    Retorna:
+        tuple: (total, cursor)
+
+    """
+    if table not in TABLE_SCHEMAS:
+        raise ValueError(f'Tabela desconhecida: {table}')
+
+    conditions = []
+    params = []
+    if date_from is not None:
+        conditions.append('created_at >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append('created_at < ?')
+        params.append(date_to)
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    months = _months_for_range(date_from, date_to)
+    if len(months) > MAX_ATTACHED_ARCHIVES:
+        with _merged_records(db, table, columns, page_size, offset, where, params, months, tuples) as result:
+            yield result
+        return
+
+    with attached_archives(db, months) as aliases:
+        sources = ['main'] + aliases
+        count_sql = ' + '.join(f'(SELECT COUNT(1) FROM {src}.{table}{where})' for src in sources)
+        total = db.execute(f'SELECT {count_sql} AS c', params * len(sources)).fetchone()[0]
+
+        # ORDER BY created_at (sem datetime()) percorre o índice idx_<tabela>_summary
+        # em vez de ordenar a tabela inteira
+        if not aliases:
+            rows_sql = (
+                f'SELECT {columns} FROM {table}{where} '
+                'ORDER BY created_at DESC LIMIT ? OFFSET ?'
+            )
+            cursor = db.execute(rows_sql, params + [page_size, offset])
+        else:
+            # A união precisa de created_at para ordenar, mesmo que não tenha sido pedido
+            names = [name.strip() for name in columns.split(',')]
+            inner = columns if 'created_at' in names else f'{columns}, created_at'
+            union = ' UNION ALL '.join(f'SELECT {inner} FROM {src}.{table}{where}' for src in sources)
+            rows_sql = (
+                f'SELECT {columns} FROM ({union}) '
+                'ORDER BY created_at DESC LIMIT ? OFFSET ?'
+            )
+            cursor = db.execute(rows_sql, params * len(sources) + [page_size, offset])
+
+        # Colunas de texto livre comprimidas voltam como texto (só se projetadas)
+        unpack_cursor(cursor, table, columns, tuples)
+        try:
+            yield total, cursor
+        finally:
+            # Um statement pendente impediria o DETACH dos arquivos
+            cursor.close()
+
+
+class _MergedCursor:
+    """Linhas já intercaladas de vários lotes, com a interface de cursor usada pelas listagens"""
+
+    def __init__(self, rows, cursors):
+        self._rows = rows
+        self._cursors = cursors
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor.close()
+
+
+@contextmanager
+def _merged_records(db, table, columns, page_size, offset, where, params, months, tuples):
+    """
+    open_records para intervalos com mais de MAX_ATTACHED_ARCHIVES meses.
+
+    O primeiro lote usa a conexão do banco principal; cada lote seguinte,
+    uma conexão em memória só com os arquivos anexados. Cada lote devolve
+    as suas primeiras offset + page_size linhas em ordem e heapq.merge as
+    intercala por created_at (última coluna de cada linha).
+    """
+    batches = [months[start:start + MAX_ATTACHED_ARCHIVES]
+               for start in range(0, len(months), MAX_ATTACHED_ARCHIVES)]
+    inner = f'{columns}, created_at AS _order'
+    limit = offset + page_size
+    connections = []
+    cursors = []
+    total = 0
+    try:
+        with attached_archives(db, batches[0]) as first:
+            sources = [(db, ['main'] + first)]
+            for batch in batches[1:]:
+                extra = sqlite3.connect(':memory:', check_same_thread=False)
+                connections.append(extra)
+                for index, month in enumerate(batch):
+                    extra.execute(f'ATTACH DATABASE ? AS arch_{index}', (_archive_path(month),))
+                sources.append((extra, [f'arch_{index}' for index in range(len(batch))]))
+
+            for conn, aliases in sources:
+                counts = ' + '.join(f'(SELECT COUNT(1) FROM {src}.{table}{where})' for src in aliases)
+                total += conn.execute(f'SELECT {counts}', params * len(aliases)).fetchone()[0]
+                union = ' UNION ALL '.join(f'SELECT {inner} FROM {src}.{table}{where}' for src in aliases)
+                cursor = conn.execute(
+                    f'SELECT * FROM ({union}) ORDER BY _order DESC LIMIT ?', params * len(aliases) + [limit]
+                )
+                cursors.append(unpack_cursor(cursor, table, inner, tuples=True))
+
+            # Cursor só para dar nomes às colunas das linhas (sqlite3.Row)
+            names = db.execute(
+                'SELECT ' + ', '.join(f'NULL AS {name.strip()}' for name in columns.split(','))
+            )
+            cursors.append(names)
+            merged = islice(heapq.merge(*cursors[:-1], key=lambda row: row[-1], reverse=True),
+                            offset, limit)
+            if tuples:
+                rows = (row[:-1] for row in merged)
+            else:
+                rows = (sqlite3.Row(names, row[:-1]) for row in merged)
+            cursor = _MergedCursor(rows, cursors)
+            try:
+                yield total, cursor
+            finally:
+                cursor.close()
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def get_archived(table: str, record_id: int) -> Optional[dict]:
+    """
+    Busca um registro pelo id nos arquivos mensais (do mais recente ao mais antigo).
+
+    Retorna:
+        dict ou None: A linha arquivada, ou None se não estiver em nenhum arquivo
+    """
+    if table not in TABLE_SCHEMAS:
+        raise ValueError(f'Tabela desconhecida: {table}')
+    for month in reversed(list_archive_months()):
+        db = sqlite3.connect(f'file:{quote(_archive_path(month))}?mode=ro', uri=True)
+        try:
+            db.row_factory = sqlite3.Row
+            row = db.execute(f'SELECT * FROM {table} WHERE id = ?', (record_id,)).fetchone()
+        except sqlite3.OperationalError:
+            # Arquivo do mês sem esta tabela
+            row = None
+        finally:
+            db.close()
+        if row is not None:
+            return unpack_dict(table, dict(row))
+    return None
+
+
+def list_records(db, table, columns, page_size, offset, date_from=None, date_to=None):
+    """
+    Lista uma página de registros (ver open_records).
+
+    Retorna:
+        tuple: (total, rows)
+    """
+    with open_records(db, table, columns, page_size, offset, date_from, date_to) as (total, cursor):
+        return total, cursor.fetchall()
+
+
+def iter_records(table, columns, page_size, offset, date_from=None, date_to=None, tuples=False):
+    """
+    Gerador para respostas em streaming: produz o total e depois as linhas da página.
+
+    A conexão de leitura fica emprestada do pool enquanto o gerador é
+    consumido e é devolvida quando ele termina ou é fechado. O total sai
+    no primeiro next(), antes de qualquer linha.
+    """
+    with read_db(table) as db:
+        with open_records(db, table, columns, page_size, offset, date_from, date_to, tuples) as (total, cursor):
+            yield total
+            yield from cursor
+
+
+def archive_old_rows(max_age_days: Optional[int] = None) -> dict:
+    """
+    Move linhas antigas do banco principal para os arquivos mensais.
+
+    A cópia usa INSERT OR IGNORE (ids preservados) antes do DELETE, então
+    uma execução interrompida pode ser repetida sem perda nem duplicação.
+
+    Args:
+        max_age_days: Idade mínima em dias (padrão: STARKE_ARCHIVE_AFTER_DAYS)
+
+    Retorna:
+        dict: Data de corte e quantidade de linhas movidas por tabela e mês
+    """
+    days = ARCHIVE_AFTER_DAYS if max_age_days is None else int(max_age_days)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    os.makedirs(get_archive_dir(), exist_ok=True)
+
+    moved = {table: {} for table in TABLE_SCHEMAS}
+    for table in TABLE_SCHEMAS:
+        db = get_db(table)
+        try:
+            months = [
+                row[0] for row in db.execute(
+                    f'SELECT DISTINCT substr(created_at, 1, 7) FROM {table} WHERE created_at < ?',
+                    (cutoff,)
+                ).fetchall()
+            ]
+            for month in months:
+                predicate = 'created_at >= ? AND created_at < ? AND created_at < ?'
+                bounds = (month, _next_month(month), cutoff)
+                db.execute('ATTACH DATABASE ? AS arch', (_archive_path(month),))
+                try:
+                    create_tables(db, [table], schema='arch')
+                    db.execute(
+                        f'INSERT OR IGNORE INTO arch.{table} SELECT * FROM main.{table} WHERE {predicate}',
+                        bounds
+                    )
+                    # Linhas arquivadas não são exclusões para o feed de eventos, mas
+                    # saíram do banco principal: o delta (since=) e os backups
+                    # incrementais precisam vê-las (op='archive' no change_log)
+                    before = last_seq(db)
+                    cursor = db.execute(f'DELETE FROM main.{table} WHERE {predicate}', bounds)
+                    mark_archived(db, before)
+                    db.commit()
+                    moved[table][month] = cursor.rowcount
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.execute('DETACH DATABASE arch')
+        finally:
+            db.close()
+
+    return {'cutoff': cutoff, 'moved': moved}
@@ -0,0 +1,403 @@
+"""
+Backups incrementais a partir do change_log
+
+O backup completo (GET /api/db-admin/backup) é uma cópia do arquivo SQLite
+e traz o sync_token da posição do change_log no momento da cópia. Com
+GET /api/db-admin/backup?since=<token> sai um incremento só com o que
+mudou desde então: o estado atual das linhas inseridas/alteradas e os ids
+excluídos. O volume transferido acompanha a quantidade de alterações, não
+o tamanho do banco.
+
+Uma cadeia é a base seguida dos incrementos em ordem, cada um começando
+onde o anterior terminou ("from" == "to" do anterior). verify_chain()
+confere continuidade e checksums e aplica a cadeia em uma cópia em
+memória; restore_chain() faz o mesmo e restaura o resultado com
+restore_db().
+
+O módulo session/changeset do SQLite não é exposto pelo sqlite3 do
+Python, por isso os incrementos vêm do change_log mantido pelos triggers.
+Como no delta das listagens, um token anterior à compactação do log
+(horizon) não serve mais: é preciso um novo backup completo.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+from typing import Optional
+
+from _changes import (
+    SyncTokenExpired, encode_cursor, forget_since, horizon, last_seq, parse_cursor, table_label,
+)
+from _dal import columns as table_columns
+from _db import TABLE_SCHEMAS, database_files, init_db, read_db, restore_db, write_db
+from _packing import pack_values, unpack_cursor
+
+INCREMENT_FORMAT = 'starke-incremental'
+INCREMENT_VERSION = 1
+
+# Ids por statement (abaixo do limite de parâmetros do SQLite)
+_IDS_PER_QUERY = 500
+
+
+class BackupChainError(ValueError):
+    """Cadeia de backup inválida: incremento corrompido, fora de ordem ou de outro banco"""
+
+
+def _checksum(increment: dict) -> str:
+    """sha256 do incremento (sem o próprio checksum) em JSON canônico"""
+    body = {key: value for key, value in increment.items() if key != 'checksum'}
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _open_snapshot(data: bytes):
+    """Abre um backup (bytes do arquivo SQLite) como banco em memória"""
+    db = sqlite3.connect(':memory:')
+    if hasattr(db, 'deserialize'):
+        # Bytes 18/19 do cabeçalho = 2 (WAL): banco em memória não abre em modo WAL
+        if data[18:20] == b'\x02\x02':
+            data = bytearray(data)
+            data[18:20] = b'\x01\x01'
+        db.deserialize(data)
+        return db
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        source = sqlite3.connect(tmp_path)
+        try:
+            source.backup(db)
+        finally:
+            source.close()
+    finally:
+        os.remove(tmp_path)
+    return db
+
+
+def _serialize(db) -> bytes:
+    if hasattr(db, 'serialize'):
+        return db.serialize()
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            db.backup(target)
+        finally:
+            target.close()
+        with open(tmp_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(tmp_path)
+
+
+def snapshot_position(db) -> dict:
+    """
+    Posição do change_log gravada em um snapshot: {rótulo: seq}.
+
+    O backup do layout split guarda a posição de cada arquivo em
+    change_log_meta ('position:<rótulo>'); o do layout padrão é o próprio
+    arquivo, com o sqlite_sequence do change_log.
+    """
+    try:
+        rows = db.execute(
+            "SELECT name, value FROM change_log_meta WHERE name LIKE 'position:%'"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    if rows:
+        return {name.split(':', 1)[1]: value for name, value in rows}
+    return {'main': last_seq(db)}
+
+
+def backup_position(data: bytes) -> str:
+    """sync_token de um backup completo (ponto de partida do primeiro incremento)"""
+    db = _open_snapshot(data)
+    try:
+        return encode_cursor(snapshot_position(db))
+    finally:
+        db.close()
+
+
+def _table_changes(db, table: str, since: int) -> dict:
+    """Linhas atuais e ids excluídos de uma tabela desde `since` (na transação atual)"""
+    ids = [
+        row[0] for row in db.execute(
+            'SELECT DISTINCT record_id FROM change_log WHERE table_name = ? AND seq > ?',
+            (table, since)
+        ).fetchall()
+    ]
+    names = table_columns(table)
+    rows = {}
+    for start in range(0, len(ids), _IDS_PER_QUERY):
+        chunk = ids[start:start + _IDS_PER_QUERY]
+        cursor = db.execute(
+            f'SELECT {names} FROM {table} WHERE id IN ({", ".join("?" * len(chunk))})', chunk
+        )
+        # Incrementos levam o texto (JSON), não o valor comprimido
+        for row in unpack_cursor(cursor, table, names, tuples=True).fetchall():
+            rows[row[0]] = list(row)
+    return {
+        "columns": [name.strip() for name in names.split(',')],
+        "rows": [rows[record_id] for record_id in sorted(rows)],
+        "deleted": sorted(record_id for record_id in ids if record_id not in rows),
+    }
+
+
+def incremental_backup(since: str) -> dict:
+    """
+    Gera o incremento com as alterações desde o token `since`.
+
+    Cada arquivo de banco é lido em uma única transação, então o "to" do
+    incremento corresponde exatamente às linhas entregues.
+
+    Args:
+        since: sync_token do backup completo ou o "to" do incremento anterior
+
+    Retorna:
+        dict: {"format", "version", "from", "to", "created_at", "tables", "checksum"}
+
+    Raises:
+        ValueError: Se o token for inválido para o layout atual
+        SyncTokenExpired: Se o token for anterior à compactação do change_log
+    """
+    files = database_files()
+    positions = parse_cursor(since)
+    if positions is None or set(positions) != set(files):
+        raise ValueError('Token since inválido para este banco')
+
+    tables = {}
+    latest = {}
+    for label in files:
+        # Rótulo 'main' = banco principal; no layout split o rótulo é a tabela
+        with read_db(None if label == 'main' else label) as db:
+            db.execute('BEGIN')
+            try:
+                latest[label] = last_seq(db)
+                if positions[label] < horizon(db) or positions[label] > latest[label]:
+                    raise SyncTokenExpired('Token since expirado; faça um novo backup completo')
+                for table in TABLE_SCHEMAS:
+                    if table_label(table) == label:
+                        tables[table] = _table_changes(db, table, positions[label])
+            finally:
+                db.rollback()
+
+    increment = {
+        "format": INCREMENT_FORMAT,
+        "version": INCREMENT_VERSION,
+        "from": encode_cursor(positions),
+        "to": encode_cursor(latest),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "tables": tables,
+    }
+    increment["checksum"] = _checksum(increment)
+    return increment
+
+
+def _apply_increment(db, increment: dict) -> dict:
+    """Aplica as linhas/exclusões de um incremento (na transação do chamador)"""
+    counts = {}
+    for table, changes in increment['tables'].items():
+        if table not in TABLE_SCHEMAS:
+            raise BackupChainError(f'Tabela desconhecida no incremento: {table}')
+        names = changes['columns']
+        if names != [name.strip() for name in table_columns(table).split(',')]:
+            raise BackupChainError(f'Colunas de {table} não conferem com o schema atual')
+
+        deleted = changes['deleted']
+        for start in range(0, len(deleted), _IDS_PER_QUERY):
+            chunk = deleted[start:start + _IDS_PER_QUERY]
+            db.execute(f'DELETE FROM {table} WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+
+        updates = ', '.join(f'{name} = excluded.{name}' for name in names if name != 'id')
+        db.executemany(
+            f'''
+                INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})
+                ON CONFLICT (id) DO UPDATE SET {updates}
+            ''',
+            [pack_values(table, names, row) for row in changes['rows']]
+        )
+        counts[table] = {'rows': len(changes['rows']), 'deleted': len(deleted)}
+    return counts
+
+
+def _replay(base: bytes, increments: list):
+    """
+    Abre a base em memória e aplica os incrementos, conferindo a cadeia.
+
+    Retorna:
+        tuple: (conexão em memória, posição da base, posição final, resumo por incremento)
+
+    Raises:
+        BackupChainError: Se a base ou algum incremento não encaixar na cadeia
+    """
+    try:
+        db = _open_snapshot(base)
+        db.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    except sqlite3.Error as e:
+        raise BackupChainError(f'Backup base inválido: {e}') from e
+
+    try:
+        start = position = snapshot_position(db)
+        steps = []
+        for number, increment in enumerate(increments, 1):
+            if not isinstance(increment, dict) or increment.get('format') != INCREMENT_FORMAT:
+                raise BackupChainError(f'Incremento {number}: formato desconhecido')
+            if increment.get('version') != INCREMENT_VERSION:
+                raise BackupChainError(f'Incremento {number}: versão {increment.get("version")} não suportada')
+            if increment.get('checksum') != _checksum(increment):
+                raise BackupChainError(f'Incremento {number}: checksum não confere')
+            if not isinstance(increment.get('from'), str) or not isinstance(increment.get('to'), str):
+                raise BackupChainError(f'Incremento {number}: "from" e "to" devem ser strings')
+            begin, end = parse_cursor(increment['from']), parse_cursor(increment['to'])
+            if begin != position:
+                raise BackupChainError(
+                    f'Incremento {number} começa em {increment.get("from")}, '
+                    f'mas a cadeia está em {encode_cursor(position)}'
+                )
+            if end is None or set(end) != set(begin) or any(end[label] < begin[label] for label in begin):
+                raise BackupChainError(f'Incremento {number}: posição final inválida')
+            try:
+                with db:
+                    counts = _apply_increment(db, increment)
+            except (AttributeError, KeyError, TypeError, ValueError, sqlite3.Error) as e:
+                raise BackupChainError(f'Incremento {number}: {e}') from e
+            steps.append({
+                'from': increment['from'],
+                'to': increment['to'],
+                'created_at': increment.get('created_at'),
+                'tables': counts,
+            })
+            position = end
+    except Exception:
+        db.close()
+        raise
+    return db, start, position, steps
+
+
+def _table_digest(db, table: str) -> dict:
+    """Quantidade e sha256 das linhas de uma tabela (em ordem de id)"""
+    digest = hashlib.sha256()
+    count = 0
+    # Sobre o texto: o resultado independe de a linha estar comprimida ou não
+    cursor = db.execute(f'SELECT {table_columns(table)} FROM {table} ORDER BY id')
+    for row in unpack_cursor(cursor, table, table_columns(table), tuples=True):
+        digest.update(json.dumps(list(row), ensure_ascii=False).encode())
+        digest.update(b'\n')
+        count += 1
+    return {'count': count, 'sha256': digest.hexdigest()}
+
+
+def verify_chain(base: bytes, increments: list, compare: bool = False) -> dict:
+    """
+    Confere uma cadeia de backup sem tocar no banco.
+
+    Checa o formato, o checksum e a continuidade de cada incremento, aplica
+    a cadeia em memória e roda PRAGMA integrity_check no resultado.
+
+    Args:
+        base: Bytes do backup completo
+        increments: Incrementos em ordem (dicts de incremental_backup)
+        compare: Também compara quantidade/sha256 das linhas com o banco atual
+                 (uma tabela diferente torna a cadeia inválida)
+
+    Retorna:
+        dict: {"valid", "errors", "base", "position", "increments", "integrity", "tables"}
+    """
+    report = {'valid': False, 'errors': [], 'base': None, 'position': None, 'increments': []}
+    try:
+        db, start, position, steps = _replay(base, increments)
+    except BackupChainError as e:
+        report['errors'].append(str(e))
+        return report
+
+    try:
+        report['base'] = encode_cursor(start)
+        report['position'] = encode_cursor(position)
+        report['increments'] = steps
+        report['integrity'] = db.execute('PRAGMA integrity_check').fetchone()[0]
+        if report['integrity'] != 'ok':
+            report['errors'].append(f'integrity_check: {report["integrity"]}')
+        report['tables'] = {table: _table_digest(db, table) for table in TABLE_SCHEMAS}
+    finally:
+        db.close()
+
+    if compare:
+        for table, restored in report['tables'].items():
+            with read_db(table) as live_db:
+                live = _table_digest(live_db, table)
+            restored['matches_live'] = live == {'count': restored['count'], 'sha256': restored['sha256']}
+            if not restored['matches_live']:
+                restored['live'] = live
+                report['errors'].append(
+                    f'{table}: {restored["count"]} linhas restauradas não conferem com '
+                    f'as {live["count"]} do banco atual'
+                )
+
+    report['valid'] = not report['errors']
+    return report
+
+
+def build_snapshot(base: bytes, increments: list) -> bytes:
+    """Aplica a cadeia em memória e devolve o arquivo SQLite resultante (sem tocar no banco)"""
+    db, _, _, _ = _replay(base, increments)
+    try:
+        return _serialize(db)
+    finally:
+        db.close()
+
+
+def _reset_log_position(db, base_seq: int, seq: int):
+    """
+    Deixa o change_log restaurado na posição `seq`.
+
+    As entradas geradas pela reaplicação (após a base) não são as originais:
+    são removidas e o horizon vai para `seq`, então tokens since= anteriores
+    à restauração recebem 410 e o feed de eventos manda um reset.
+    """
+    forget_since(db, base_seq)
+    if not db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'change_log'", (seq,)).rowcount:
+        db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (seq,))
+    db.execute(
+        '''
+            INSERT INTO change_log_meta (name, value) VALUES ('horizon', ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        ''',
+        (seq,)
+    )
+
+
+def restore_chain(base: bytes, increments: Optional[list] = None) -> dict:
+    """
+    Restaura o banco a partir da base e de uma cadeia de incrementos.
+
+    A cadeia inteira é conferida e aplicada em memória antes de o banco
+    atual ser substituído: um incremento inválido não deixa o banco pela
+    metade.
+
+    Retorna:
+        dict: {"sync_token": posição restaurada, "increments": resumo por incremento}
+
+    Raises:
+        BackupChainError: Se a cadeia for inválida ou de outro layout
+        RuntimeError: Se a restauração do arquivo falhar
+    """
+    db, start, position, steps = _replay(base, increments or [])
+    try:
+        if steps and set(position) != set(database_files()):
+            raise BackupChainError('A cadeia foi gerada em outro layout de banco (STARKE_DB_SPLIT)')
+        data = _serialize(db)
+    finally:
+        db.close()
+
+    if not restore_db(data):
+        raise RuntimeError('Erro ao restaurar banco de dados')
+    if steps:
+        # Bases antigas podem não ter o change_log
+        init_db()
+        for label, seq in position.items():
+            with write_db(None if label == 'main' else label) as live_db:
+                _reset_log_position(live_db, start[label], seq)
+    return {'sync_token': encode_cursor(position), 'increments': steps}
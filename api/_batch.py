@@ -0,0 +1,195 @@
+"""
+Operações em lote (exclusão e atualização) para mensagens e orçamentos
+
+Cada lote roda em uma única transação de escrita (BEGIN IMMEDIATE), com
+um SELECT de existência, um DELETE/UPDATE e um SELECT final para o lote
+inteiro - em vez de um ciclo SELECT/escrita/commit por id. O resultado
+traz o status de cada id para que o admin saiba o que foi aplicado.
+"""
+import os
+from typing import Optional
+
+from _dal import TABLE_FIELDS, columns, field_values, missing_fields, stored_values
+from _packing import unpack_cursor
+
+# Quantidade máxima de ids/itens por lote
+MAX_BATCH_SIZE = int(os.getenv('STARKE_BATCH_MAX_SIZE', '1000'))
+
+# Ids por statement (bem abaixo do limite de variáveis do SQLite)
+_CHUNK_SIZE = 500
+
+
+class BatchError(ValueError):
+    """Corpo do lote inválido (lista vazia, ids inválidos, lote grande demais)"""
+
+
+def _chunks(values):
+    for start in range(0, len(values), _CHUNK_SIZE):
+        yield values[start:start + _CHUNK_SIZE]
+
+
+def _placeholders(count):
+    return ', '.join('?' * count)
+
+
+def _begin(db):
+    # Lock de escrita desde o primeiro SELECT: os ids vistos são os que serão alterados
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+
+
+def _check_size(count):
+    if not count:
+        raise BatchError('Lote vazio')
+    if count > MAX_BATCH_SIZE:
+        raise BatchError(f'Lote muito grande (máximo: {MAX_BATCH_SIZE})')
+
+
+def _as_id(value) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value > 0 else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip()) or None
+    return None
+
+
+def parse_ids(values) -> list:
+    """
+    Valida a lista de ids de um lote (sem repetições, na ordem recebida).
+
+    Raises:
+        BatchError: Se não for uma lista de inteiros positivos ou exceder MAX_BATCH_SIZE
+    """
+    if not isinstance(values, list):
+        raise BatchError("Campo 'ids' deve ser uma lista")
+    ids = []
+    seen = set()
+    for value in values:
+        record_id = _as_id(value)
+        if record_id is None:
+            raise BatchError(f'ID inválido: {value!r}')
+        if record_id not in seen:
+            seen.add(record_id)
+            ids.append(record_id)
+    _check_size(len(ids))
+    return ids
+
+
+def _existing_ids(db, table, ids) -> set:
+    existing = set()
+    for chunk in _chunks(ids):
+        rows = db.execute(
+            f'SELECT id FROM {table} WHERE id IN ({_placeholders(len(chunk))})', chunk
+        ).fetchall()
+        existing.update(row[0] for row in rows)
+    return existing
+
+
+def delete_ids(db, table: str, ids: list):
+    """
+    Exclui os ids informados em uma única transação.
+
+    Retorna:
+        tuple: (quantidade excluída, [{"id", "status": "deleted"|"not_found"}])
+    """
+    _begin(db)
+    existing = _existing_ids(db, table, ids)
+    targets = [record_id for record_id in ids if record_id in existing]
+    for chunk in _chunks(targets):
+        db.execute(f'DELETE FROM {table} WHERE id IN ({_placeholders(len(chunk))})', chunk)
+    results = [
+        {"id": record_id, "status": "deleted" if record_id in existing else "not_found"}
+        for record_id in ids
+    ]
+    return len(targets), results
+
+
+def delete_range(db, table: str, date_from: Optional[str], date_to: Optional[str]) -> int:
+    """
+    Exclui os registros do banco principal criados no intervalo [date_from, date_to).
+
+    Meses já arquivados não são alterados.
+
+    Raises:
+        BatchError: Se nenhum limite do intervalo for informado
+    """
+    conditions = []
+    params = []
+    if date_from is not None:
+        conditions.append('created_at >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append('created_at < ?')
+        params.append(date_to)
+    if not conditions:
+        raise BatchError("Informe 'ids' ou um intervalo com 'from'/'to'")
+    _begin(db)
+    cursor = db.execute(f'DELETE FROM {table} WHERE {" AND ".join(conditions)}', params)
+    return cursor.rowcount
+
+
+def update_items(db, table: str, items):
+    """
+    Atualiza vários registros (substituição completa, como o PUT por id).
+
+    Args:
+        db: Conexão de escrita
+        table: 'messages' ou 'budgets'
+        items: Lista de objetos com "id" e os campos
+
+    Retorna:
+        tuple: (quantidade atualizada, [{"id", "status", "item"|"error"}])
+
+    Raises:
+        BatchError: Se items não for uma lista válida ou exceder MAX_BATCH_SIZE
+    """
+    if not isinstance(items, list):
+        raise BatchError("Campo 'items' deve ser uma lista")
+    _check_size(len(items))
+
+    results = []
+    pending = {}
+    for item in items:
+        record_id = _as_id(item.get('id')) if isinstance(item, dict) else None
+        if record_id is None:
+            results.append({"id": item.get('id') if isinstance(item, dict) else None,
+                            "status": "invalid", "error": "ID inválido"})
+            continue
+        if record_id in pending:
+            results.append({"id": record_id, "status": "invalid", "error": "ID repetido no lote"})
+            continue
+        missing = missing_fields(table, item)
+        if missing:
+            results.append({"id": record_id, "status": "invalid",
+                            "error": f'Campos ausentes: {", ".join(missing)}'})
+            continue
+        pending[record_id] = stored_values(table, field_values(table, item))
+        results.append({"id": record_id, "status": "updated"})
+
+    _begin(db)
+    existing = _existing_ids(db, table, list(pending))
+    assignments = ', '.join(f'{field} = ?' for field in TABLE_FIELDS[table])
+    db.executemany(
+        f'UPDATE {table} SET {assignments} WHERE id = ?',
+        [values + (record_id,) for record_id, values in pending.items() if record_id in existing]
+    )
+
+    rows = {}
+    updated = [record_id for record_id in pending if record_id in existing]
+    for chunk in _chunks(updated):
+        cursor = db.execute(
+            f'SELECT {columns(table)} FROM {table} WHERE id IN ({_placeholders(len(chunk))})', chunk
+        )
+        for row in unpack_cursor(cursor, table, columns(table)).fetchall():
+            rows[row['id']] = dict(row)
+
+    for result in results:
+        if result['status'] != 'updated':
+            continue
+        if result['id'] in existing:
+            result['item'] = rows.get(result['id'], {"id": result['id']})
+        else:
+            result['status'] = 'not_found'
+    return len(updated), results
@@ -0,0 +1,515 @@
+"""
+Registro de alterações (change_log) e feed de eventos das tabelas
+
+Triggers em messages/budgets gravam cada INSERT/UPDATE/DELETE na tabela
+change_log do mesmo arquivo, com um número de sequência crescente (seq).
+
+O feed (ChangeFeed) tem uma única thread por processo que observa a
+assinatura dos arquivos do banco (mtime/tamanho do arquivo e do -wal e o
+contador de alterações do cabeçalho, ver _db._file_signature) e só consulta
+o change_log quando ela muda. Os clientes conectados em /api/events esperam
+em uma Condition: com o banco parado, nenhum deles faz consultas - só
+recebem um heartbeat a cada STARKE_EVENTS_HEARTBEAT_SECONDS.
+
+O id de cada evento é um cursor com a posição em cada arquivo
+(ex: "main:42" ou "messages:10,budgets:7" com STARKE_DB_SPLIT=1); enviado
+de volta em Last-Event-ID, retoma o stream sem perder alterações.
+
+O mesmo log atende a sincronização incremental (GET ...?since=<token>):
+delta() devolve o estado atual das linhas alteradas e os ids excluídos
+desde o token. compact() mantém só a alteração mais recente de cada
+registro e remove as mais antigas que STARKE_CHANGE_LOG_RETENTION_DAYS,
+avançando o "horizon" - tokens anteriores a ele precisam ressincronizar.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from _db import SPLIT_TABLES, _file_signature, database_files, read_db, write_db
+from _metrics import inc, set_gauge
+from _packing import unpack_cursor
+
+# Intervalo (segundos) entre verificações da assinatura dos arquivos
+POLL_SECONDS = float(os.getenv('STARKE_EVENTS_POLL_SECONDS', '0.5'))
+HEARTBEAT_SECONDS = float(os.getenv('STARKE_EVENTS_HEARTBEAT_SECONDS', '15'))
+# Duração máxima de um stream; o navegador reconecta sozinho com Last-Event-ID.
+# No Vercel fica abaixo do maxDuration das funções (vercel.json)
+MAX_STREAM_SECONDS = float(os.getenv(
+    'STARKE_EVENTS_MAX_SECONDS', '8' if os.getenv('VERCEL') else '300'
+))
+# Eventos mantidos em memória; clientes mais atrasados leem do change_log
+BUFFER_SIZE = int(os.getenv('STARKE_EVENTS_BUFFER_SIZE', '1000'))
+
+# Alterações mantidas no change_log (tokens since= mais antigos expiram)
+RETENTION_DAYS = float(os.getenv('STARKE_CHANGE_LOG_RETENTION_DAYS', '30'))
+# Intervalo mínimo (segundos) entre compactações automáticas
+COMPACT_INTERVAL_SECONDS = float(os.getenv('STARKE_CHANGE_LOG_COMPACT_SECONDS', '3600'))
+
+# Alterações lidas do banco por consulta
+_READ_LIMIT = 500
+
+_COMPACT_LOCK = threading.Lock()
+_LAST_COMPACT = {'at': 0.0}
+
+
+def last_seq(db) -> int:
+    """Maior seq já gravada no change_log da conexão (0 se vazio ou inexistente)"""
+    try:
+        row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def forget_since(db, seq: int):
+    """
+    Remove as alterações registradas após `seq` na transação atual.
+
+    Usado quando a escrita não representa alterações dos registros (ex: o
+    log reposicionado após restaurar uma cadeia de backup).
+    """
+    db.execute('DELETE FROM change_log WHERE seq > ?', (seq,))
+
+
+def mark_archived(db, seq: int):
+    """
+    Marca como op='archive' as exclusões registradas após `seq` na transação atual.
+
+    Usado pelo arquivamento: a linha saiu do banco principal, então o delta
+    (since=) e os backups incrementais a tratam como excluída, mas o feed de
+    eventos não a anuncia (não é uma exclusão para quem acompanha o painel).
+    """
+    db.execute("UPDATE change_log SET op = 'archive' WHERE seq > ? AND op = 'delete'", (seq,))
+
+
+def changes_since(db, seq: int, limit: int = _READ_LIMIT) -> list:
+    """Alterações com seq maior que `seq`, em ordem (sem as de arquivamento)"""
+    try:
+        rows = db.execute(
+            'SELECT seq, table_name, record_id, op, changed_at FROM change_log '
+            "WHERE seq > ? AND op != 'archive' ORDER BY seq LIMIT ?",
+            (seq, limit)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [
+        (row[0], {"table": row[1], "id": row[2], "op": row[3], "at": row[4]})
+        for row in rows
+    ]
+
+
+def encode_cursor(positions: dict) -> str:
+    """Cursor das posições por arquivo: "main:42" ou "messages:10,budgets:7\""""
+    return ','.join(f'{label}:{seq}' for label, seq in positions.items())
+
+
+def parse_cursor(token: Optional[str]) -> Optional[dict]:
+    """
+    Lê um cursor gerado por encode_cursor.
+
+    Retorna:
+        dict ou None: {rótulo: seq}, ou None se o token estiver vazio ou inválido
+    """
+    if not token:
+        return None
+    positions = {}
+    for part in token.split(','):
+        label, _, seq = part.strip().partition(':')
+        if not label or not seq.isdigit():
+            return None
+        positions[label] = int(seq)
+    return positions
+
+
+def table_label(table: str) -> str:
+    """Rótulo (ver database_files) do arquivo onde fica o change_log da tabela"""
+    return table if SPLIT_TABLES else 'main'
+
+
+# Sincronização incremental (since=) -------------------------------------------
+
+class SyncTokenExpired(ValueError):
+    """O token since= é anterior à compactação (ou o banco foi restaurado): é preciso ressincronizar"""
+
+
+def horizon(db) -> int:
+    """Menor seq ainda aceita em since= (as alterações anteriores foram compactadas)"""
+    try:
+        row = db.execute("SELECT value FROM change_log_meta WHERE name = 'horizon'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def sync_token(db, table: str) -> str:
+    """Token que representa o estado atual da tabela (para o próximo since=)"""
+    return encode_cursor({table_label(table): last_seq(db)})
+
+
+def parse_since(token: str, table: str) -> int:
+    """
+    Lê o token since= de uma tabela.
+
+    Aceita os tokens de sync_token e os ids dos eventos de /api/events.
+
+    Raises:
+        ValueError: Se o token for inválido
+    """
+    if token.isdigit():
+        return int(token)
+    positions = parse_cursor(token)
+    if positions is None or table_label(table) not in positions:
+        raise ValueError('Token since inválido')
+    return positions[table_label(table)]
+
+
+def delta(db, table: str, since: int, columns: str, limit: int) -> dict:
+    """
+    Linhas inseridas/alteradas e ids excluídos desde `since`.
+
+    Tudo é lido em uma única transação de leitura, então o sync_token
+    devolvido corresponde exatamente aos dados entregues. Várias alterações
+    do mesmo registro viram uma só (o estado atual da linha); linhas
+    movidas para o arquivo (op='archive') aparecem em "deleted".
+
+    Args:
+        db: Conexão de leitura
+        table: 'messages' ou 'budgets'
+        since: seq do último sync (ver parse_since)
+        columns: Colunas dos itens (string SQL, ver _dal.list_columns)
+        limit: Máximo de alterações consumidas por chamada
+
+    Retorna:
+        dict: {"items": [...], "deleted": [ids], "sync_token": str, "has_more": bool}
+
+    Raises:
+        SyncTokenExpired: Se `since` for anterior à compactação ou posterior ao banco atual
+    """
+    db.execute('BEGIN')
+    try:
+        latest = last_seq(db)
+        if since < horizon(db) or since > latest:
+            raise SyncTokenExpired('Token since expirado; recarregue a lista completa')
+        rows = db.execute(
+            'SELECT seq, record_id FROM change_log WHERE table_name = ? AND seq > ? ORDER BY seq LIMIT ?',
+            (table, since, limit + 1)
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        ids = list(dict.fromkeys(row[1] for row in rows))
+
+        items = {}
+        for start in range(0, len(ids), _READ_LIMIT):
+            chunk = ids[start:start + _READ_LIMIT]
+            cursor = db.execute(
+                f'SELECT {columns} FROM {table} WHERE id IN ({", ".join("?" * len(chunk))})', chunk
+            )
+            for row in unpack_cursor(cursor, table, columns).fetchall():
+                items[row['id']] = dict(row)
+    finally:
+        db.rollback()
+
+    # Sem mais páginas, o token avança até o fim do log (inclui alterações de outras tabelas)
+    position = rows[-1][0] if has_more else latest
+    return {
+        "items": [items[record_id] for record_id in ids if record_id in items],
+        "deleted": [record_id for record_id in ids if record_id not in items],
+        "sync_token": encode_cursor({table_label(table): position}),
+        "has_more": has_more,
+    }
+
+
+def compact(db, retention_days: Optional[float] = None) -> dict:
+    """
+    Compacta o change_log (na transação de escrita atual).
+
+    - Registros com várias alterações mantêm só a mais recente
+    - Alterações mais antigas que `retention_days` são removidas e o horizon
+      avança: tokens since= anteriores a ele recebem 410 (ressincronizar)
+
+    Retorna:
+        dict: Linhas removidas por etapa e o novo horizon
+    """
+    days = RETENTION_DAYS if retention_days is None else float(retention_days)
+    # Mesmo formato do default de changed_at ('%Y-%m-%dT%H:%M:%fZ')
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat(timespec='milliseconds')
+    cutoff = cutoff.replace('+00:00', 'Z')
+    collapsed = db.execute(
+        '''
+            DELETE FROM change_log WHERE seq NOT IN (
+                SELECT MAX(seq) FROM change_log GROUP BY table_name, record_id
+            )
+        '''
+    ).rowcount
+    expired_seq = db.execute(
+        'SELECT MAX(seq) FROM change_log WHERE changed_at < ?', (cutoff,)
+    ).fetchone()[0]
+    expired = 0
+    if expired_seq is not None:
+        expired = db.execute('DELETE FROM change_log WHERE seq <= ?', (expired_seq,)).rowcount
+        db.execute(
+            '''
+                INSERT INTO change_log_meta (name, value) VALUES ('horizon', ?)
+                ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+            ''',
+            (expired_seq,)
+        )
+    inc('starke_change_log_compacted_total', collapsed, step='collapsed')
+    inc('starke_change_log_compacted_total', expired, step='expired')
+    return {'collapsed': collapsed, 'expired': expired, 'horizon': horizon(db)}
+
+
+def _compact_in_background(table):
+    try:
+        # Transação própria, depois do commit de quem pediu a compactação
+        with write_db(table) as db:
+            compact(db)
+    except sqlite3.Error as e:
+        # Banco ainda sem change_log (ex: criado antes dos triggers)
+        if 'no such table' not in str(e):
+            inc('starke_change_log_compact_errors_total')
+
+
+def maybe_compact(table: Optional[str] = None):
+    """
+    Agenda compact() no máximo a cada STARKE_CHANGE_LOG_COMPACT_SECONDS por processo.
+
+    A compactação percorre o change_log inteiro: roda em uma thread, na
+    própria transação de escrita, para não prolongar a transação (nem a
+    latência) da requisição que a disparou.
+    """
+    now = time.time()
+    with _COMPACT_LOCK:
+        if now - _LAST_COMPACT['at'] < COMPACT_INTERVAL_SECONDS:
+            return
+        _LAST_COMPACT['at'] = now
+    threading.Thread(
+        target=_compact_in_background, args=(table,), name='change-log-compact', daemon=True
+    ).start()
+
+
+def _read_db(label):
+    # Rótulo 'main' = banco principal; no layout split o rótulo é a tabela
+    return read_db(None if label == 'main' else label)
+
+
+class ChangeFeed:
+    """Distribui as alterações do change_log para os streams abertos neste processo"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # (rótulo, seq, evento), em ordem de chegada
+        self._events = deque()
+        # Posição mais recente conhecida e posição anterior ao buffer, por arquivo
+        self._positions = None
+        self._floor = {}
+        self._signatures = {}
+        self._subscribers = 0
+        self._thread = None
+
+    # Leitura do banco --------------------------------------------------------
+    def _load(self):
+        positions = {}
+        for label, path in database_files().items():
+            self._signatures[label] = _file_signature(path)
+            if self._signatures[label] is None:
+                positions[label] = 0
+                continue
+            with _read_db(label) as db:
+                positions[label] = last_seq(db)
+        self._positions = positions
+        self._floor = dict(positions)
+
+    def _poll(self):
+        """
+        Consulta o change_log dos arquivos cuja assinatura mudou.
+
+        Retorna:
+            tuple: ([(rótulo, seq, evento)], {rótulo: nova posição}, {rótulo: posição após restore})
+        """
+        fresh = []
+        positions = {}
+        resets = {}
+        for label, path in database_files().items():
+            signature = _file_signature(path)
+            if signature is None or signature == self._signatures.get(label):
+                continue
+            self._signatures[label] = signature
+            seq = self._positions.get(label, 0)
+            with _read_db(label) as db:
+                latest = last_seq(db)
+                if latest < seq:
+                    # Banco restaurado: o change_log voltou no tempo
+                    resets[label] = seq = latest
+                while True:
+                    batch = changes_since(db, seq)
+                    fresh.extend((label, event_seq, event) for event_seq, event in batch)
+                    if len(batch) < _READ_LIMIT:
+                        break
+                    seq = batch[-1][0]
+            positions[label] = max(latest, seq)
+        return fresh, positions, resets
+
+    def _publish(self, fresh, positions, resets):
+        with self._cond:
+            for label, seq in resets.items():
+                # Descarta o buffer deste arquivo: os clientes recebem "reset"
+                self._events = deque(e for e in self._events if e[0] != label)
+                self._floor[label] = seq
+            for label, seq, event in fresh:
+                if len(self._events) >= BUFFER_SIZE:
+                    dropped = self._events.popleft()
+                    self._floor[dropped[0]] = dropped[1]
+                self._events.append((label, seq, event))
+            self._positions.update(positions)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            time.sleep(POLL_SECONDS)
+            with self._cond:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                changes = self._poll()
+            except sqlite3.Error:
+                inc('starke_events_poll_errors_total')
+                continue
+            if any(changes):
+                self._publish(*changes)
+
+    # Assinantes ----------------------------------------------------------------
+    def subscribe(self) -> dict:
+        """Registra um stream e retorna as posições atuais (inicia a thread se preciso)"""
+        with self._cond:
+            if self._thread is None:
+                # Sem thread, o buffer pode estar desatualizado: recomeça da posição atual
+                self._events.clear()
+                self._load()
+            self._subscribers += 1
+            set_gauge('starke_events_subscribers', self._subscribers)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='starke-events', daemon=True)
+                self._thread.start()
+            return dict(self._positions)
+
+    def positions(self) -> dict:
+        """Posições mais recentes conhecidas, por arquivo"""
+        with self._cond:
+            return dict(self._positions or {})
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+            set_gauge('starke_events_subscribers', self._subscribers)
+
+    def _pending(self, positions):
+        return [e for e in self._events if e[1] > positions.get(e[0], 0)]
+
+    def wait(self, positions: dict, timeout: float):
+        """
+        Alterações posteriores a `positions`, esperando até `timeout` segundos.
+
+        Retorna:
+            list ou None: [(rótulo, seq, evento)] (vazia no timeout), ou None
+                          se `positions` está à frente do banco (restore) ou
+                          antes do horizon da compactação e o cliente deve
+                          recarregar tudo
+        """
+        with self._cond:
+            behind = [label for label, seq in positions.items() if seq < self._floor.get(label, 0)]
+            ahead = any(seq > self._positions.get(label, 0) for label, seq in positions.items())
+            if ahead:
+                return None
+            if not behind:
+                self._cond.wait_for(lambda: self._pending(positions), timeout)
+                return self._pending(positions)
+        # Cliente mais atrasado que o buffer: lê direto do change_log
+        events = []
+        for label in behind:
+            with _read_db(label) as db:
+                if positions[label] < horizon(db):
+                    # Alterações já compactadas: só recarregando tudo
+                    return None
+                events.extend((label, seq, event) for seq, event in changes_since(db, positions[label]))
+        return events
+
+
+_FEED = ChangeFeed()
+
+
+def _reset_after_fork():
+    # A thread do feed do pai não existe no processo filho
+    global _FEED
+    _FEED = ChangeFeed()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_feed() -> ChangeFeed:
+    return _FEED
+
+
+def _sse(event: str, data, event_id: Optional[str] = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def event_stream(last_event_id: Optional[str] = None, max_seconds: Optional[float] = None):
+    """
+    Gera o corpo text/event-stream de /api/events.
+
+    Eventos:
+        ready: enviado na conexão, com o cursor atual
+        change: {"table", "id", "op": insert|update|delete, "at"}
+        reset: o banco foi restaurado (ou o cursor é anterior à compactação) -
+               o cliente deve recarregar as listas
+    Comentários ": ping" servem de heartbeat.
+
+    Args:
+        last_event_id: Header Last-Event-ID (retoma após esse cursor)
+        max_seconds: Duração máxima do stream (padrão: STARKE_EVENTS_MAX_SECONDS)
+    """
+    feed = get_feed()
+    current = feed.subscribe()
+    try:
+        positions = dict(current)
+        resumed = parse_cursor(last_event_id)
+        if resumed:
+            positions.update({label: seq for label, seq in resumed.items() if label in positions})
+        deadline = time.monotonic() + (MAX_STREAM_SECONDS if max_seconds is None else max_seconds)
+
+        yield b'retry: 2000\n\n'
+        yield _sse('ready', {"cursor": encode_cursor(positions)}, encode_cursor(positions))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = feed.wait(positions, min(HEARTBEAT_SECONDS, remaining))
+            if events is None:
+                positions = feed.positions()
+                yield _sse('reset', {}, encode_cursor(positions))
+                continue
+            if not events:
+                yield b': ping\n\n'
+                continue
+            chunk = bytearray()
+            for label, seq, event in events:
+                positions[label] = seq
+                chunk += _sse('change', event, encode_cursor(positions))
+            inc('starke_events_sent_total', len(events))
+            yield bytes(chunk)
+    finally:
+        feed.unsubscribe()
@@ -0,0 +1,404 @@
+"""
+Camada de acesso a dados de mensagens e orçamentos
+
+Compartilhada pelos handlers serverless (api/) e pelo app Flask (app.py).
+Cada escrita é um único statement:
+
+- insert: INSERT ... RETURNING <colunas>
+- update: UPDATE ... WHERE id = ? RETURNING <colunas> (None se o id não existe)
+- delete: DELETE ... WHERE id = ? (existência pelo rowcount)
+- patch: UPDATE só das colunas enviadas, com WHERE que ignora a linha se
+  nenhum valor mudou - nada é escrito no WAL quando o PATCH não altera nada
+
+Sem o SELECT de existência antes e o SELECT de releitura depois, o lock de
+escrita fica retido por menos tempo. Em builds do SQLite sem RETURNING
+(< 3.35) o insert/update relê a linha com um SELECT na mesma transação.
+
+O SQL de cada tabela é montado uma única vez, então o cache de statements
+do sqlite3 (por conexão, indexado pelo texto do SQL) reaproveita os
+statements preparados das conexões do pool.
+
+As colunas de texto livre (messages.message, budgets.details) passam por
+_packing.py: comprimidas na escrita quando STARKE_COLUMN_COMPRESSION está
+ativo e devolvidas como texto na leitura. compress_existing() comprime as
+linhas gravadas antes disso, em lotes pequenos.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from _changes import forget_since, last_seq, maybe_compact
+from _metrics import inc
+import _packing
+from _packing import pack, pack_values, unpack_dict
+
+# RETURNING existe a partir do SQLite 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Maior page_size aceito nas listagens (enviadas em streaming)
+MAX_PAGE_SIZE = int(os.getenv('STARKE_MAX_PAGE_SIZE', '5000'))
+
+# Campos graváveis de cada tabela, na ordem das colunas
+TABLE_FIELDS = {
+    'messages': ('name', 'email', 'subject', 'message'),
+    'budgets': ('name', 'email', 'phone', 'service', 'details', 'company', 'city'),
+}
+
+# Colunas de view=summary - todas cobertas pelo índice idx_<tabela>_summary
+SUMMARY_COLUMNS = {
+    'messages': ('id', 'name', 'email', 'subject', 'created_at'),
+    'budgets': ('id', 'name', 'email', 'service', 'city', 'created_at'),
+}
+
+# Campos que podem ficar vazios (gravados como '')
+OPTIONAL_FIELDS = {
+    'messages': (),
+    'budgets': ('company',),
+}
+
+
+def _check_table(table):
+    if table not in TABLE_FIELDS:
+        raise ValueError(f'Tabela desconhecida: {table}')
+
+
+@lru_cache(maxsize=None)
+def columns(table: str) -> str:
+    """Colunas retornadas ao cliente (string SQL: "id, ..., created_at")"""
+    _check_table(table)
+    return ', '.join(('id',) + TABLE_FIELDS[table] + ('created_at',))
+
+
+class FieldsError(ValueError):
+    """Parâmetro fields= ou view= inválido"""
+
+
+@lru_cache(maxsize=256)
+def list_columns(table: str, fields: Optional[str] = None, view: Optional[str] = None) -> str:
+    """
+    Colunas de uma listagem conforme os parâmetros fields= e view=.
+
+    Args:
+        table: 'messages' ou 'budgets'
+        fields: Lista separada por vírgulas (whitelist: colunas da tabela);
+                "id" é sempre incluído
+        view: 'summary' (colunas do índice de cobertura) ou 'full' (padrão)
+
+    Retorna:
+        str: Colunas em ordem canônica (string SQL), para que o mesmo
+             conjunto gere sempre o mesmo statement
+
+    Raises:
+        FieldsError: Se houver campos desconhecidos ou view inválida
+    """
+    _check_table(table)
+    if view not in (None, '', 'full', 'summary'):
+        raise FieldsError(f'view inválida: {view} (use summary ou full)')
+    allowed = ('id',) + TABLE_FIELDS[table] + ('created_at',)
+    if fields:
+        requested = {name.strip() for name in fields.split(',') if name.strip()}
+        unknown = sorted(requested.difference(allowed))
+        if unknown:
+            raise FieldsError(f'Campos desconhecidos: {", ".join(unknown)}')
+        return ', '.join(name for name in allowed if name == 'id' or name in requested)
+    if view == 'summary':
+        return ', '.join(SUMMARY_COLUMNS[table])
+    return columns(table)
+
+
+def required_fields(table: str) -> list:
+    """Campos obrigatórios (não vazios) em criações e substituições"""
+    _check_table(table)
+    return [field for field in TABLE_FIELDS[table] if field not in OPTIONAL_FIELDS[table]]
+
+
+def missing_fields(table: str, data: dict) -> list:
+    """Campos obrigatórios ausentes ou em branco no payload"""
+    return [field for field in required_fields(table) if not str(data.get(field) or '').strip()]
+
+
+def field_values(table: str, data: dict) -> tuple:
+    """Valores dos campos graváveis, sem espaços nas pontas, na ordem de TABLE_FIELDS"""
+    return tuple(str(data.get(field) or '').strip() for field in TABLE_FIELDS[table])
+
+
+@lru_cache(maxsize=None)
+def _sql(table: str, kind: str) -> str:
+    _check_table(table)
+    fields = TABLE_FIELDS[table]
+    returning = f' RETURNING {columns(table)}' if HAS_RETURNING else ''
+    if kind == 'insert':
+        names = ', '.join(fields + ('created_at',))
+        placeholders = ', '.join('?' * (len(fields) + 1))
+        return f'INSERT INTO {table} ({names}) VALUES ({placeholders}){returning}'
+    if kind == 'update':
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        return f'UPDATE {table} SET {assignments} WHERE id = ?{returning}'
+    if kind == 'delete':
+        return f'DELETE FROM {table} WHERE id = ?'
+    if kind == 'get':
+        return f'SELECT {columns(table)} FROM {table} WHERE id = ?'
+    raise ValueError(f'Statement desconhecido: {kind}')
+
+
+class PatchError(ValueError):
+    """Corpo do PATCH inválido (sem campos, campos desconhecidos ou obrigatórios vazios)"""
+
+
+@lru_cache(maxsize=256)
+def _patch_sql(table: str, fields: tuple) -> str:
+    # Um statement por combinação de colunas (no máximo 2^7 por tabela)
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    # Coluna comprimida: igual se bater com o valor comprimido ou com o texto
+    # (linha gravada antes da compressão)
+    changed = ' OR '.join(
+        f'({field} IS NOT ? AND {field} IS NOT ?)' if field in _packing.PACKED_FIELDS[table]
+        else f'{field} IS NOT ?'
+        for field in fields
+    )
+    returning = f' RETURNING {columns(table)}' if HAS_RETURNING else ''
+    return f'UPDATE {table} SET {assignments} WHERE id = ? AND ({changed}){returning}'
+
+
+def _row(cursor, table) -> Optional[dict]:
+    # fetchall() conclui o statement - necessário antes do commit
+    rows = cursor.fetchall()
+    return unpack_dict(table, dict(rows[0])) if rows else None
+
+
+def stored_values(table: str, values: tuple) -> tuple:
+    """Valores de field_values() como são gravados (colunas de texto livre comprimidas)"""
+    return pack_values(table, TABLE_FIELDS[table], values)
+
+
+def get(db, table: str, record_id: int) -> Optional[dict]:
+    """Busca um registro pelo id (None se não existir)"""
+    return _row(db.execute(_sql(table, 'get'), (record_id,)), table)
+
+
+def insert(db, table: str, data: dict) -> dict:
+    """
+    Insere um registro com os campos de `data` e created_at atual.
+
+    Retorna:
+        dict: A linha inserida (com id e created_at)
+    """
+    params = stored_values(table, field_values(table, data)) + (datetime.now(timezone.utc).isoformat(),)
+    cursor = db.execute(_sql(table, 'insert'), params)
+    if HAS_RETURNING:
+        row = _row(cursor, table)
+    else:
+        row = get(db, table, cursor.lastrowid) or {'id': cursor.lastrowid}
+    # Inserções são o que faz o change_log crescer: compacta de tempos em
+    # tempos (em outra thread e transação, ver _changes.maybe_compact)
+    maybe_compact(table)
+    return row
+
+
+def update(db, table: str, record_id: int, data: dict) -> Optional[dict]:
+    """
+    Substitui os campos graváveis de um registro.
+
+    Retorna:
+        dict ou None: A linha atualizada, ou None se o id não existir
+    """
+    cursor = db.execute(_sql(table, 'update'), stored_values(table, field_values(table, data)) + (record_id,))
+    if HAS_RETURNING:
+        return _row(cursor, table)
+    if cursor.rowcount == 0:
+        return None
+    return get(db, table, record_id)
+
+
+def delete(db, table: str, record_id: int) -> bool:
+    """Exclui um registro; retorna False se o id não existir"""
+    return db.execute(_sql(table, 'delete'), (record_id,)).rowcount > 0
+
+
+def patch_values(table: str, data: dict) -> dict:
+    """
+    Valida o corpo de um PATCH.
+
+    Retorna:
+        dict: Campos enviados e seus valores (sem espaços nas pontas), na ordem de TABLE_FIELDS
+
+    Raises:
+        PatchError: Se não houver campos, houver campos desconhecidos ou obrigatórios vazios
+    """
+    _check_table(table)
+    if not isinstance(data, dict):
+        raise PatchError('Corpo deve ser um objeto JSON')
+    unknown = [key for key in data if key not in TABLE_FIELDS[table]]
+    if unknown:
+        raise PatchError(f'Campos desconhecidos: {", ".join(unknown)}')
+    values = {
+        field: str(data[field] if data[field] is not None else '').strip()
+        for field in TABLE_FIELDS[table] if field in data
+    }
+    if not values:
+        raise PatchError('Nenhum campo para atualizar')
+    blank = [field for field, value in values.items()
+             if not value and field not in OPTIONAL_FIELDS[table]]
+    if blank:
+        raise PatchError(f'Campos obrigatórios vazios: {", ".join(blank)}')
+    return values
+
+
+def patch(db, table: str, record_id: int, values: dict):
+    """
+    Atualiza apenas as colunas em `values` (ver patch_values).
+
+    Se nenhum valor mudou, o UPDATE não casa com a linha e nada é escrito;
+    a linha atual é lida para distinguir "sem alteração" de "não encontrado".
+
+    Retorna:
+        tuple: (linha atual ou None se o id não existir, True se algo foi gravado)
+    """
+    fields = tuple(values)
+    stored = pack_values(table, fields, tuple(values.values()))
+    compare = []
+    for field, value, packed in zip(fields, values.values(), stored):
+        compare.extend((packed, value) if field in _packing.PACKED_FIELDS[table] else (value,))
+    params = stored + (record_id,) + tuple(compare)
+    cursor = db.execute(_patch_sql(table, fields), params)
+    if HAS_RETURNING:
+        row = _row(cursor, table)
+        if row is not None:
+            return row, True
+    elif cursor.rowcount:
+        return get(db, table, record_id), True
+    return get(db, table, record_id), False
+
+
+# Migração das linhas gravadas antes da compressão (ver compress_existing)
+COMPRESS_BATCH_SIZE = int(os.getenv('STARKE_COLUMN_COMPRESSION_BATCH', '200'))
+
+_BACKGROUND = {'thread': None}
+_BACKGROUND_LOCK = threading.Lock()
+
+
+class CompressionDisabled(ValueError):
+    """STARKE_COLUMN_COMPRESSION não está ativo"""
+
+
+def compress_batch(db, table: str, after_id: int = 0, batch_size: int = COMPRESS_BATCH_SIZE):
+    """
+    Comprime as colunas de texto livre de um lote de linhas ainda em TEXT.
+
+    Roda na transação de escrita do chamador (lock tomado antes da leitura).
+    Reescrever o mesmo conteúdo não é uma alteração para o feed de eventos
+    nem para o since=: o que os triggers registram aqui é descartado.
+
+    Retorna:
+        tuple: (linhas comprimidas, maior id examinado ou None se não há mais linhas)
+    """
+    _check_table(table)
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    packed_fields = _packing.PACKED_FIELDS[table]
+    names = ', '.join(packed_fields)
+    pending = ' OR '.join(
+        f"(typeof({field}) = 'text' AND length(CAST({field} AS BLOB)) >= ?)" for field in packed_fields
+    )
+    rows = db.execute(
+        f'SELECT id, {names} FROM {table} WHERE id > ? AND ({pending}) ORDER BY id LIMIT ?',
+        (after_id,) + (_packing.MIN_BYTES,) * len(packed_fields) + (batch_size,)
+    ).fetchall()
+    if not rows:
+        return 0, None
+
+    updates = []
+    for row in rows:
+        values = tuple(row)[1:]
+        packed = tuple(pack(value) for value in values)
+        if packed != values:
+            updates.append(packed + (row[0],) + values)
+    if updates:
+        assignments = ', '.join(f'{field} = ?' for field in packed_fields)
+        unchanged = ' AND '.join(f'{field} IS ?' for field in packed_fields)
+        before = last_seq(db)
+        db.executemany(f'UPDATE {table} SET {assignments} WHERE id = ? AND {unchanged}', updates)
+        forget_since(db, before)
+    return len(updates), rows[-1][0]
+
+
+def compress_existing(tables=None, batch_size: int = COMPRESS_BATCH_SIZE,
+                      max_seconds: Optional[float] = None, pause: float = 0.0) -> dict:
+    """
+    Comprime as linhas antigas em lotes pequenos, cada um na própria transação.
+
+    Entre os lotes o lock de escrita é liberado (e `pause` segundos de
+    espera), então requests de escrita seguem normalmente durante a migração.
+
+    Args:
+        tables: Tabelas a migrar (padrão: todas)
+        batch_size: Linhas examinadas por transação
+        max_seconds: Para após esse tempo (done=False); None roda até o fim
+        pause: Espera entre os lotes
+
+    Retorna:
+        dict: {tabela: {"compressed": n, "done": bool}}
+
+    Raises:
+        CompressionDisabled: Se STARKE_COLUMN_COMPRESSION não estiver ativo
+    """
+    from _db import write_db
+
+    if not _packing.ALGORITHM:
+        raise CompressionDisabled('Compressão de colunas desativada (STARKE_COLUMN_COMPRESSION)')
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    result = {}
+    for table in tables or TABLE_FIELDS:
+        compressed, after_id, done = 0, 0, False
+        while deadline is None or time.monotonic() < deadline:
+            with write_db(table) as db:
+                count, after_id = compress_batch(db, table, after_id, batch_size)
+            compressed += count
+            if count:
+                inc('starke_column_compression_migrated_total', count, table=table)
+            if after_id is None:
+                done = True
+                break
+            if pause:
+                time.sleep(pause)
+        result[table] = {'compressed': compressed, 'done': done}
+    return result
+
+
+def start_background_compression(pause: float = 0.05) -> bool:
+    """
+    Roda compress_existing() em uma thread deste processo (servidor local ou
+    pre-fork; em serverless a thread não sobrevive ao fim do request).
+
+    Retorna:
+        bool: False se a migração já estiver rodando neste processo
+
+    Raises:
+        CompressionDisabled: Se STARKE_COLUMN_COMPRESSION não estiver ativo
+    """
+    if not _packing.ALGORITHM:
+        raise CompressionDisabled('Compressão de colunas desativada (STARKE_COLUMN_COMPRESSION)')
+    with _BACKGROUND_LOCK:
+        thread = _BACKGROUND['thread']
+        if thread is not None and thread.is_alive():
+            return False
+        thread = threading.Thread(
+            target=compress_existing, kwargs={'pause': pause}, name='column-compression', daemon=True
+        )
+        _BACKGROUND['thread'] = thread
+        thread.start()
+    return True
+
+
+def compression_stats(db, table: str) -> dict:
+    """Linhas com as colunas de texto livre comprimidas (BLOB) e em texto"""
+    _check_table(table)
+    field = _packing.PACKED_FIELDS[table][0]
+    counts = dict(db.execute(
+        f"SELECT typeof({field}) = 'blob', COUNT(*) FROM {table} GROUP BY 1"
+    ).fetchall())
+    return {'compressed': counts.get(1, 0), 'plain': counts.get(0, 0)}
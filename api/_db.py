@@ -8,17 +8,98 @@ Estratégia:
 - Local: Usa database.sqlite3 na raiz do projeto
 - Vercel: Usa /tmp/database.sqlite3 (único diretório gravável em serverless)
 - Copia automaticamente o banco da raiz para /tmp na primeira execução (se existir)
+- STARKE_DB_PATH sobrescreve o caminho do banco principal
+
+Layout dos arquivos (STARKE_DB_SPLIT):
+- Padrão: todas as tabelas em um único arquivo (database.sqlite3)
+- STARKE_DB_SPLIT=1: cada tabela em seu próprio arquivo (messages.sqlite3,
+  budgets.sqlite3) no mesmo diretório - cada arquivo tem seu próprio lock de
+  escrita, então rajadas em uma tabela não enfileiram escritas na outra
+
+Checkpoints do WAL:
+- PASSIVE automático a cada N páginas (wal_autocheckpoint) e a cada T segundos
+  (verificado ao fechar conexões)
+- TRUNCATE em períodos ociosos, por uma thread em background
+- journal_size_limit limita o tamanho do arquivo -wal após cada checkpoint
+
+Pools de conexões (por arquivo de banco):
+- Leitura (read_db): conexões mode=ro + query_only, com cache e mmap maiores,
+  reaproveitadas entre requests - leitores nunca esperam por escritores
+- Escrita (write_db): pool pequeno e limitado de conexões de escrita
 """
 import sqlite3
 import os
 import shutil
+import threading
+import time
+from urllib.parse import quote
+from collections import deque
 from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import Optional
 
+from _metrics import inc, observe, set_gauge, timed
+
 # Cache do caminho do banco de dados (lazy initialization)
 _DB_PATH_CACHE: Optional[str] = None
+_TABLE_PATH_CACHE: dict = {}
 _DB_INITIALIZED = False
 
+DB_FILENAME = 'database.sqlite3'
+
+# Uma tabela por arquivo (desativado por padrão)
+SPLIT_TABLES = os.getenv('STARKE_DB_SPLIT', '0') == '1'
+
+# Log de consultas lentas (desativado por padrão)
+# STARKE_SLOW_QUERY_MS: limite em ms a partir do qual a consulta é registrada
+# STARKE_SLOW_QUERY_LOG_SIZE: quantidade de registros mantidos no buffer circular
+_SLOW_QUERY_THRESHOLD_MS: Optional[float] = None
+_SLOW_QUERY_LOG: deque = deque(maxlen=int(os.getenv('STARKE_SLOW_QUERY_LOG_SIZE', '200')))
+# Planos já capturados, por SQL (evita repetir EXPLAIN para o mesmo statement)
+_QUERY_PLAN_CACHE: dict = {}
+_QUERY_PLAN_CACHE_MAX = 256
+
+# Política de checkpoint do WAL
+# STARKE_WAL_AUTOCHECKPOINT_PAGES: checkpoint PASSIVE após N páginas no WAL
+# STARKE_WAL_CHECKPOINT_SECONDS: checkpoint PASSIVE se o último tiver mais de T segundos
+# STARKE_WAL_IDLE_SECONDS: checkpoint TRUNCATE após T segundos sem conexões (0 desativa)
+# STARKE_JOURNAL_SIZE_LIMIT: tamanho máximo (bytes) mantido pelo arquivo -wal
+_WAL_AUTOCHECKPOINT_PAGES = int(os.getenv('STARKE_WAL_AUTOCHECKPOINT_PAGES', '1000'))
+_WAL_CHECKPOINT_SECONDS = float(os.getenv('STARKE_WAL_CHECKPOINT_SECONDS', '30'))
+_WAL_IDLE_SECONDS = float(os.getenv('STARKE_WAL_IDLE_SECONDS', '60'))
+_JOURNAL_SIZE_LIMIT = int(os.getenv('STARKE_JOURNAL_SIZE_LIMIT', str(64 * 1024 * 1024)))
+
+_WAL_LOCK = threading.Lock()
+_WAL_STATE = {
+    'last_activity': time.monotonic(),
+    'active_connections': 0,
+}
+# Estado de checkpoint por arquivo de banco
+_WAL_FILES: dict = {}
+_IDLE_CHECKPOINTER: Optional[threading.Thread] = None
+
+# Pools de conexões
+# STARKE_DB_READERS: conexões de leitura mantidas abertas por arquivo
+# STARKE_DB_WRITERS: conexões de escrita simultâneas por arquivo
+# STARKE_DB_READ_CACHE_KB / STARKE_DB_READ_MMAP_BYTES: cache e mmap das conexões de leitura
+_READ_POOL_SIZE = int(os.getenv('STARKE_DB_READERS', '8'))
+_WRITE_POOL_SIZE = int(os.getenv('STARKE_DB_WRITERS', '2'))
+_READ_CACHE_KB = int(os.getenv('STARKE_DB_READ_CACHE_KB', '16384'))
+_READ_MMAP_BYTES = int(os.getenv('STARKE_DB_READ_MMAP_BYTES', str(64 * 1024 * 1024)))
+_POOL_ACQUIRE_TIMEOUT = 10.0
+_POOLS: dict = {}
+_POOLS_LOCK = threading.Lock()
+
+# Cache de get_db_info: recalculado só quando algum arquivo do banco muda
+_DB_INFO_LOCK = threading.Lock()
+_DB_INFO_CACHE = {'key': None, 'info': None, 'computed_at': 0.0}
+
+if os.getenv('STARKE_SLOW_QUERY_MS'):
+    try:
+        _SLOW_QUERY_THRESHOLD_MS = float(os.getenv('STARKE_SLOW_QUERY_MS'))
+    except ValueError:
+        _SLOW_QUERY_THRESHOLD_MS = None
+
 
 def _get_db_path():
     """
@@ -33,13 +114,13 @@ def _get_db_path():
     if _DB_PATH_CACHE is not None:
         return _DB_PATH_CACHE
     
-    try:
-        # Tenta localizar o banco na raiz do projeto
-        root_db = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.sqlite3')
-    except Exception:
-        root_db = None
+    if os.getenv('STARKE_DB_PATH'):
+        _DB_PATH_CACHE = os.getenv('STARKE_DB_PATH')
+        return _DB_PATH_CACHE
     
-    tmp_db = os.path.join('/tmp', 'database.sqlite3')
+    # Tenta localizar o banco na raiz do projeto
+    root_db = _root_path(DB_FILENAME)
+    tmp_db = os.path.join('/tmp', DB_FILENAME)
     
     # Ambiente local: usa banco na raiz se for gravável
     if root_db and os.path.exists(root_db):
@@ -65,15 +146,569 @@ def _get_db_path():
     return _DB_PATH_CACHE
 
 
+def _root_path(filename):
+    """Caminho de um arquivo de banco na raiz do projeto (ou None)"""
+    try:
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), filename)
+    except Exception:
+        return None
+
+
 def _ensure_db_path():
     """Garante que o caminho do banco está inicializado"""
     return _get_db_path()
 
 
-def get_db():
+def get_table_path(table: Optional[str] = None) -> str:
+    """
+    Retorna o arquivo de banco onde a tabela está armazenada.
+    
+    Args:
+        table: Nome da tabela (None para o banco principal)
+    
+    Retorna:
+        str: Caminho do arquivo (o banco principal, exceto com STARKE_DB_SPLIT=1)
+    """
+    main_path = _ensure_db_path()
+    if table is None or not SPLIT_TABLES:
+        return main_path
+    
+    path = _TABLE_PATH_CACHE.get(table)
+    if path is not None:
+        return path
+    
+    filename = f'{table}.sqlite3'
+    path = os.path.join(os.path.dirname(main_path), filename)
+    
+    # Mesma estratégia do banco principal: copia o arquivo da raiz para /tmp se existir
+    root_db = _root_path(filename)
+    if root_db and root_db != path and os.path.exists(root_db) and not os.path.exists(path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copy2(root_db, path)
+        except Exception:
+            pass
+    
+    _TABLE_PATH_CACHE[table] = path
+    return path
+
+
+def database_files() -> dict:
+    """
+    Arquivos de banco em uso, por rótulo.
+    
+    Retorna:
+        dict: {'main': caminho} no layout padrão, ou {tabela: caminho} com STARKE_DB_SPLIT=1
+    """
+    if not SPLIT_TABLES:
+        return {'main': _ensure_db_path()}
+    return {table: get_table_path(table) for table in TABLE_SCHEMAS}
+
+
+def _tables_by_path() -> dict:
+    """Agrupa as tabelas pelo arquivo onde ficam"""
+    groups = {}
+    for table in TABLE_SCHEMAS:
+        groups.setdefault(get_table_path(table), []).append(table)
+    return groups
+
+
+def _param_shape(value):
+    """Descreve um parâmetro pelo tipo/tamanho, sem expor o valor"""
+    if value is None:
+        return 'null'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def _params_shape(parameters):
+    if isinstance(parameters, dict):
+        return {key: _param_shape(value) for key, value in parameters.items()}
+    return [_param_shape(value) for value in parameters or ()]
+
+
+def _wal_file_state(path):
+    state = _WAL_FILES.get(path)
+    if state is None:
+        state = _WAL_FILES.setdefault(path, {
+            'last_checkpoint_at': time.time(),
+            'last_result': None,
+            'checkpoints': 0,
+        })
+    return state
+
+
+def _run_checkpoint(db, mode, path):
+    """Executa PRAGMA wal_checkpoint(mode) e registra o resultado"""
+    busy, log_frames, checkpointed = sqlite3.Connection.execute(
+        db, f'PRAGMA wal_checkpoint({mode})'
+    ).fetchone()
+    result = {
+        'mode': mode,
+        'busy': bool(busy),
+        'log_frames': log_frames,
+        'checkpointed_frames': checkpointed,
+        'at': datetime.now(timezone.utc).isoformat(),
+    }
+    with _WAL_LOCK:
+        state = _wal_file_state(path)
+        state['last_result'] = result
+        state['checkpoints'] += 1
+        if not busy:
+            state['last_checkpoint_at'] = time.time()
+    inc('starke_wal_checkpoints_total', mode=mode.lower(), busy=str(bool(busy)).lower())
+    return result
+
+
+def checkpoint(mode: str = 'PASSIVE', path: Optional[str] = None) -> dict:
+    """
+    Executa um checkpoint do WAL em um arquivo de banco.
+
+    Args:
+        mode: PASSIVE, FULL, RESTART ou TRUNCATE
+        path: Arquivo do banco (padrão: banco principal)
+
+    Retorna:
+        dict: Resultado (busy, frames no WAL e frames copiados para o banco)
+    """
+    mode = mode.upper()
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f'Modo de checkpoint inválido: {mode}')
+    path = path or _ensure_db_path()
+    # Sem busy timeout: se houver leitores/escritores ativos, retorna busy em vez de esperar
+    db = sqlite3.connect(path, timeout=0)
+    try:
+        return _run_checkpoint(db, mode, path)
+    finally:
+        sqlite3.Connection.close(db)
+
+
+def _idle_checkpoint_loop():
+    """Thread em background: faz TRUNCATE quando o processo fica ocioso"""
+    interval = max(_WAL_IDLE_SECONDS / 2, 1.0)
+    truncated_since_activity = False
+    while True:
+        time.sleep(interval)
+        with _WAL_LOCK:
+            idle_for = time.monotonic() - _WAL_STATE['last_activity']
+            active = _WAL_STATE['active_connections']
+        if active or idle_for < _WAL_IDLE_SECONDS:
+            truncated_since_activity = False
+            continue
+        if truncated_since_activity:
+            continue
+        truncated_since_activity = True
+        for path in database_files().values():
+            try:
+                wal_path = path + '-wal'
+                if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+                    result = checkpoint('TRUNCATE', path)
+                    if result['busy']:
+                        truncated_since_activity = False
+            except Exception:
+                pass
+
+
+def _start_idle_checkpointer():
+    global _IDLE_CHECKPOINTER
+    if _WAL_IDLE_SECONDS <= 0 or _IDLE_CHECKPOINTER is not None:
+        return
+    with _WAL_LOCK:
+        if _IDLE_CHECKPOINTER is not None:
+            return
+        _IDLE_CHECKPOINTER = threading.Thread(
+            target=_idle_checkpoint_loop, name='wal-idle-checkpoint', daemon=True
+        )
+        _IDLE_CHECKPOINTER.start()
+
+
+class _Connection(sqlite3.Connection):
+    """
+    Conexão padrão do módulo.
+
+    Ao fechar, dispara um checkpoint PASSIVE se o último tiver mais de
+    STARKE_WAL_CHECKPOINT_SECONDS (PASSIVE nunca espera por leitores).
+    """
+
+    _closed = False
+    _tracked = False
+    db_path = None
+    read_only = False
+
+    def maybe_checkpoint(self):
+        """Checkpoint PASSIVE se o último deste arquivo tiver mais de STARKE_WAL_CHECKPOINT_SECONDS"""
+        if self.read_only or not self.db_path or _WAL_CHECKPOINT_SECONDS <= 0 or self.in_transaction:
+            return
+        try:
+            if time.time() - _wal_file_state(self.db_path)['last_checkpoint_at'] >= _WAL_CHECKPOINT_SECONDS:
+                _run_checkpoint(self, 'PASSIVE', self.db_path)
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.maybe_checkpoint()
+        finally:
+            if self._tracked:
+                _track_activity(-1)
+            super().close()
+
+
+def _track_activity(delta):
+    """Conta conexões em uso (o checkpoint de ociosidade só roda quando chega a zero)"""
+    with _WAL_LOCK:
+        _WAL_STATE['active_connections'] += delta
+        _WAL_STATE['last_activity'] = time.monotonic()
+
+
+class _TracedConnection(_Connection):
+    """
+    Conexão que mede cada statement e registra os que passam do limite.
+
+    O tempo medido cobre preparação e primeiro passo da consulta - para
+    ORDER BY, COUNT e demais agregações é aí que o trabalho todo acontece.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        threshold = _SLOW_QUERY_THRESHOLD_MS
+        if threshold is not None and elapsed_ms >= threshold:
+            _record_slow_query(self, sql, parameters, elapsed_ms)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        threshold = _SLOW_QUERY_THRESHOLD_MS
+        if threshold is not None and elapsed_ms >= threshold:
+            _record_slow_query(self, sql, None, elapsed_ms)
+        return cursor
+
+
+def _query_plan(db, sql, parameters):
+    """Captura o EXPLAIN QUERY PLAN do statement (com cache por SQL)"""
+    plan = _QUERY_PLAN_CACHE.get(sql)
+    if plan is not None:
+        return plan
+    keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    if keyword not in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'):
+        return []
+    try:
+        rows = sqlite3.Connection.execute(db, 'EXPLAIN QUERY PLAN ' + sql, parameters or ()).fetchall()
+    except sqlite3.Error:
+        return []
+    # Cada linha: (id, parent, notused, detail) - monta a árvore com indentação
+    depth = {0: -1}
+    plan = []
+    for row in rows:
+        node_id, parent = row[0], row[1]
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node_id] + row[3])
+    if len(_QUERY_PLAN_CACHE) >= _QUERY_PLAN_CACHE_MAX:
+        _QUERY_PLAN_CACHE.clear()
+    _QUERY_PLAN_CACHE[sql] = plan
+    return plan
+
+
+def _record_slow_query(db, sql, parameters, elapsed_ms):
+    _SLOW_QUERY_LOG.append({
+        'sql': ' '.join(sql.split()),
+        'params': _params_shape(parameters) if parameters is not None else None,
+        'elapsed_ms': round(elapsed_ms, 3),
+        'plan': _query_plan(db, sql, parameters) if parameters is not None else [],
+        'at': datetime.now(timezone.utc).isoformat(),
+    })
+
+
+def enable_slow_query_log(threshold_ms: float = 100.0):
+    """
+    Ativa o log de consultas lentas para as próximas conexões.
+
+    Args:
+        threshold_ms: Duração mínima (ms) para que um statement seja registrado
+    """
+    global _SLOW_QUERY_THRESHOLD_MS
+    _SLOW_QUERY_THRESHOLD_MS = float(threshold_ms)
+
+
+def disable_slow_query_log():
+    """Desativa o log de consultas lentas (os registros existentes são mantidos)"""
+    global _SLOW_QUERY_THRESHOLD_MS
+    _SLOW_QUERY_THRESHOLD_MS = None
+
+
+def get_slow_queries(limit: int = 10) -> dict:
+    """
+    Retorna os statements mais lentos registrados, agrupados por SQL.
+
+    Args:
+        limit: Quantidade máxima de statements retornados
+
+    Retorna:
+        dict: Limite configurado e lista ordenada pelo pior tempo observado
+    """
+    grouped = {}
+    for entry in list(_SLOW_QUERY_LOG):
+        item = grouped.get(entry['sql'])
+        if item is None:
+            item = grouped[entry['sql']] = {
+                'sql': entry['sql'],
+                'count': 0,
+                'max_ms': 0.0,
+                'total_ms': 0.0,
+                'params': entry['params'],
+                'plan': entry['plan'],
+                'last_seen': entry['at'],
+            }
+        item['count'] += 1
+        item['total_ms'] = round(item['total_ms'] + entry['elapsed_ms'], 3)
+        if entry['elapsed_ms'] >= item['max_ms']:
+            item['max_ms'] = entry['elapsed_ms']
+            item['params'] = entry['params']
+            item['plan'] = entry['plan'] or item['plan']
+        item['last_seen'] = entry['at']
+
+    queries = sorted(grouped.values(), key=lambda q: q['max_ms'], reverse=True)
+    return {
+        'enabled': _SLOW_QUERY_THRESHOLD_MS is not None,
+        'threshold_ms': _SLOW_QUERY_THRESHOLD_MS,
+        'queries': queries[:max(limit, 0)],
+    }
+
+
+def _connect(path, pooled=False):
+    """Abre uma conexão configurada (row factory, pragmas e log de consultas lentas)"""
+    factory = _TracedConnection if _SLOW_QUERY_THRESHOLD_MS is not None else _Connection
+    db = sqlite3.connect(path, timeout=10.0, factory=factory, check_same_thread=not pooled)
+    db.db_path = path
+    if not pooled:
+        # Conexões de pool são contadas ao serem emprestadas, não ao serem abertas
+        db._tracked = True
+        _track_activity(1)
+    db.row_factory = sqlite3.Row
+    # Habilita foreign keys e otimizações
+    db.execute('PRAGMA foreign_keys = ON')
+    db.execute('PRAGMA journal_mode = WAL')  # Write-Ahead Logging para melhor performance
+    db.execute(f'PRAGMA wal_autocheckpoint = {_WAL_AUTOCHECKPOINT_PAGES:d}')
+    db.execute(f'PRAGMA journal_size_limit = {_JOURNAL_SIZE_LIMIT:d}')
+    _start_idle_checkpointer()
+    return db
+
+
+def _connect_readonly(path):
+    """Abre uma conexão somente leitura (mode=ro + query_only) para o pool de leitura"""
+    factory = _TracedConnection if _SLOW_QUERY_THRESHOLD_MS is not None else _Connection
+    db = sqlite3.connect(
+        f'file:{quote(path)}?mode=ro', uri=True, timeout=10.0,
+        factory=factory, check_same_thread=False
+    )
+    db.db_path = path
+    db.read_only = True
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA query_only = ON')
+    db.execute(f'PRAGMA cache_size = -{_READ_CACHE_KB:d}')
+    db.execute(f'PRAGMA mmap_size = {_READ_MMAP_BYTES:d}')
+    _start_idle_checkpointer()
+    return db
+
+
+class _ConnectionPool:
+    """
+    Pool de conexões de um arquivo de banco para uma "lane" (read ou write).
+    
+    A lane de leitura não tem limite de conexões abertas (leitores nunca
+    esperam); a de escrita é limitada a STARKE_DB_WRITERS conexões simultâneas.
+    """
+    
+    def __init__(self, path, lane, max_idle, max_open=None):
+        self.path = path
+        self.lane = lane
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_open) if max_open else None
+    
+    def acquire(self):
+        start = time.perf_counter()
+        if self._slots is not None and not self._slots.acquire(timeout=_POOL_ACQUIRE_TIMEOUT):
+            inc('starke_db_pool_timeouts_total', lane=self.lane)
+            raise sqlite3.OperationalError(f'Pool de conexões ({self.lane}) esgotado')
+        try:
+            with self._lock:
+                db = self._idle.pop() if self._idle else None
+            if db is None:
+                db = _connect_readonly(self.path) if self.lane == 'read' else _connect(self.path, pooled=True)
+                inc('starke_db_pool_connections_total', lane=self.lane, source='opened')
+            else:
+                inc('starke_db_pool_connections_total', lane=self.lane, source='reused')
+        except Exception:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        observe('starke_db_acquire_seconds', time.perf_counter() - start, lane=self.lane)
+        _track_activity(1)
+        return db
+    
+    def release(self, db, discard=False):
+        try:
+            if db.in_transaction:
+                db.rollback()
+            db.maybe_checkpoint()
+        except sqlite3.Error:
+            discard = True
+        with self._lock:
+            if not discard and len(self._idle) < self.max_idle:
+                self._idle.append(db)
+                db = None
+            idle = len(self._idle)
+        if db is not None:
+            db.close()
+        if self._slots is not None:
+            self._slots.release()
+        _track_activity(-1)
+        set_gauge('starke_db_pool_idle_connections', idle, lane=self.lane)
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            try:
+                db.close()
+            except sqlite3.Error:
+                pass
+
+
+def _get_pool(path, lane):
+    pool = _POOLS.get((path, lane))
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get((path, lane))
+            if pool is None:
+                if lane == 'read':
+                    pool = _ConnectionPool(path, lane, _READ_POOL_SIZE)
+                else:
+                    pool = _ConnectionPool(path, lane, _WRITE_POOL_SIZE, max_open=_WRITE_POOL_SIZE)
+                _POOLS[(path, lane)] = pool
+    return pool
+
+
+def close_pools():
+    """Fecha as conexões ociosas de todos os pools (ex: após restore ou fork)"""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def warm_pools(readers: int = 2):
+    """
+    Abre as conexões dos pools antes do primeiro request (ex: em cada worker
+    do servidor pre-fork): `readers` de leitura e uma de escrita por arquivo.
+    """
+    init_db()
+    for path in _tables_by_path():
+        pool = _get_pool(path, 'read')
+        held = [pool.acquire() for _ in range(max(min(readers, _READ_POOL_SIZE), 0))]
+        for db in held:
+            pool.release(db)
+        pool = _get_pool(path, 'write')
+        pool.release(pool.acquire())
+
+
+# Pools herdados de um fork: mantidos referenciados para que o coletor de
+# lixo nunca feche no filho uma conexão aberta pelo pai
+_INHERITED_POOLS: list = []
+
+
+def _reset_after_fork():
+    """
+    Processo filho de um fork (ex: workers do servidor pre-fork com --preload).
+
+    Conexões SQLite não podem ser usadas em outro processo e as threads do
+    pai não existem no filho: cada processo abre os próprios pools e, se
+    precisar, a própria thread de checkpoint.
+    """
+    global _POOLS, _POOLS_LOCK, _WAL_LOCK, _DB_INFO_LOCK, _IDLE_CHECKPOINTER
+    _INHERITED_POOLS.append(_POOLS)
+    _POOLS = {}
+    _POOLS_LOCK = threading.Lock()
+    _WAL_LOCK = threading.Lock()
+    _DB_INFO_LOCK = threading.Lock()
+    _WAL_STATE['active_connections'] = 0
+    _IDLE_CHECKPOINTER = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def read_db(table: Optional[str] = None):
+    """
+    Empresta uma conexão somente leitura do pool (lane de leitura).
+    
+    Uso:
+        with read_db('messages') as db:
+            rows = db.execute('SELECT ...').fetchall()
+    
+    Args:
+        table: Tabela que será lida (ver get_db)
+    """
+    pool = _get_pool(get_table_path(table), 'read')
+    db = pool.acquire()
+    discard = False
+    try:
+        yield db
+    except sqlite3.Error:
+        discard = True
+        raise
+    finally:
+        pool.release(db, discard)
+
+
+@contextmanager
+def write_db(table: Optional[str] = None):
+    """
+    Empresta uma conexão de escrita do pool. Commit automático em caso de
+    sucesso e rollback em caso de erro (como get_db_context).
+    
+    Args:
+        table: Tabela que será escrita (ver get_db)
+    """
+    pool = _get_pool(get_table_path(table), 'write')
+    db = pool.acquire()
+    discard = False
+    try:
+        yield db
+        db.commit()
+    except BaseException as e:
+        try:
+            db.rollback()
+        except sqlite3.Error:
+            discard = True
+        if isinstance(e, sqlite3.Error):
+            discard = True
+        raise
+    finally:
+        pool.release(db, discard)
+
+
+def get_db(table: Optional[str] = None):
     """
     Obtém uma conexão com o banco de dados.
     
+    Args:
+        table: Tabela que será usada - com STARKE_DB_SPLIT=1 a conexão é aberta
+               no arquivo dessa tabela (padrão: banco principal)
+    
     IMPORTANTE: Sempre feche a conexão após usar:
         db = get_db()
         try:
@@ -89,17 +724,12 @@ def get_db():
     Retorna:
         sqlite3.Connection: Conexão com o banco de dados
     """
-    path = _ensure_db_path()
-    db = sqlite3.connect(path, timeout=10.0)
-    db.row_factory = sqlite3.Row
-    # Habilita foreign keys e otimizações
-    db.execute('PRAGMA foreign_keys = ON')
-    db.execute('PRAGMA journal_mode = WAL')  # Write-Ahead Logging para melhor performance
-    return db
+    path = get_table_path(table)
+    return _connect(path)
 
 
 @contextmanager
-def get_db_context():
+def get_db_context(table: Optional[str] = None):
     """
     Context manager para obter conexão com o banco de dados.
     Faz commit automático em caso de sucesso e rollback em caso de erro.
@@ -110,17 +740,16 @@ def get_db_context():
             results = cursor.fetchall()
             # Commit automático ao sair do bloco
     
+    Args:
+        table: Tabela que será usada (ver get_db)
+    
     Retorna:
         sqlite3.Connection: Conexão com o banco de dados
     """
-    path = _ensure_db_path()
+    path = get_table_path(table)
     db = None
     try:
-        db = sqlite3.connect(path, timeout=10.0)
-        db.row_factory = sqlite3.Row
-        # Habilita foreign keys e otimizações
-        db.execute('PRAGMA foreign_keys = ON')
-        db.execute('PRAGMA journal_mode = WAL')  # Write-Ahead Logging para melhor performance
+        db = _connect(path)
         yield db
         db.commit()
     except sqlite3.Error as e:
@@ -132,19 +761,11 @@ def get_db_context():
             db.close()
 
 
-def init_db():
-    """
-    Inicializa o banco de dados criando as tabelas necessárias se não existirem.
-    """
-    global _DB_INITIALIZED
-    
-    # Evita re-inicialização desnecessária
-    path = _ensure_db_path()
-    
-    with get_db_context() as db:
-        # Cria tabela de mensagens
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
+# DDL de cada tabela - {schema} permite criar a mesma estrutura em bancos anexados
+TABLE_SCHEMAS = {
+    'messages': (
+        '''
+            CREATE TABLE IF NOT EXISTS {schema}.messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 email TEXT NOT NULL,
@@ -152,17 +773,18 @@ def init_db():
                 message TEXT NOT NULL,
                 created_at TEXT NOT NULL
             )
-        ''')
-        
-        # Cria índice para melhor performance em consultas
-        db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_messages_created_at 
-            ON messages(created_at DESC)
-        ''')
-        
-        # Cria tabela de orçamentos
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS budgets (
+        ''',
+        # Índice de cobertura da listagem: ordena por created_at e atende
+        # view=summary sem ler as linhas (substitui idx_messages_created_at)
+        '''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_messages_summary
+            ON messages(created_at DESC, name, email, subject)
+        ''',
+        'DROP INDEX IF EXISTS {schema}.idx_messages_created_at',
+    ),
+    'budgets': (
+        '''
+            CREATE TABLE IF NOT EXISTS {schema}.budgets (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 email TEXT NOT NULL,
@@ -173,13 +795,99 @@ def init_db():
                 city TEXT NOT NULL,
                 created_at TEXT NOT NULL
             )
-        ''')
-        
-        # Cria índice para melhor performance
-        db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_budgets_created_at 
-            ON budgets(created_at DESC)
-        ''')
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_budgets_summary
+            ON budgets(created_at DESC, name, email, service, city)
+        ''',
+        'DROP INDEX IF EXISTS {schema}.idx_budgets_created_at',
+    ),
+}
+
+
+# Registro de alterações (ver api/_changes.py): só no banco principal, nunca
+# nos arquivos mensais do arquivamento
+CHANGE_LOG_SCHEMA = (
+    '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+        )
+    ''',
+    # Consultas since= de uma tabela: (table_name, seq) percorre só as linhas dela
+    '''
+        CREATE INDEX IF NOT EXISTS idx_change_log_table_seq
+        ON change_log(table_name, seq)
+    ''',
+    # Estado da compactação (ex: horizon = menor token ainda aceito)
+    '''
+        CREATE TABLE IF NOT EXISTS change_log_meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''',
+)
+
+_CHANGE_LOG_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_log AFTER {event} ON {table}
+    BEGIN
+        INSERT INTO change_log (table_name, record_id, op) VALUES ('{table}', {row}.id, '{op}');
+    END
+'''
+
+_CHANGE_LOG_EVENTS = (('insert', 'INSERT', 'NEW'), ('update', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD'))
+
+
+def create_change_log(db, tables=None):
+    """Cria o change_log e os triggers que registram INSERT/UPDATE/DELETE das tabelas"""
+    for statement in CHANGE_LOG_SCHEMA:
+        db.execute(statement)
+    for table in tables or TABLE_SCHEMAS:
+        for op, event, row in _CHANGE_LOG_EVENTS:
+            db.execute(_CHANGE_LOG_TRIGGER.format(table=table, op=op, event=event, row=row))
+
+
+def create_tables(db, tables=None, schema: str = 'main'):
+    """
+    Cria as tabelas (e índices) informadas no schema indicado.
+    
+    Args:
+        db: Conexão aberta
+        tables: Nomes das tabelas (padrão: todas)
+        schema: Nome do banco ('main' ou um alias de ATTACH)
+    """
+    for table in tables or TABLE_SCHEMAS:
+        for statement in TABLE_SCHEMAS[table]:
+            db.execute(statement.format(schema=schema))
+
+
+@timed('schema')
+def init_db(force: bool = False):
+    """
+    Inicializa o banco de dados criando as tabelas necessárias se não existirem.
+    
+    Args:
+        force: Executa o DDL mesmo se este processo já tiver inicializado o banco
+    """
+    global _DB_INITIALIZED
+    
+    # Evita re-inicialização desnecessária
+    files = _tables_by_path()
+    if _DB_INITIALIZED and not force and all(os.path.exists(p) for p in files):
+        return
+    
+    # Cria tabelas de mensagens e orçamentos, cada uma no arquivo onde fica
+    for table_path, tables in files.items():
+        db = _connect(table_path)
+        try:
+            create_tables(db, tables)
+            create_change_log(db, tables)
+            db.commit()
+        finally:
+            db.close()
     
     _DB_INITIALIZED = True
 
@@ -192,17 +900,111 @@ def backup_db() -> Optional[bytes]:
         bytes: Conteúdo do arquivo de backup, ou None em caso de erro
     """
     try:
+        if SPLIT_TABLES:
+            return _backup_split()
+        
         path = _ensure_db_path()
         if not os.path.exists(path):
             return None
         
-        # Lê o arquivo inteiro
-        with open(path, 'rb') as f:
-            return f.read()
+        # Lê um snapshot consistente pela própria SQLite - ler o arquivo
+        # diretamente ignoraria as páginas que ainda estão no -wal
+        db = sqlite3.connect(path, timeout=10.0)
+        try:
+            if hasattr(db, 'serialize'):
+                return db.serialize()
+            return _dump_to_bytes(db)
+        finally:
+            db.close()
     except Exception:
         return None
 
 
+def _backup_split() -> Optional[bytes]:
+    """
+    Backup no layout de um arquivo por tabela.
+    
+    Junta as tabelas em um único banco SQLite (mesmo formato do backup
+    padrão), copiando cada tabela a partir do seu arquivo. A posição do
+    change_log de cada arquivo fica em change_log_meta ('position:<tabela>'),
+    ponto de partida dos backups incrementais (ver api/_backup.py).
+    """
+    files = _tables_by_path()
+    if not any(os.path.exists(path) for path in files):
+        return None
+    
+    snapshot = sqlite3.connect(':memory:')
+    try:
+        create_tables(snapshot)
+        snapshot.execute(CHANGE_LOG_SCHEMA[2])
+        for path, tables in files.items():
+            if not os.path.exists(path):
+                continue
+            snapshot.execute('ATTACH DATABASE ? AS src', (path,))
+            try:
+                # Mesma transação de leitura para as linhas e a posição do log
+                snapshot.execute('BEGIN')
+                try:
+                    row = snapshot.execute(
+                        "SELECT seq FROM src.sqlite_sequence WHERE name = 'change_log'"
+                    ).fetchone()
+                except sqlite3.OperationalError:
+                    row = None
+                for table in tables:
+                    snapshot.execute(f'INSERT INTO main.{table} SELECT * FROM src.{table}')
+                    snapshot.execute(
+                        'INSERT INTO change_log_meta (name, value) VALUES (?, ?)',
+                        (f'position:{table}', row[0] if row else 0)
+                    )
+                snapshot.commit()
+            finally:
+                snapshot.execute('DETACH DATABASE src')
+        if hasattr(snapshot, 'serialize'):
+            return snapshot.serialize()
+        return _dump_to_bytes(snapshot)
+    finally:
+        snapshot.close()
+
+
+def _restore_split(backup_path: str):
+    """Distribui as tabelas de um backup para os arquivos de cada tabela"""
+    for path, tables in _tables_by_path().items():
+        db = _connect(path)
+        try:
+            create_tables(db, tables)
+            db.commit()
+            db.execute('ATTACH DATABASE ? AS src', (backup_path,))
+            try:
+                for table in tables:
+                    db.execute(f'DELETE FROM main.{table}')
+                    db.execute(f'INSERT INTO main.{table} SELECT * FROM src.{table}')
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.execute('DETACH DATABASE src')
+        finally:
+            db.close()
+
+
+def _dump_to_bytes(db) -> bytes:
+    """Fallback para Pythons sem Connection.serialize: backup para arquivo temporário"""
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            db.backup(target)
+        finally:
+            target.close()
+        with open(tmp_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(tmp_path)
+
+
 def restore_db(backup_data: bytes) -> bool:
     """
     Restaura o banco de dados a partir de um backup.
@@ -214,11 +1016,22 @@ def restore_db(backup_data: bytes) -> bool:
         bool: True se a restauração foi bem-sucedida, False caso contrário
     """
     try:
+        if SPLIT_TABLES:
+            return _restore_split_from_bytes(backup_data)
+        
         path = _ensure_db_path()
         
+        # Conexões de pool apontam para o arquivo antigo
+        close_pools()
+        
         # Garante que o diretório existe
         os.makedirs(os.path.dirname(path), exist_ok=True)
         
+        # Remove -wal/-shm antigos: seriam reaplicados sobre o arquivo novo
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        
         # Escreve o backup
         with open(path, 'wb') as f:
             f.write(backup_data)
@@ -229,42 +1042,208 @@ def restore_db(backup_data: bytes) -> bool:
         db.close()
         
         # Limpa o cache para forçar recálculo do caminho
-        global _DB_PATH_CACHE
+        global _DB_PATH_CACHE, _DB_INITIALIZED
         _DB_PATH_CACHE = None
+        _DB_INITIALIZED = False
+        _TABLE_PATH_CACHE.clear()
         
         return True
     except Exception:
         return False
 
 
-def get_db_info() -> dict:
+def _restore_split_from_bytes(backup_data: bytes) -> bool:
+    """Valida o backup em um arquivo temporário e copia cada tabela para o seu arquivo"""
+    import tempfile
+    directory = os.path.dirname(_ensure_db_path())
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(backup_data)
+        db = sqlite3.connect(tmp_path)
+        try:
+            if db.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+                return False
+        finally:
+            db.close()
+        _restore_split(tmp_path)
+        return True
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+
+
+def get_wal_info(deep: bool = False, path: Optional[str] = None) -> dict:
+    """
+    Retorna o estado do WAL: tamanho do arquivo -wal e atraso do checkpoint.
+    
+    Args:
+        deep: Se True, executa um checkpoint PASSIVE para medir quantos
+              frames ainda não puderam ser copiados para o banco
+        path: Arquivo do banco (padrão: banco principal)
+    
+    Retorna:
+        dict: Tamanho do WAL, política configurada e último checkpoint
+    """
+    path = path or _ensure_db_path()
+    wal_path = path + '-wal'
+    with _WAL_LOCK:
+        state = dict(_wal_file_state(path))
+    info = {
+        'wal_size': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'seconds_since_checkpoint': round(time.time() - state['last_checkpoint_at'], 3),
+        'checkpoints': state['checkpoints'],
+        'last_checkpoint': state['last_result'],
+        'policy': {
+            'autocheckpoint_pages': _WAL_AUTOCHECKPOINT_PAGES,
+            'checkpoint_seconds': _WAL_CHECKPOINT_SECONDS,
+            'idle_truncate_seconds': _WAL_IDLE_SECONDS,
+            'journal_size_limit': _JOURNAL_SIZE_LIMIT,
+        },
+    }
+    if deep and os.path.exists(path):
+        result = checkpoint('PASSIVE', path)
+        info['checkpoint_lag_frames'] = max(result['log_frames'] - result['checkpointed_frames'], 0)
+        info['wal_size'] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    return info
+
+
+def get_wal_status(deep: bool = False) -> dict:
+    """Estado do WAL de cada arquivo de banco em uso (ver database_files)"""
+    return {label: get_wal_info(deep, path) for label, path in database_files().items()}
+
+
+def _file_signature(path: str):
+    """
+    Assinatura barata de um arquivo de banco: mtime/tamanho do arquivo e do
+    -wal e o contador de alterações do cabeçalho (offset 24). Muda a cada
+    commit, inclusive de outros processos, sem abrir conexão SQLite.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            f.seek(24)
+            change_counter = int.from_bytes(f.read(4), 'big')
+    except OSError:
+        change_counter = None
+    try:
+        wal = os.stat(path + '-wal')
+        wal_signature = (wal.st_mtime_ns, wal.st_size)
+    except OSError:
+        wal_signature = None
+    return (stat.st_mtime_ns, stat.st_size, change_counter, wal_signature)
+
+
+def _btree_sizes(db) -> Optional[dict]:
+    """Tamanho em bytes de cada tabela/índice via dbstat (None se o SQLite não tiver dbstat)"""
+    try:
+        rows = db.execute(
+            '''
+                SELECT s.name AS name, m.type AS type, s.pgsize AS size
+                FROM dbstat AS s LEFT JOIN sqlite_master AS m ON m.name = s.name
+                WHERE s.aggregate = TRUE
+            '''
+        ).fetchall()
+    except sqlite3.Error:
+        return None
+    sizes = {'tables': {}, 'indexes': {}}
+    for row in rows:
+        sizes['indexes' if row['type'] == 'index' else 'tables'][row['name']] = row['size']
+    return sizes
+
+
+def _file_stats(label: str) -> dict:
+    # Rótulo 'main' = banco principal; no layout split o rótulo é a tabela
+    with read_db(None if label == 'main' else label) as db:
+        stats = {
+            'page_size': db.execute('PRAGMA page_size').fetchone()[0],
+            'page_count': db.execute('PRAGMA page_count').fetchone()[0],
+            'freelist_count': db.execute('PRAGMA freelist_count').fetchone()[0],
+        }
+        sizes = _btree_sizes(db)
+    if sizes is not None:
+        stats['btree_sizes'] = sizes
+    return stats
+
+
+def _compute_db_info(existing: dict) -> dict:
+    """Parte cara de get_db_info: contagens, páginas e tamanhos por tabela/índice"""
+    info = {'tables': {}, 'files': {}}
+    # Conta registros em cada tabela (no arquivo onde ela fica)
+    for table in TABLE_SCHEMAS:
+        if not os.path.exists(get_table_path(table)):
+            continue
+        with read_db(table) as db:
+            count = db.execute(f'SELECT COUNT(*) as c FROM {table}').fetchone()['c']
+        info['tables'][table] = {'count': count}
+    for label in existing:
+        info['files'][label] = _file_stats(label)
+    return info
+
+
+def get_db_info(refresh: bool = False) -> dict:
     """
     Retorna informações sobre o banco de dados atual.
     
+    Contagens, páginas (page_count/freelist_count) e tamanhos por tabela e
+    índice (dbstat) ficam em cache, indexado pela assinatura dos arquivos
+    (ver _file_signature): enquanto nada for gravado, painéis com
+    auto-refresh não abrem conexão nem varrem as tabelas. Tamanho dos
+    arquivos e estado do WAL são sempre atuais.
+    
+    Args:
+        refresh: True ignora o cache e recalcula
+    
     Retorna:
-        dict: Informações sobre o banco (caminho, tamanho, tabelas, etc.)
+        dict: Informações sobre o banco (caminho, tamanho, tabelas, arquivos, etc.)
     """
     try:
         path = _ensure_db_path()
+        files = database_files()
+        signatures = {label: _file_signature(p) for label, p in files.items()}
+        existing = {label: p for label, p in files.items() if signatures[label] is not None}
         info = {
             'path': path,
-            'exists': os.path.exists(path),
-            'size': os.path.getsize(path) if os.path.exists(path) else 0,
+            'layout': 'split' if SPLIT_TABLES else 'single',
+            'exists': bool(existing),
+            'size': sum(signatures[label][1] for label in existing),
             'environment': 'local' if '/tmp' not in path else 'vercel',
         }
         
-        if os.path.exists(path):
-            with get_db_context() as db:
-                # Conta registros em cada tabela
-                messages_count = db.execute('SELECT COUNT(*) as c FROM messages').fetchone()['c']
-                budgets_count = db.execute('SELECT COUNT(*) as c FROM budgets').fetchone()['c']
-                
-                info['tables'] = {
-                    'messages': {'count': messages_count},
-                    'budgets': {'count': budgets_count}
+        if existing:
+            key = tuple(sorted(signatures.items()))
+            # Um único cálculo por mudança, mesmo com vários painéis abertos
+            with _DB_INFO_LOCK:
+                hit = not refresh and _DB_INFO_CACHE['key'] == key
+                if not hit:
+                    _DB_INFO_CACHE['info'] = _compute_db_info(existing)
+                    _DB_INFO_CACHE['key'] = key
+                    _DB_INFO_CACHE['computed_at'] = time.time()
+                cached = _DB_INFO_CACHE['info']
+                computed_at = _DB_INFO_CACHE['computed_at']
+            inc('starke_db_info_total', result='hit' if hit else 'miss')
+            
+            info['tables'] = {table: dict(data) for table, data in cached['tables'].items()}
+            info['files'] = {
+                label: {
+                    'path': p,
+                    'size': signatures[label][1],
+                    'wal': get_wal_info(path=p),
+                    **cached['files'].get(label, {}),
                 }
+                for label, p in existing.items()
+            }
+            info['cache'] = {
+                'hit': hit,
+                'computed_at': datetime.fromtimestamp(computed_at, timezone.utc).isoformat(),
+                'age_seconds': round(time.time() - computed_at, 3),
+            }
         
         return info
     except Exception as e:
         return {'error': str(e)}
-
@@ -0,0 +1,285 @@
+"""
+Helpers HTTP compartilhados pelos handlers em api/
+
+Centraliza a escrita de respostas para que todos os endpoints tenham os
+mesmos headers CORS e a mesma instrumentação (codificação JSON e escrita
+no socket).
+
+Compressão:
+- Negociada pelo Accept-Encoding: br (se o pacote brotli estiver
+  instalado), zstd (pacote zstandard) e gzip (sempre disponível)
+- Apenas tipos textuais (JSON, texto) a partir de STARKE_COMPRESS_MIN_BYTES
+- Corpos grandes comprimidos ficam em um cache indexado pelo hash do
+  conteúdo: o mesmo backup ou página baixado de novo não é recomprimido
+- send_stream() comprime bloco a bloco (Transfer-Encoding: chunked)
+- STARKE_COMPRESS=0 desativa
+"""
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from _jsonstream import dumps
+from _metrics import inc, observe, timed_iter, timer
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependência opcional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependência opcional
+    zstandard = None
+
+ALLOW_HEADERS = "Content-Type, Authorization, Idempotency-Key"
+
+COMPRESS_ENABLED = os.getenv('STARKE_COMPRESS', '1') != '0'
+COMPRESS_MIN_BYTES = int(os.getenv('STARKE_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('STARKE_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Cache de corpos já comprimidos (limite total em bytes comprimidos)
+COMPRESS_CACHE_BYTES = int(os.getenv('STARKE_COMPRESS_CACHE_BYTES', str(8 * 1024 * 1024)))
+# Corpos menores que isso são comprimidos direto (hash + cache não compensam)
+_CACHE_MIN_BYTES = 32 * 1024
+
+_COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+# Ordem de preferência do servidor quando o cliente aceita mais de uma
+ENCODINGS = tuple(
+    name for name, available in (('br', brotli), ('zstd', zstandard), ('gzip', True))
+    if available
+)
+
+_CACHE_LOCK = threading.Lock()
+# (hash do corpo, encoding) -> corpo comprimido
+_CACHE: OrderedDict = OrderedDict()
+_CACHE_SIZE = {'bytes': 0}
+
+
+def compressible(content_type: str) -> bool:
+    """True se o tipo de conteúdo deve passar pela compressão"""
+    # text/event-stream fica de fora: o compressor seguraria os eventos no buffer
+    return (COMPRESS_ENABLED and content_type.startswith(_COMPRESSIBLE_TYPES)
+            and not content_type.startswith('text/event-stream'))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Escolhe a codificação de resposta a partir do header Accept-Encoding.
+
+    Respeita q-values (q=0 recusa) e "*"; em empate vale a ordem de ENCODINGS.
+
+    Retorna:
+        str ou None: 'br', 'zstd', 'gzip' ou None (sem compressão)
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[token] = weight
+    wildcard = weights.get('*', 0.0)
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, wildcard)
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(bytes(body), quality=BROTLI_QUALITY)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """
+    Comprime um corpo completo, reaproveitando o cache para corpos grandes.
+
+    O cache é indexado pelo hash do conteúdo, então nunca serve dados velhos:
+    um corpo diferente tem outro hash.
+    """
+    if len(body) < _CACHE_MIN_BYTES or COMPRESS_CACHE_BYTES <= 0:
+        return _compress(body, encoding)
+
+    key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None:
+            _CACHE.move_to_end(key)
+    if cached is not None:
+        inc('starke_compress_cache_total', result='hit')
+        return cached
+
+    compressed = _compress(body, encoding)
+    inc('starke_compress_cache_total', result='miss')
+    if len(compressed) <= COMPRESS_CACHE_BYTES:
+        with _CACHE_LOCK:
+            if key not in _CACHE:
+                _CACHE[key] = compressed
+                _CACHE_SIZE['bytes'] += len(compressed)
+            while _CACHE_SIZE['bytes'] > COMPRESS_CACHE_BYTES:
+                _, evicted = _CACHE.popitem(last=False)
+                _CACHE_SIZE['bytes'] -= len(evicted)
+    return compressed
+
+
+class _StreamCompressor:
+    """Interface única (compress/flush) para os compressores incrementais"""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.flush = compressor.process, compressor.finish
+        elif encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self.compress, self.flush = compressor.compress, compressor.flush
+        else:
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self.flush = compressor.compress, compressor.flush
+
+
+def _compress_chunks(chunks, encoding):
+    compressor = _StreamCompressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """
+    Comprime incrementalmente um iterável de blocos de bytes.
+
+    Se os blocos vierem de um timed_iter (listagens), o tempo do compressor
+    também é medido, descontado o de quem produz os blocos. Streams sem
+    medição (ex: eventos, que esperam por alterações) não são medidos.
+    """
+    if isinstance(chunks, timed_iter):
+        return timed_iter(_compress_chunks(chunks, encoding), 'compress', exclude=chunks)
+    return _compress_chunks(chunks, encoding)
+
+
+def _common_headers(handler, content_type, methods, extra_headers, encoding):
+    handler.send_header("Content-type", content_type)
+    handler.send_header("Access-Control-Allow-Origin", "*")
+    handler.send_header("Access-Control-Allow-Headers", ALLOW_HEADERS)
+    handler.send_header("Access-Control-Allow-Methods", methods)
+    for header, value in extra_headers or ():
+        handler.send_header(header, value)
+    if compressible(content_type):
+        handler.send_header("Vary", "Accept-Encoding")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+
+
+def send_body(handler, status_code, body, content_type, methods, extra_headers=None):
+    """
+    Envia uma resposta completa (headers + corpo em bytes).
+
+    Args:
+        handler: Instância de BaseHTTPRequestHandler
+        status_code: Status HTTP
+        body: Corpo em bytes (ou None para resposta sem corpo)
+        content_type: Valor do header Content-type
+        methods: Métodos anunciados em Access-Control-Allow-Methods
+        extra_headers: Lista opcional de (header, valor) adicionais
+    """
+    encoding = None
+    if body is not None and len(body) >= COMPRESS_MIN_BYTES and compressible(content_type):
+        encoding = negotiate_encoding(handler.headers.get('Accept-Encoding'))
+        if encoding:
+            with timer('compress'):
+                body = compress_body(body, encoding)
+
+    handler.send_response(status_code)
+    _common_headers(handler, content_type, methods, extra_headers, encoding)
+    if body is not None:
+        handler.send_header("Content-Length", str(len(body)))
+    with timer('write'):
+        handler.end_headers()
+        if body is not None:
+            handler.wfile.write(body)
+
+
+def send_stream(handler, status_code, chunks, content_type, methods, extra_headers=None):
+    """
+    Envia uma resposta cujo corpo é produzido em blocos (iterável de bytes).
+
+    Com HTTP/1.1 usa Transfer-Encoding: chunked; com HTTP/1.0 o fim do corpo
+    é indicado pelo fechamento da conexão. Se o cliente aceitar, cada bloco
+    passa por um compressor incremental antes de ir para o socket.
+    """
+    encoding = None
+    if compressible(content_type):
+        encoding = negotiate_encoding(handler.headers.get('Accept-Encoding'))
+    chunked = handler.request_version == 'HTTP/1.1' and handler.protocol_version == 'HTTP/1.1'
+
+    handler.send_response(status_code)
+    _common_headers(handler, content_type, methods, extra_headers, encoding)
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    else:
+        handler.send_header("Connection", "close")
+        handler.close_connection = True
+    handler.end_headers()
+
+    wfile = handler.wfile
+    perf_counter = time.perf_counter
+    # Só o tempo no socket: produzir os blocos é medido pelo próprio iterável
+    # (timed_iter nas etapas db/json/compress)
+    spent = 0.0
+
+    if encoding:
+        chunks = compress_stream(chunks, encoding)
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            start = perf_counter()
+            if chunked:
+                wfile.write(b'%x\r\n' % len(chunk))
+            wfile.write(chunk)
+            if chunked:
+                wfile.write(b'\r\n')
+            spent += perf_counter() - start
+        start = perf_counter()
+        if chunked:
+            wfile.write(b'0\r\n\r\n')
+        spent += perf_counter() - start
+    finally:
+        observe('starke_stage_seconds', spent, stage='write')
+        # Stream interrompido (cliente desconectou): fecha o gerador e registra as etapas
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def send_json(handler, status_code, payload, methods, extra_headers=None):
+    """Serializa o payload e envia como application/json"""
+    body = None
+    if payload is not None:
+        with timer('json'):
+            body = dumps(payload)
+    send_body(handler, status_code, body, "application/json", methods, extra_headers)
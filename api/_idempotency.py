@@ -0,0 +1,221 @@
+"""
+Chaves de idempotência para os endpoints de envio (POST)
+
+Clientes que repetem um POST com o mesmo header Idempotency-Key recebem a
+resposta original (201 + item) em vez de gerar uma nova linha.
+
+- A chave é registrada na mesma transação do INSERT (no mesmo arquivo da
+  tabela), então a linha e a chave são gravadas juntas ou nenhuma delas
+- Duas requisições simultâneas com a mesma chave são serializadas pelo lock
+  de escrita do SQLite: a segunda vê a chave da primeira e repete a resposta
+- As chaves expiram após STARKE_IDEMPOTENCY_TTL_SECONDS (padrão: 24h)
+- Um LRU em memória (STARKE_IDEMPOTENCY_CACHE_SIZE) responde repetições
+  sem abrir conexão com o banco
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from _metrics import inc
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+TTL_SECONDS = float(os.getenv('STARKE_IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60)))
+CACHE_SIZE = int(os.getenv('STARKE_IDEMPOTENCY_CACHE_SIZE', '1024'))
+
+# Intervalo mínimo (segundos) entre limpezas das chaves expiradas
+_PURGE_INTERVAL = 60.0
+
+_SCHEMA = (
+    '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status INTEGER,
+            response TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+        ON idempotency_keys(expires_at)
+    ''',
+)
+
+_LOCK = threading.Lock()
+# (scope, key) -> (expires_at, request_hash, status, payload)
+_CACHE: OrderedDict = OrderedDict()
+_LAST_PURGE = {'at': 0.0}
+
+
+class IdempotencyConflict(ValueError):
+    """A chave já foi usada com um corpo de requisição diferente"""
+
+
+def get_key(headers) -> Optional[str]:
+    """
+    Lê o header Idempotency-Key.
+
+    Retorna:
+        str ou None: A chave (sem espaços nas pontas) ou None se ausente
+
+    Raises:
+        ValueError: Se a chave for maior que MAX_KEY_LENGTH
+    """
+    key = (headers.get(HEADER) or '').strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'{HEADER} deve ter no máximo {MAX_KEY_LENGTH} caracteres')
+    return key
+
+
+def request_hash(data) -> str:
+    """Impressão digital do corpo da requisição (independe da ordem das chaves)"""
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _cache_get(scope, key, fingerprint):
+    with _LOCK:
+        entry = _CACHE.get((scope, key))
+        if entry is None:
+            return None
+        expires_at, cached_hash, status, payload = entry
+        if expires_at <= time.time():
+            del _CACHE[(scope, key)]
+            return None
+        _CACHE.move_to_end((scope, key))
+    if cached_hash != fingerprint:
+        raise IdempotencyConflict(f'{HEADER} já usada com outro corpo de requisição')
+    return status, payload
+
+
+def _cache_put(scope, key, expires_at, fingerprint, status, payload):
+    if CACHE_SIZE <= 0:
+        return
+    with _LOCK:
+        _CACHE[(scope, key)] = (expires_at, fingerprint, status, payload)
+        _CACHE.move_to_end((scope, key))
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+
+def lookup(scope: str, key: str, fingerprint: str):
+    """
+    Procura a resposta de uma chave no LRU em memória (sem tocar no banco).
+
+    Retorna:
+        tuple: (status, payload) da resposta original, ou None
+
+    Raises:
+        IdempotencyConflict: Se a chave foi usada com outro corpo
+    """
+    replay = _cache_get(scope, key, fingerprint)
+    if replay is not None:
+        inc('starke_idempotency_total', scope=scope, result='cache')
+    return replay
+
+
+def _create_table(db):
+    for statement in _SCHEMA:
+        db.execute(statement)
+
+
+def _purge_expired(db, now):
+    with _LOCK:
+        if now - _LAST_PURGE['at'] < _PURGE_INTERVAL:
+            return
+        _LAST_PURGE['at'] = now
+    db.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+
+
+def _claim(db, scope, key, fingerprint, now):
+    return db.execute(
+        '''
+            INSERT INTO idempotency_keys (scope, key, request_hash, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (scope, key) DO UPDATE SET
+                request_hash = excluded.request_hash,
+                status = NULL,
+                response = NULL,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at
+            WHERE idempotency_keys.expires_at <= excluded.created_at
+        ''',
+        (scope, key, fingerprint, now, now + TTL_SECONDS)
+    ).rowcount
+
+
+def claim(db, scope: str, key: str, fingerprint: str):
+    """
+    Reserva a chave dentro da transação de escrita atual.
+
+    Deve ser chamada com uma conexão de write_db, antes do INSERT. Se outra
+    requisição com a mesma chave estiver em andamento, o lock de escrita do
+    SQLite faz esta esperar até que a primeira termine.
+
+    Retorna:
+        tuple: (status, payload) da resposta original se a chave já foi usada,
+               ou None se a chave foi reservada e o INSERT deve prosseguir
+
+    Raises:
+        IdempotencyConflict: Se a chave foi usada com outro corpo
+    """
+    now = time.time()
+    try:
+        claimed = _claim(db, scope, key, fingerprint, now)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        _create_table(db)
+        claimed = _claim(db, scope, key, fingerprint, now)
+
+    if claimed:
+        _purge_expired(db, now)
+        inc('starke_idempotency_total', scope=scope, result='new')
+        return None
+
+    row = db.execute(
+        'SELECT request_hash, status, response, expires_at FROM idempotency_keys WHERE scope = ? AND key = ?',
+        (scope, key)
+    ).fetchone()
+    if row[0] != fingerprint:
+        raise IdempotencyConflict(f'{HEADER} já usada com outro corpo de requisição')
+    status, payload = row[1], json.loads(row[2])
+    _cache_put(scope, key, row[3], fingerprint, status, payload)
+    inc('starke_idempotency_total', scope=scope, result='replay')
+    return status, payload
+
+
+def store(db, scope: str, key: str, status: int, payload):
+    """
+    Grava a resposta da chave reservada por claim(), na mesma transação do INSERT.
+
+    O LRU só é atualizado depois do commit - use remember() após sair do
+    bloco write_db.
+    """
+    db.execute(
+        'UPDATE idempotency_keys SET status = ?, response = ? WHERE scope = ? AND key = ?',
+        (status, json.dumps(payload), scope, key)
+    )
+
+
+def remember(scope: str, key: str, fingerprint: str, status: int, payload):
+    """Coloca no LRU a resposta de uma chave já gravada (após o commit)"""
+    _cache_put(scope, key, time.time() + TTL_SECONDS, fingerprint, status, payload)
+
+
+def clear_cache():
+    """Esvazia o LRU em memória (ex: após restaurar o banco)"""
+    with _LOCK:
+        _CACHE.clear()
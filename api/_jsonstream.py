@@ -0,0 +1,140 @@
+"""
+Codificação JSON incremental para as listagens
+
+Em vez de converter a página inteira em uma lista de dicts e montar uma
+única string com json.dumps, encode_page() percorre o cursor e produz o
+JSON em blocos de ~STREAM_CHUNK_BYTES. Com send_stream() (api/_http.py) a
+memória usada fica constante, qualquer que seja o page_size.
+
+Se o pacote orjson estiver instalado ele é usado para serializar (mais
+rápido e já devolve bytes); sem ele, o módulo json da biblioteca padrão.
+
+Formatos (parâmetro format= das listagens):
+- objects (padrão): "items" com um objeto por linha
+- columnar: "columns" com os nomes uma única vez e "rows" com cada linha
+  como array, montado direto das tuplas do cursor (sem converter em dict)
+"""
+import json
+import os
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+# Tamanho aproximado de cada bloco enviado ao socket
+STREAM_CHUNK_BYTES = int(os.getenv('STARKE_STREAM_CHUNK_BYTES', str(64 * 1024)))
+
+FORMATS = ('objects', 'columnar')
+
+# Linhas serializadas por chamada ao encoder (amortiza o custo por chamada)
+_ROWS_PER_BATCH = 256
+
+
+def dumps(payload) -> bytes:
+    """Serializa um objeto para JSON em bytes (orjson se disponível)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+
+class FormatError(ValueError):
+    """Parâmetro format= inválido"""
+
+
+def parse_format(value) -> str:
+    """
+    Valida o parâmetro format= das listagens.
+
+    Retorna:
+        str: 'objects' (padrão, também para valor vazio) ou 'columnar'
+
+    Raises:
+        FormatError: Se o formato não existir
+    """
+    if not value:
+        return 'objects'
+    if value not in FORMATS:
+        raise FormatError(f'format inválido: {value} (use {" ou ".join(FORMATS)})')
+    return value
+
+
+def _stream_array(head: bytes, key: str, values):
+    """Gera head + "key": [values...] + "}" em blocos, serializando por lotes"""
+    buffer = bytearray(head[:-1])
+    buffer += b',"' + key.encode() + b'":['
+
+    batch = []
+    first = True
+    for value in values:
+        batch.append(value)
+        if len(batch) < _ROWS_PER_BATCH:
+            continue
+        if not first:
+            buffer += b','
+        # Serializa o lote como array e remove os colchetes: "{...},{...}"
+        buffer += dumps(batch)[1:-1]
+        first = False
+        batch.clear()
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+
+    if batch:
+        if not first:
+            buffer += b','
+        buffer += dumps(batch)[1:-1]
+    buffer += b']}'
+    yield bytes(buffer)
+
+
+def _as_dicts(rows):
+    names = None
+    for row in rows:
+        if names is None:
+            names = tuple(row.keys())
+        yield dict(zip(names, row))
+
+
+def encode_page(rows, total: int, page: int, page_size: int, key: str = 'items',
+                extra: Optional[dict] = None):
+    """
+    Gera o JSON de uma página de listagem em blocos de bytes.
+
+    O formato é o mesmo da resposta montada de uma vez:
+    {"total": N, "page": P, "page_size": S, "items": [{...}, ...]}
+
+    Args:
+        rows: Iterável de sqlite3.Row (ex: o próprio cursor)
+        total, page, page_size: Metadados da paginação
+        key: Nome do campo com a lista de itens
+        extra: Campos adicionais do cabeçalho (ex: sync_token)
+
+    Yields:
+        bytes: Partes do documento JSON
+    """
+    head = dumps({"total": total, "page": page, "page_size": page_size, **(extra or {})})
+    return _stream_array(head, key, _as_dicts(rows))
+
+
+def encode_columnar(rows, columns, total: int, page: int, page_size: int,
+                    extra: Optional[dict] = None):
+    """
+    Gera o JSON de uma página no formato columnar:
+    {"total": N, "page": P, "page_size": S, "columns": [...], "rows": [[...], ...]}
+
+    Args:
+        rows: Iterável de tuplas na ordem de `columns` (cursor sem row_factory)
+        columns: Nomes das colunas (lista ou string SQL "id, name, ...")
+        total, page, page_size: Metadados da paginação
+        extra: Campos adicionais do cabeçalho (ex: sync_token)
+
+    Yields:
+        bytes: Partes do documento JSON
+    """
+    if isinstance(columns, str):
+        columns = [name.strip() for name in columns.split(',')]
+    head = dumps({"total": total, "page": page, "page_size": page_size, **(extra or {}),
+                  "columns": list(columns)})
+    return _stream_array(head, 'rows', rows)
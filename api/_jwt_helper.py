@@ -1,64 +1,210 @@
 """
-JWT helper functions for authentication
-"""
-try:
-    import jwt
-    JWT_AVAILABLE = True
-except ImportError:
-    JWT_AVAILABLE = False
-    import secrets
+Funções de JWT para autenticação
+
+HS256 implementado aqui com hmac/hashlib (sem PyJWT): a chave de assinatura
+é preparada uma vez por processo, as assinaturas são comparadas em tempo
+constante e os tokens são compatíveis com o PyJWT (mesmo header e JSON).
 
+Os tokens não têm estado - qualquer processo com JWT_SECRET_KEY os verifica.
+Só o logout precisa de estado compartilhado: veja _revocation.py.
+"""
+import base64
+import hashlib
+import hmac
+import json
 import os
-from datetime import datetime, timedelta, timezone
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from _metrics import timed
+import _revocation
+
+# Validade do token
+TOKEN_TTL_SECONDS = 24 * 60 * 60
+
+# Tolerância (segundos) para diferença de relógio ao conferir exp/iat/nbf
+LEEWAY_SECONDS = float(os.getenv('STARKE_JWT_LEEWAY_SECONDS', '0'))
 
-# Secret key for JWT signing (use environment variable in production)
-# Lazy initialization to avoid issues during build
+# Chave secreta para assinar os tokens (use a variável de ambiente em produção)
+# Inicializada sob demanda para não causar problemas no build
 _SECRET_KEY = None
+_SIGNER = None
+_SIGNER_LOCK = threading.Lock()
+
+# Tokens já verificados neste processo (token -> payload), em LRU: evita
+# decodificar e conferir a assinatura de novo a cada request
+TOKEN_CACHE_SIZE = int(os.getenv('STARKE_TOKEN_CACHE_SIZE', '1024'))
+_VERIFIED = OrderedDict()
+_VERIFIED_LOCK = threading.Lock()
+
+
+class InvalidToken(ValueError):
+    """Token malformado, com assinatura inválida ou com claims inválidas"""
+
+
+class ExpiredToken(InvalidToken):
+    """Token com a claim exp vencida"""
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data: str) -> bytes:
+    raw = data.encode('ascii')
+    return base64.urlsafe_b64decode(raw + b'=' * (-len(raw) % 4))
+
+
+def _json(value) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+# Header de todo token emitido aqui, já codificado (mesmos bytes do PyJWT)
+_HEADER = _b64encode(_json({"alg": "HS256", "typ": "JWT"}))
+
 
 def _get_secret_key():
-    """Get JWT secret key, initializing if necessary"""
+    """Obtém a chave secreta do JWT, inicializando se necessário"""
     global _SECRET_KEY
     if _SECRET_KEY is None:
         _SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
     return _SECRET_KEY
 
-def generate_token(user_email='admin'):
-    """Generate JWT token for authenticated user"""
-    if not JWT_AVAILABLE:
-        # Fallback if PyJWT is not available
-        return secrets.token_hex(32)
-    
+
+def _signer():
+    """HMAC-SHA256 com a chave já carregada; cada assinatura usa um copy()"""
+    global _SIGNER
+    if _SIGNER is None:
+        with _SIGNER_LOCK:
+            if _SIGNER is None:
+                _SIGNER = hmac.new(_get_secret_key().encode(), digestmod=hashlib.sha256)
+    return _SIGNER
+
+
+def _sign(signing_input: bytes) -> bytes:
+    mac = _signer().copy()
+    mac.update(signing_input)
+    return _b64encode(mac.digest())
+
+
+def encode(payload: dict) -> str:
+    """Assina um payload como JWT HS256"""
+    signing_input = _HEADER + b'.' + _b64encode(_json(payload))
+    return (signing_input + b'.' + _sign(signing_input)).decode('ascii')
+
+
+def _number(payload, claim):
+    value = payload[claim]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidToken(f'A claim {claim} deve ser um número')
+    return value
+
+
+def decode(token: str, leeway: float = None) -> dict:
+    """
+    Verifica um JWT HS256 e retorna o payload.
+
+    Confere a assinatura (em tempo constante), exige exp e valida iat/nbf
+    (não podem estar no futuro) e jti (string não vazia) quando presentes.
+
+    Raises:
+        ExpiredToken: Se o exp já passou (há mais de `leeway` segundos)
+        InvalidToken: Para qualquer outro problema no token
+    """
+    if leeway is None:
+        leeway = LEEWAY_SECONDS
+    if isinstance(token, bytes):
+        token = token.decode('ascii', 'replace')
+    parts = token.split('.')
+    if len(parts) != 3:
+        raise InvalidToken('Token sem os três segmentos')
+    header, body, signature = parts
+
     try:
-        payload = {
-            'email': user_email,
-            'exp': datetime.now(timezone.utc) + timedelta(hours=24),  # Token expires in 24 hours
-            'iat': datetime.now(timezone.utc)
-        }
-        token = jwt.encode(payload, _get_secret_key(), algorithm='HS256')
-        # PyJWT 2.x returns string, but check if it's bytes
-        if isinstance(token, bytes):
-            return token.decode('utf-8')
-        return token
-    except Exception as e:
-        # Fallback on error
-        import secrets
-        return secrets.token_hex(32)
+        header_raw = header.encode('ascii')
+        if header_raw != _HEADER:
+            # Tokens de outros emissores (ex: PyJWT com headers extras)
+            header_data = json.loads(_b64decode(header))
+            if not isinstance(header_data, dict) or header_data.get('alg') != 'HS256':
+                raise InvalidToken('Algoritmo não suportado')
+        expected = _sign(header_raw + b'.' + body.encode('ascii'))
+        if not hmac.compare_digest(expected, signature.encode('ascii')):
+            raise InvalidToken('Assinatura inválida')
+        payload = json.loads(_b64decode(body))
+    except InvalidToken:
+        raise
+    except (ValueError, UnicodeError) as e:
+        raise InvalidToken(f'Token malformado: {e}') from None
+    if not isinstance(payload, dict):
+        raise InvalidToken('O payload deve ser um objeto JSON')
+
+    now = time.time()
+    if 'exp' not in payload:
+        raise InvalidToken('Token sem a claim exp')
+    if _number(payload, 'exp') <= now - leeway:
+        raise ExpiredToken('Token expirado')
+    if 'iat' in payload and _number(payload, 'iat') > now + leeway:
+        raise InvalidToken('Token emitido no futuro')
+    if 'nbf' in payload and _number(payload, 'nbf') > now + leeway:
+        raise InvalidToken('Token ainda não é válido')
+    if 'jti' in payload and (not isinstance(payload['jti'], str) or not payload['jti']):
+        raise InvalidToken('A claim jti deve ser uma string não vazia')
+    return payload
 
+
+def generate_token(user_email='admin'):
+    """Gera o token JWT do usuário autenticado"""
+    now = int(time.time())
+    return encode({
+        'email': user_email,
+        'exp': now + TOKEN_TTL_SECONDS,
+        'iat': now,
+        'jti': secrets.token_urlsafe(16),
+    })
+
+
+@timed('auth')
 def verify_token(token):
-    """Verify JWT token and return payload if valid"""
-    if not JWT_AVAILABLE:
-        return None
-    
+    """Verifica o token JWT e retorna o payload se for válido"""
     if not token:
         return None
-    
-    try:
-        payload = jwt.decode(token, _get_secret_key(), algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None  # Token expired
-    except jwt.InvalidTokenError:
-        return None  # Invalid token
-    except Exception:
-        return None  # Any other error
 
+    with _VERIFIED_LOCK:
+        payload = _VERIFIED.get(token)
+        if payload is not None:
+            if payload['exp'] > time.time() - LEEWAY_SECONDS:
+                _VERIFIED.move_to_end(token)
+            else:
+                del _VERIFIED[token]
+                payload = None
+
+    if payload is None:
+        try:
+            payload = decode(token)
+        except InvalidToken:
+            return None  # Token inválido ou expirado
+        if TOKEN_CACHE_SIZE > 0:
+            with _VERIFIED_LOCK:
+                _VERIFIED[token] = payload
+                while len(_VERIFIED) > TOKEN_CACHE_SIZE:
+                    _VERIFIED.popitem(last=False)
+
+    if _revocation.is_revoked(token, payload):
+        return None  # Revogado por logout
+    return payload
+
+
+def revoke_token(token):
+    """
+    Logout: revoga um token válido até ele expirar, para todos os processos.
+
+    Retorna:
+        bool: True se o token era válido (e agora está revogado)
+    """
+    payload = verify_token(token)
+    if payload is None:
+        return False
+    _revocation.revoke(token, payload)
+    return True
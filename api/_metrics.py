@@ -0,0 +1,289 @@
+"""
+Instrumentação leve de latência para os handlers e para o app Flask.
+
+Registra o tempo gasto em cada etapa de um request (auth, schema, db,
+json, write) em histogramas de buckets fixos, além de contadores simples,
+e renderiza tudo no formato texto do Prometheus para /api/metrics.
+
+Os valores são por processo: cada instância serverless (ou worker) expõe
+apenas o que ela mesma atendeu.
+
+Desative com STARKE_METRICS=0.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+ENABLED = os.getenv('STARKE_METRICS', '1') != '0'
+
+# Limites superiores dos buckets (segundos) - fixos para que observe() não aloque
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Descrições exibidas em "# HELP" para cada métrica conhecida
+HELP = {
+    'starke_request_seconds': 'Duração total do request por endpoint e método',
+    'starke_stage_seconds': 'Tempo gasto por etapa do request (auth, schema, db, json, compress, write)',
+    'starke_db_acquire_seconds': 'Tempo para obter uma conexão do pool, por lane (read/write)',
+    'starke_db_pool_connections_total': 'Conexões entregues pelo pool, por lane e origem (opened/reused)',
+    'starke_db_pool_idle_connections': 'Conexões ociosas mantidas em cada pool',
+    'starke_idempotency_total': 'POSTs com Idempotency-Key, por resultado (new/replay/cache)',
+    'starke_rate_limit_total': 'Decisões do limite de requisições, por endpoint e resultado',
+    'starke_db_info_total': 'Chamadas a get_db_info, por resultado do cache (hit/miss)',
+    'starke_events_subscribers': 'Streams de /api/events abertos neste processo',
+    'starke_events_sent_total': 'Eventos de alteração enviados aos streams de /api/events',
+    'starke_events_poll_errors_total': 'Falhas ao ler o change_log no feed de eventos',
+    'starke_change_log_compacted_total': 'Entradas do change_log removidas pela compactação',
+    'starke_change_log_compact_errors_total': 'Falhas da compactação automática do change_log',
+    'starke_column_compression_migrated_total': 'Linhas antigas comprimidas pela migração das colunas de texto livre',
+    'starke_compress_cache_total': 'Consultas ao cache de respostas comprimidas, por resultado (hit/miss)',
+    'starke_wsgi_adapter_errors_total': 'Exceções do app WSGI tratadas pelo adapter de _vercel_helper.make_handler',
+}
+
+_LOCK = threading.Lock()
+_HISTOGRAMS = {}
+_COUNTERS = {}
+_GAUGES = {}
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+def _key(name, labels):
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+def observe(name, seconds, **labels):
+    """Registra uma amostra de duração (em segundos) no histograma indicado"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    index = bisect_left(BUCKETS, seconds)
+    with _LOCK:
+        hist = _HISTOGRAMS.get(key)
+        if hist is None:
+            hist = _HISTOGRAMS[key] = _Histogram()
+        hist.counts[index] += 1
+        hist.sum += seconds
+        hist.count += 1
+
+
+def inc(name, amount=1, **labels):
+    """Incrementa um contador"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Define o valor atual de um gauge"""
+    if not ENABLED:
+        return
+    with _LOCK:
+        _GAUGES[_key(name, labels)] = value
+
+
+class timer:
+    """
+    Context manager que mede uma etapa do request.
+
+    Uso:
+        with timer('db'):
+            rows = db.execute(...).fetchall()
+    """
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe('starke_stage_seconds', time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+class timed_iter:
+    """
+    Iterador que mede uma etapa executada aos poucos, dentro de um stream.
+
+    Em respostas em streaming o banco e o encoder JSON só trabalham quando o
+    próximo bloco é pedido: o tempo de cada next() é somado e registrado uma
+    única vez, quando o iterável termina, falha ou é fechado.
+
+    Uso:
+        rows = timed_iter(cursor, 'db')
+        chunks = timed_iter(encode_page(rows, ...), 'json', exclude=rows)
+
+    `exclude` é outro timed_iter consumido por dentro deste: o tempo dele é
+    descontado, para que cada etapa conte só o próprio trabalho.
+    """
+    __slots__ = ('stage', 'exclude', 'elapsed', '_items', '_done')
+
+    def __init__(self, items, stage, exclude=None):
+        self._items = iter(items)
+        self.stage = stage
+        self.exclude = exclude
+        self.elapsed = 0.0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            item = next(self._items)
+        except BaseException:
+            self.elapsed += time.perf_counter() - start
+            self._finish()
+            raise
+        self.elapsed += time.perf_counter() - start
+        return item
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        own = self.elapsed - (self.exclude.elapsed if self.exclude is not None else 0.0)
+        observe('starke_stage_seconds', max(own, 0.0), stage=self.stage)
+
+    def close(self):
+        """Registra o tempo medido até aqui (stream interrompido) e fecha o iterável"""
+        self._finish()
+        close = getattr(self._items, 'close', None)
+        if close is not None:
+            close()
+
+
+def timed(stage):
+    """Decorator equivalente a `with timer(stage)` em volta da função inteira"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe('starke_stage_seconds', time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def instrument(endpoint):
+    """
+    Decorator de classe para handlers BaseHTTPRequestHandler.
+
+    Mede a duração de cada método do_<VERBO> em starke_request_seconds.
+    """
+    def decorator(cls):
+        if not ENABLED:
+            return cls
+        for attr in list(vars(cls)):
+            if not attr.startswith('do_'):
+                continue
+            method_name = attr[3:]
+            func = getattr(cls, attr)
+
+            def make_wrapper(func, method_name):
+                @wraps(func)
+                def wrapper(self, *args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return func(self, *args, **kwargs)
+                    finally:
+                        observe('starke_request_seconds', time.perf_counter() - start,
+                                endpoint=endpoint, method=method_name)
+                return wrapper
+
+            setattr(cls, attr, make_wrapper(func, method_name))
+        return cls
+    return decorator
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    parts = []
+    for name, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus():
+    """
+    Renderiza todas as métricas no formato texto do Prometheus (0.0.4).
+
+    Retorna:
+        str: Corpo da resposta para /api/metrics
+    """
+    with _LOCK:
+        histograms = [(key, list(h.counts), h.sum, h.count) for key, h in _HISTOGRAMS.items()]
+        counters = list(_COUNTERS.items())
+        gauges = list(_GAUGES.items())
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in HELP:
+            lines.append(f'# HELP {name} {HELP[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), counts, total, count in sorted(histograms, key=lambda h: h[0]):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_format_labels(labels, ("le", repr(bound)))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    for (name, labels), value in sorted(counters):
+        header(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    for (name, labels), value in sorted(gauges):
+        header(name, 'gauge')
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Zera todas as métricas (útil em testes e benchmarks)"""
+    with _LOCK:
+        _HISTOGRAMS.clear()
+        _COUNTERS.clear()
+        _GAUGES.clear()
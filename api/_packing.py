@@ -0,0 +1,154 @@
+"""
+Compressão transparente das colunas de texto livre
+
+messages.message e budgets.details dominam o tamanho das tabelas. Com
+STARKE_COLUMN_COMPRESSION ativo, a camada de acesso a dados (_dal.py) grava
+esses valores comprimidos e os lê de volta como texto:
+
+- Valores a partir de STARKE_COLUMN_COMPRESSION_MIN_BYTES são gravados como
+  BLOB = 1 byte marcador + dados comprimidos (0x01 zlib/deflate, 0x02 zstd),
+  só se ficarem menores; os demais continuam TEXT
+- A descompressão acontece no cursor (row_factory) e só quando a coluna
+  está na projeção: view=summary, fields= sem a coluna e as contagens não
+  descomprimem nada
+- A leitura aceita sempre os dois formatos, então a compressão pode ser
+  ligada, desligada ou trocada de algoritmo sem migrar o banco (zstd exige
+  o pacote zstandard para ler valores gravados com ele)
+
+Linhas antigas são comprimidas aos poucos por _dal.compress_existing().
+"""
+import os
+import sqlite3
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependência opcional
+    zstandard = None
+
+# Colunas comprimidas de cada tabela
+PACKED_FIELDS = {
+    'messages': ('message',),
+    'budgets': ('details',),
+}
+
+MARKER_ZLIB = 0x01
+MARKER_ZSTD = 0x02
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _algorithm() -> str:
+    value = os.getenv('STARKE_COLUMN_COMPRESSION', '').strip().lower()
+    if value in ('', '0', 'off', 'false'):
+        return ''
+    if value == 'zstd' and zstandard is not None:
+        return 'zstd'
+    # zlib (ou zstd sem o pacote instalado)
+    return 'zlib'
+
+
+ALGORITHM = _algorithm()
+MIN_BYTES = int(os.getenv('STARKE_COLUMN_COMPRESSION_MIN_BYTES', '256'))
+
+
+class PackedValueError(ValueError):
+    """BLOB com marcador desconhecido (ou zstd sem o pacote zstandard)"""
+
+
+def pack(value):
+    """
+    Valor a gravar em uma coluna comprimida.
+
+    Retorna:
+        bytes (marcador + dados) se a compressão estiver ativa, o texto tiver
+        pelo menos MIN_BYTES e o resultado for menor; senão o próprio texto
+    """
+    if not ALGORITHM or not isinstance(value, str):
+        return value
+    raw = value.encode('utf-8')
+    if len(raw) < MIN_BYTES:
+        return value
+    if ALGORITHM == 'zstd':
+        packed = bytes((MARKER_ZSTD,)) + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        packed = bytes((MARKER_ZLIB,)) + zlib.compress(raw, ZLIB_LEVEL, wbits=-15)
+    return packed if len(packed) < len(raw) else value
+
+
+def unpack(value):
+    """Texto de um valor lido de uma coluna comprimida (TEXT passa direto)"""
+    if type(value) is not bytes:
+        return value
+    marker = value[0] if value else None
+    if marker == MARKER_ZLIB:
+        return zlib.decompress(value[1:], wbits=-15).decode('utf-8')
+    if marker == MARKER_ZSTD:
+        if zstandard is None:
+            raise PackedValueError('Valor comprimido com zstd: instale o pacote zstandard')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(value[1:]).decode('utf-8')
+    raise PackedValueError(f'Marcador de compressão desconhecido: {marker}')
+
+
+def packed_indexes(table: str, names) -> tuple:
+    """Posições das colunas comprimidas em uma projeção (lista de nomes)"""
+    packed = PACKED_FIELDS.get(table, ())
+    return tuple(index for index, name in enumerate(names) if name in packed)
+
+
+def pack_values(table: str, names, values) -> tuple:
+    """Aplica pack() aos valores das colunas comprimidas (na ordem de `names`)"""
+    indexes = packed_indexes(table, names)
+    if not ALGORITHM or not indexes:
+        return tuple(values)
+    values = list(values)
+    for index in indexes:
+        values[index] = pack(values[index])
+    return tuple(values)
+
+
+def unpack_dict(table: str, row: dict) -> dict:
+    """Descomprime as colunas comprimidas presentes em um dict de linha"""
+    for name in PACKED_FIELDS.get(table, ()):
+        if name in row:
+            row[name] = unpack(row[name])
+    return row
+
+
+def unpack_cursor(cursor, table: str, columns, tuples: bool = False):
+    """
+    Faz o cursor devolver as colunas comprimidas já como texto.
+
+    Só instala uma row_factory se alguma coluna comprimida estiver em
+    `columns`; sem ela as linhas vêm direto do sqlite3 (sem custo extra).
+
+    Args:
+        cursor: Cursor já executado, antes de qualquer fetch
+        table: 'messages' ou 'budgets'
+        columns: Colunas da consulta (lista ou string SQL "id, name, ...")
+        tuples: True para tuplas, False para sqlite3.Row
+
+    Retorna:
+        O próprio cursor
+    """
+    if isinstance(columns, str):
+        columns = [name.strip() for name in columns.split(',')]
+    indexes = packed_indexes(table, columns)
+    if not indexes:
+        if tuples:
+            cursor.row_factory = None
+        return cursor
+
+    def decoded(values):
+        values = list(values)
+        for index in indexes:
+            if type(values[index]) is bytes:
+                values[index] = unpack(values[index])
+        return tuple(values)
+
+    if tuples:
+        cursor.row_factory = lambda cur, values: decoded(values)
+    else:
+        cursor.row_factory = lambda cur, values: sqlite3.Row(cur, decoded(values))
+    return cursor
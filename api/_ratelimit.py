@@ -0,0 +1,172 @@
+"""
+Limite de requisições (token bucket) para os POSTs públicos
+
+Cada cliente (IP do socket, ou o último endereço de X-Forwarded-For atrás
+de um proxy confiável, ver STARKE_RATE_LIMIT_TRUST_FORWARDED) tem um balde
+com STARKE_RATE_LIMIT_BURST fichas, reabastecido a
+STARKE_RATE_LIMIT_PER_MINUTE fichas por minuto. Sem fichas, o endpoint
+responde 429 com Retry-After antes de tocar no banco.
+
+- Caminho rápido: baldes em memória, por processo
+- STARKE_RATE_LIMIT_SHARED: arquivo SQLite (ex: /tmp/starke_ratelimit.sqlite3)
+  compartilhado entre workers, para que o limite valha para todos eles.
+  Se o arquivo compartilhado falhar, a requisição é liberada (fail open)
+- STARKE_RATE_LIMIT=0 desativa o limite
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from _metrics import inc
+
+ENABLED = os.getenv('STARKE_RATE_LIMIT', '1') != '0'
+PER_MINUTE = float(os.getenv('STARKE_RATE_LIMIT_PER_MINUTE', '10'))
+BURST = float(os.getenv('STARKE_RATE_LIMIT_BURST', '5'))
+SHARED_PATH = os.getenv('STARKE_RATE_LIMIT_SHARED') or None
+# Confia em X-Forwarded-For/X-Real-IP só atrás de um proxy que os grava: por
+# padrão apenas no Vercel (o proxy sobrescreve o header). Fora dele o
+# cliente poderia mandar um valor novo a cada requisição e ganhar um balde cheio
+TRUST_FORWARDED = os.getenv(
+    'STARKE_RATE_LIMIT_TRUST_FORWARDED', '1' if os.getenv('VERCEL') else '0'
+) != '0'
+
+# Quantidade máxima de baldes mantidos em memória (LRU)
+_MAX_BUCKETS = 10000
+
+_LOCK = threading.Lock()
+# bucket -> [fichas, instante da última atualização]
+_BUCKETS: OrderedDict = OrderedDict()
+_SHARED = threading.local()
+
+_SHARED_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        bucket TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID
+'''
+
+
+def client_id(headers, remote_addr: Optional[str]) -> str:
+    """
+    Identifica o cliente pelo endereço do socket ou, com TRUST_FORWARDED, pelo
+    endereço que o proxy acrescentou a X-Forwarded-For (o último da lista - os
+    anteriores vêm do próprio cliente) ou gravou em X-Real-IP.
+    """
+    if TRUST_FORWARDED:
+        forwarded = headers.get('X-Forwarded-For') or headers.get('X-Real-IP') or ''
+        last = forwarded.rsplit(',', 1)[-1].strip()
+        if last:
+            return last
+    return remote_addr or 'unknown'
+
+
+def _refill(tokens, updated_at, now, rate):
+    return min(BURST, tokens + (now - updated_at) * rate)
+
+
+def _take(tokens, rate):
+    """Consome uma ficha; retorna (fichas restantes, segundos até a próxima)"""
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+def _take_local(bucket, now, rate):
+    with _LOCK:
+        state = _BUCKETS.get(bucket)
+        if state is None:
+            state = _BUCKETS[bucket] = [BURST, now]
+            while len(_BUCKETS) > _MAX_BUCKETS:
+                _BUCKETS.popitem(last=False)
+        else:
+            _BUCKETS.move_to_end(bucket)
+        tokens = _refill(state[0], state[1], now, rate)
+        state[0], retry_after = _take(tokens, rate)
+        state[1] = now
+        return retry_after
+
+
+def _shared_connection():
+    db = getattr(_SHARED, 'db', None)
+    if db is None:
+        db = sqlite3.connect(SHARED_PATH, timeout=1.0, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=OFF')
+        db.execute(_SHARED_SCHEMA)
+        _SHARED.db = db
+    return db
+
+
+def _close_shared():
+    db = getattr(_SHARED, 'db', None)
+    _SHARED.db = None
+    if db is not None:
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+
+def _take_shared(bucket, now, rate):
+    db = _shared_connection()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute(
+            'SELECT tokens, updated_at FROM rate_limits WHERE bucket = ?', (bucket,)
+        ).fetchone()
+        tokens = BURST if row is None else _refill(row[0], row[1], now, rate)
+        tokens, retry_after = _take(tokens, rate)
+        db.execute(
+            'INSERT OR REPLACE INTO rate_limits (bucket, tokens, updated_at) VALUES (?, ?, ?)',
+            (bucket, tokens, now)
+        )
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return retry_after
+
+
+def check(scope: str, client: str) -> float:
+    """
+    Consome uma ficha do balde (scope, client).
+
+    O balde em memória é consultado primeiro: se ele já está vazio, o
+    compartilhado (que soma todos os workers) também estaria, então a
+    requisição é recusada sem abrir o arquivo.
+
+    Retorna:
+        float: 0 se a requisição pode seguir, ou segundos até a próxima ficha
+    """
+    if not ENABLED or PER_MINUTE <= 0:
+        return 0.0
+    rate = PER_MINUTE / 60.0
+    bucket = f'{scope}:{client}'
+    now = time.time()
+
+    retry_after = _take_local(bucket, now, rate)
+    if not retry_after and SHARED_PATH:
+        try:
+            retry_after = _take_shared(bucket, now, rate)
+        except sqlite3.Error:
+            inc('starke_rate_limit_total', scope=scope, result='shared_error')
+            _close_shared()
+
+    inc('starke_rate_limit_total', scope=scope, result='limited' if retry_after else 'allowed')
+    return retry_after
+
+
+def retry_after_header(retry_after: float) -> str:
+    """Valor do header Retry-After (segundos inteiros, mínimo 1)"""
+    return str(max(1, math.ceil(retry_after)))
+
+
+def reset():
+    """Esvazia os baldes em memória (útil em testes)"""
+    with _LOCK:
+        _BUCKETS.clear()
@@ -0,0 +1,114 @@
+"""
+Revogação de tokens (logout) compartilhada entre processos
+
+Os tokens são assinados e expiram sozinhos (api/_jwt_helper.py), então
+qualquer processo os verifica sem estado compartilhado. O logout só precisa
+impedir o uso do token até o exp: o jti (ou o sha256 de tokens sem jti) vai
+para a tabela revoked_tokens do banco principal, com a validade do token.
+
+- Cada processo mantém os ids revogados em memória e relê a tabela a cada
+  STARKE_TOKEN_REVOCATION_REFRESH_SECONDS (padrão: 5) - um logout feito em
+  outro worker vale aqui em até esse tempo; no próprio processo, na hora
+- Linhas de tokens já expirados são apagadas a cada nova revogação
+- STARKE_TOKEN_REVOCATION=0 desativa (o logout passa a ser só no cliente)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+ENABLED = os.getenv('STARKE_TOKEN_REVOCATION', '1') != '0'
+REFRESH_SECONDS = float(os.getenv('STARKE_TOKEN_REVOCATION_REFRESH_SECONDS', '5'))
+
+_SCHEMA = (
+    '''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at
+        ON revoked_tokens(expires_at)
+    ''',
+)
+
+_LOCK = threading.Lock()
+# id do token -> exp
+_REVOKED = {}
+_LOADED = {'at': None}
+
+
+def token_id(token: str, payload: dict) -> str:
+    """jti do token, ou o sha256 do próprio token se ele não tiver jti"""
+    jti = payload.get('jti')
+    if jti:
+        return jti
+    return 'sha256:' + hashlib.sha256(token.encode()).hexdigest()
+
+
+def _create_table(db):
+    for statement in _SCHEMA:
+        db.execute(statement)
+
+
+def _refresh(now):
+    from _db import read_db
+
+    try:
+        with read_db() as db:
+            rows = db.execute(
+                'SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > ?', (now,)
+            ).fetchall()
+    except sqlite3.Error:
+        # Tabela ainda não criada (nenhum logout) ou banco indisponível:
+        # mantém o que já está em memória e tenta de novo no próximo intervalo
+        rows = []
+    with _LOCK:
+        for jti, expires_at in rows:
+            _REVOKED[jti] = expires_at
+        for jti in [jti for jti, expires_at in _REVOKED.items() if expires_at <= now]:
+            del _REVOKED[jti]
+        _LOADED['at'] = now
+
+
+def is_revoked(token: str, payload: dict) -> bool:
+    """O token foi revogado por um logout (neste ou em outro processo)?"""
+    if not ENABLED:
+        return False
+    now = time.time()
+    loaded_at = _LOADED['at']
+    if loaded_at is None or now - loaded_at >= REFRESH_SECONDS:
+        _refresh(now)
+    return token_id(token, payload) in _REVOKED
+
+
+def revoke(token: str, payload: dict):
+    """Revoga o token até o exp dele (payload já verificado)"""
+    if not ENABLED:
+        return
+    from _db import write_db
+
+    jti = token_id(token, payload)
+    expires_at = float(payload['exp'])
+    now = time.time()
+    with _LOCK:
+        _REVOKED[jti] = expires_at
+
+    def insert(db):
+        db.execute(
+            'INSERT OR REPLACE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)',
+            (jti, expires_at)
+        )
+        db.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (now,))
+
+    with write_db() as db:
+        try:
+            insert(db)
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            _create_table(db)
+            insert(db)
+
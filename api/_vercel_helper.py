@@ -1,248 +1,339 @@
 """
 Helper para converter requests do Vercel para formato WSGI
+
+O adapter trabalha sempre com bytes: o corpo do request é exposto ao app
+sem cópia e a resposta é repassada ao host bloco a bloco (quando o objeto
+de resposta suporta escrita incremental), sem decodificar para str.
+Isso mantém respostas binárias (backups, exports) intactas.
+
+make_handler é para hosts que chamam handler(req, res) com um app WSGI
+(ex: app.py). As funções de api/*.py no Vercel não passam por aqui: o
+runtime Python do Vercel chama diretamente as classes `handler`
+(BaseHTTPRequestHandler) de cada arquivo.
 """
-import io
+import itertools
+import json
+import traceback
+
+from _metrics import inc
+
+# Chaves fixas do environ WSGI - copiadas a cada request em vez de reconstruídas
+_ENVIRON_TEMPLATE = {
+    'SCRIPT_NAME': '',
+    'SERVER_PORT': '443',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': 'https',
+    'wsgi.errors': None,
+    'wsgi.multithread': False,
+    'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+}
+
+# Headers que o WSGI expõe sem o prefixo HTTP_
+_UNPREFIXED_HEADERS = frozenset(('CONTENT_TYPE', 'CONTENT_LENGTH', 'HOST'))
+
+# Tamanho dos blocos lidos por FileWrapper
+_FILE_BLOCK_SIZE = 64 * 1024
+
+
+class _BodyReader:
+    """
+    Stream de leitura (wsgi.input) sobre um buffer já existente.
+
+    Usa memoryview para não copiar o corpo inteiro - apenas o trecho
+    efetivamente lido pelo app é materializado.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B') if data else memoryview(b'')
+        self._pos = 0
+
+    def read(self, size=-1):
+        remaining = len(self._view) - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        start = self._pos
+        self._pos += size
+        return self._view[start:self._pos].tobytes()
+
+    def readline(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        start = self._pos
+        pos = start
+        while pos < end:
+            pos += 1
+            if self._view[pos - 1] == 0x0A:
+                break
+        self._pos = pos
+        return self._view[start:pos].tobytes()
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if hint is not None and 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+class FileWrapper:
+    """
+    Implementação de wsgi.file_wrapper.
+
+    Permite que o app (ex: flask.send_file) devolva um arquivo que será
+    enviado ao host em blocos, sem carregar o arquivo inteiro em memória.
+    """
+
+    def __init__(self, filelike, blksize=_FILE_BLOCK_SIZE):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
+def _request_body(req):
+    """Extrai o corpo do request como objeto bytes-like (sem cópia)"""
+    body = getattr(req, 'body', None)
+    if body is None:
+        body = getattr(req, 'data', None)
+    if not body:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return body
+
 
 def make_wsgi_environ(req):
     """Converte um request do Vercel para formato WSGI environ"""
-    # Get path from req.url or req.path
-    path = getattr(req, 'path', '/')
-    if not path or path == '':
-        # Try to extract from url
-        url = getattr(req, 'url', '/')
-        if '?' in url:
-            path = url.split('?')[0]
-        else:
-            path = url
-    
-    # Get query string
-    query_string = getattr(req, 'query_string', '')
-    if not query_string:
-        if '?' in getattr(req, 'url', ''):
-            query_string = getattr(req, 'url', '').split('?', 1)[1]
-    
-    # Get body
-    body = b''
-    if hasattr(req, 'body'):
-        if isinstance(req.body, str):
-            body = req.body.encode('utf-8')
-        elif req.body:
-            body = req.body
-    elif hasattr(req, 'data'):
-        if isinstance(req.data, str):
-            body = req.data.encode('utf-8')
-        elif req.data:
-            body = req.data
-    
+    # Get method
+    if hasattr(req, 'method'):
+        method = req.method or 'GET'
+    elif isinstance(req, dict):
+        method = req.get('method', 'GET') or 'GET'
+    else:
+        method = 'GET'
+
+    # Get path and query string - Vercel provides this in req.path or req.url
+    url = getattr(req, 'url', '') or ''
+    path = getattr(req, 'path', '') or ''
+    query_string = ''
+    if '?' in url:
+        url_path, query_string = url.split('?', 1)
+    else:
+        url_path = url
+    if not path:
+        path = url_path or '/'
+    if hasattr(req, 'query') and req.query:
+        query_string = str(req.query)
+    elif getattr(req, 'query_string', ''):
+        query_string = req.query_string
+
     # Get headers
-    headers = {}
-    if hasattr(req, 'headers'):
-        headers = req.headers
-    elif hasattr(req, 'get'):
-        # Try dict-like access
-        headers = req
-    
-    environ = {
-        'REQUEST_METHOD': getattr(req, 'method', 'GET') or 'GET',
-        'SCRIPT_NAME': '',
-        'PATH_INFO': path,
-        'QUERY_STRING': query_string,
-        'CONTENT_TYPE': headers.get('content-type', headers.get('Content-Type', '')),
-        'CONTENT_LENGTH': str(len(body)),
-        'SERVER_NAME': headers.get('host', headers.get('Host', 'localhost')),
-        'SERVER_PORT': '443',
-        'SERVER_PROTOCOL': 'HTTP/1.1',
-        'wsgi.version': (1, 0),
-        'wsgi.url_scheme': 'https',
-        'wsgi.input': io.BytesIO(body),
-        'wsgi.errors': None,
-        'wsgi.multithread': False,
-        'wsgi.multiprocess': True,
-        'wsgi.run_once': False,
-    }
-    
+    headers = getattr(req, 'headers', None)
+    if headers is None:
+        headers = req.get('headers', {}) if isinstance(req, dict) else {}
+    headers = headers or {}
+
+    body = _request_body(req)
+    body_length = memoryview(body).nbytes if not isinstance(body, bytes) else len(body)
+
+    environ = dict(_ENVIRON_TEMPLATE)
+    environ['REQUEST_METHOD'] = method
+    environ['PATH_INFO'] = path
+    environ['QUERY_STRING'] = query_string
+    environ['CONTENT_TYPE'] = headers.get('content-type', headers.get('Content-Type', ''))
+    environ['CONTENT_LENGTH'] = str(body_length)
+    environ['SERVER_NAME'] = headers.get('host', headers.get('Host', 'localhost'))
+    environ['wsgi.input'] = _BodyReader(body)
+    environ['wsgi.file_wrapper'] = FileWrapper
+
     # Add HTTP headers
     for key, value in headers.items():
         key_upper = key.upper().replace('-', '_')
-        if key_upper not in ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HOST'):
+        if key_upper not in _UNPREFIXED_HEADERS:
             environ[f'HTTP_{key_upper}'] = str(value)
-    
+
     return environ
 
+
+def _set_status(res, status_code):
+    """Define o status da resposta no objeto do host"""
+    try:
+        if hasattr(res, 'status') and callable(res.status):
+            res.status(status_code)
+        elif hasattr(res, 'statusCode'):
+            res.statusCode = status_code
+        else:
+            res.status_code = status_code
+    except Exception:
+        pass
+
+
+def _set_headers(res, response_headers):
+    """Copia os headers WSGI para o objeto de resposta do host"""
+    try:
+        if hasattr(res, 'headers'):
+            headers_dict = res.headers if isinstance(res.headers, dict) else {}
+            for header, value in response_headers:
+                headers_dict[header] = value
+            res.headers = headers_dict
+        elif hasattr(res, 'setHeader'):
+            for header, value in response_headers:
+                res.setHeader(header, value)
+    except Exception:
+        pass
+
+
+def _as_bytes(chunk):
+    """Garante que um bloco da resposta seja bytes-like"""
+    if isinstance(chunk, (bytes, bytearray, memoryview)):
+        return chunk
+    return str(chunk).encode('utf-8')
+
+
 def make_handler(wsgi_app):
     """Cria um handler para Vercel que converte req/res para WSGI"""
     def handler(req, res):
+        result = None
+        environ = None
+        state = {'status': 200, 'headers': [], 'started': False}
         try:
-            # Debug: log request attributes
-            import sys
-            import traceback
-            
-            # Try to access req attributes safely
-            req_method = 'GET'
-            req_path = '/'
-            req_headers = {}
-            req_body = b''
-            req_query = ''
-            
-            # Get method
-            if hasattr(req, 'method'):
-                req_method = req.method or 'GET'
-            elif hasattr(req, 'get'):
-                req_method = req.get('method', 'GET')
-            
-            # Get path - Vercel provides this in req.url or req.path
-            if hasattr(req, 'path'):
-                req_path = req.path or '/'
-            elif hasattr(req, 'url'):
-                req_url = req.url or '/'
-                if '?' in req_url:
-                    req_path, req_query = req_url.split('?', 1)
-                else:
-                    req_path = req_url
-            else:
-                req_path = '/'
-            
-            # Get query string
-            if hasattr(req, 'query'):
-                req_query = str(req.query) or ''
-            elif hasattr(req, 'query_string'):
-                req_query = req.query_string or ''
-            
-            # Get headers
-            if hasattr(req, 'headers'):
-                req_headers = req.headers or {}
-            elif isinstance(req, dict):
-                req_headers = req.get('headers', {})
-            
-            # Get body
-            if hasattr(req, 'body'):
-                body_data = req.body
-                if isinstance(body_data, str):
-                    req_body = body_data.encode('utf-8')
-                elif body_data:
-                    req_body = body_data if isinstance(body_data, bytes) else bytes(body_data)
-            elif hasattr(req, 'data'):
-                body_data = req.data
-                if isinstance(body_data, str):
-                    req_body = body_data.encode('utf-8')
-                elif body_data:
-                    req_body = body_data if isinstance(body_data, bytes) else bytes(body_data)
-            
-            # Build WSGI environ
-            environ = {
-                'REQUEST_METHOD': req_method,
-                'SCRIPT_NAME': '',
-                'PATH_INFO': req_path,
-                'QUERY_STRING': req_query,
-                'CONTENT_TYPE': req_headers.get('content-type', req_headers.get('Content-Type', '')),
-                'CONTENT_LENGTH': str(len(req_body)),
-                'SERVER_NAME': req_headers.get('host', req_headers.get('Host', 'localhost')),
-                'SERVER_PORT': '443',
-                'SERVER_PROTOCOL': 'HTTP/1.1',
-                'wsgi.version': (1, 0),
-                'wsgi.url_scheme': 'https',
-                'wsgi.input': io.BytesIO(req_body),
-                'wsgi.errors': None,
-                'wsgi.multithread': False,
-                'wsgi.multiprocess': True,
-                'wsgi.run_once': False,
-            }
-            
-            # Add HTTP headers
-            for key, value in req_headers.items():
-                key_upper = key.upper().replace('-', '_')
-                if key_upper not in ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HOST'):
-                    environ[f'HTTP_{key_upper}'] = str(value)
-            
+            environ = make_wsgi_environ(req)
+
             # WSGI response
-            status_code = 200
-            response_headers = []
-            response_body = []
-            
-            def start_response(status, headers):
-                nonlocal status_code, response_headers
-                status_code = int(status.split()[0])
-                response_headers = headers
-            
+            # Dados enviados pelo callable write() legado do WSGI
+            pending = []
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and state['started']:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                state['status'] = int(status.split()[0])
+                state['headers'] = headers
+                return pending.append
+
+            def begin():
+                if not state['started']:
+                    state['started'] = True
+                    _set_status(res, state['status'])
+                    _set_headers(res, state['headers'])
+
             # Execute WSGI app
             result = wsgi_app(environ, start_response)
-            
-            # Collect response body
-            for chunk in result:
-                if isinstance(chunk, bytes):
-                    response_body.append(chunk)
-                else:
-                    response_body.append(str(chunk).encode('utf-8'))
-            
-            # Set response - Vercel expects us to write to res
-            # Try different ways to set status and headers
-            try:
-                if hasattr(res, 'status'):
-                    res.status(status_code)
-                elif hasattr(res, 'statusCode'):
-                    res.statusCode = status_code
-                elif hasattr(res, 'status_code'):
-                    res.status_code = status_code
-            except:
-                pass
-            
-            # Set headers
-            try:
-                if hasattr(res, 'headers'):
-                    headers_dict = res.headers if isinstance(res.headers, dict) else {}
-                    for header, value in response_headers:
-                        headers_dict[header] = value
-                    res.headers = headers_dict
-                elif hasattr(res, 'setHeader'):
-                    for header, value in response_headers:
-                        res.setHeader(header, value)
-            except:
-                pass
-            
-            # Write body to response
-            body_str = b''.join(response_body).decode('utf-8')
-            
-            # Try to write to res
-            try:
+
+            can_stream = hasattr(res, 'write')
+
+            # Lê até dois blocos: o Flask/werkzeug devolve um iterável
+            # (ClosingIterator), não uma lista, então o tamanho só se sabe iterando
+            chunks = iter(result)
+            head = []
+            for chunk in chunks:
+                head.append(chunk)
+                if len(head) == 2:
+                    break
+
+            # Resposta de um único bloco (caso comum do Flask): repassa sem cópia
+            if not pending and len(head) <= 1:
+                body = _as_bytes(head[0]) if head else b''
+                begin()
                 if hasattr(res, 'send'):
-                    res.send(body_str)
-                    return
+                    res.send(body)
                 elif hasattr(res, 'end'):
-                    res.end(body_str)
-                    return
-                elif hasattr(res, 'write'):
-                    res.write(body_str)
-                    if hasattr(res, 'end'):
-                        res.end()
-                    return
-            except:
-                pass
-            
+                    res.end(body)
+                elif can_stream:
+                    res.write(body)
+                else:
+                    return body
+                return
+
+            # Streaming: envia cada bloco assim que o app o produz
+            if can_stream:
+                begin()
+                for chunk in pending:
+                    res.write(_as_bytes(chunk))
+                for chunk in itertools.chain(head, chunks):
+                    if chunk:
+                        res.write(_as_bytes(chunk))
+                if hasattr(res, 'end'):
+                    res.end()
+                return
+
+            # Host sem escrita incremental: junta os blocos uma única vez
+            body = b''.join(_as_bytes(chunk) for chunk in pending)
+            body += b''.join(_as_bytes(chunk) for chunk in itertools.chain(head, chunks))
+            begin()
+            if hasattr(res, 'send'):
+                res.send(body)
+                return
+            if hasattr(res, 'end'):
+                res.end(body)
+                return
+
             # Fallback: return body (Vercel should handle this)
-            return body_str
-            
+            return body
+
         except Exception as e:
-            # Enhanced error handling
-            error_msg = str(e)
-            error_trace = traceback.format_exc()
-            
+            # Traceback para o stream de erros do WSGI (se o host fornecer um)
+            errors = environ.get('wsgi.errors') if environ else None
+            if errors is not None:
+                errors.write(traceback.format_exc())
+            inc('starke_wsgi_adapter_errors_total')
+
+            if state['started']:
+                # Status e headers já enviados: só encerra a resposta
+                if hasattr(res, 'end'):
+                    try:
+                        res.end()
+                    except Exception:
+                        pass
+                return None
+
             # Try to set error response
             try:
                 if hasattr(res, 'status_code'):
                     res.status_code = 500
-                elif hasattr(res, 'status'):
+                elif hasattr(res, 'status') and not callable(res.status):
                     res.status = 500
-                
+
                 if hasattr(res, 'headers'):
                     res.headers['Content-Type'] = 'application/json'
                 elif hasattr(res, 'setHeader'):
                     res.setHeader('Content-Type', 'application/json')
-            except:
+            except Exception:
                 pass
-            
+
             # Return error
-            error_json = f'{{"error": "Internal server error", "message": "{error_msg}"}}'
-            return error_json
-    
-    return handler
+            return json.dumps({"error": "Internal server error", "message": str(e)})
+        finally:
+            if result is not None and hasattr(result, 'close'):
+                try:
+                    result.close()
+                except Exception:
+                    pass
 
+    return handler
@@ -2,7 +2,6 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import sys
-from datetime import datetime, timezone
 from urllib.parse import urlparse, parse_qs
 
 # Add api directory to path for imports
@@ -14,19 +13,40 @@ except:  # pragma: no cover - defensive path setup
     pass
 
 try:
-    from _db import get_db, init_db
+    from _db import init_db, read_db, write_db
     from _jwt_helper import verify_token
 except ImportError:  # pragma: no cover - fallback for local tools
+    from contextlib import contextmanager
+
     def verify_token(token):
         return None
 
-    def get_db():
+    @contextmanager
+    def write_db(table=None):
         import sqlite3
-        return sqlite3.connect('/tmp/database.sqlite3')
+        db = sqlite3.connect('/tmp/database.sqlite3')
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    read_db = write_db
 
     def init_db():
         pass
 
+from _archive import get_archived, iter_records, parse_date_range
+from _batch import BatchError, delete_ids, delete_range, parse_ids, update_items
+from _changes import SyncTokenExpired, delta, parse_since, sync_token
+import _dal
+from _http import ALLOW_HEADERS, send_json, send_stream
+from _idempotency import IdempotencyConflict, claim, get_key, lookup, remember, request_hash, store
+from _jsonstream import FormatError, encode_columnar, encode_page, parse_format
+from _metrics import instrument, timed_iter, timer
+from _ratelimit import check as check_rate_limit, client_id, retry_after_header
+
 
 def require_auth(headers):
     auth_header = headers.get('Authorization', '')
@@ -37,20 +57,14 @@ def require_auth(headers):
     return payload is not None
 
 
+@instrument('budgets')
 class handler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         pass
 
     # Helpers -----------------------------------------------------------------
-    def _send_json(self, status_code, payload):
-        self.send_response(status_code)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-        self.end_headers()
-        if payload is not None:
-            self.wfile.write(json.dumps(payload).encode())
+    def _send_json(self, status_code, payload, extra_headers=None):
+        send_json(self, status_code, payload, "GET, POST, PUT, PATCH, DELETE, OPTIONS", extra_headers)
 
     def _read_json(self):
         try:
@@ -78,42 +92,87 @@ class handler(BaseHTTPRequestHandler):
             return int(last)
         return None
 
+    def _batch_update(self, items):
+        try:
+            with write_db('budgets') as db, timer('db'):
+                updated, results = update_items(db, 'budgets', items)
+        except BatchError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, {"success": True, "updated": updated, "results": results})
+
+    def _batch_delete(self, data):
+        try:
+            if 'ids' in data:
+                ids = parse_ids(data['ids'])
+                with write_db('budgets') as db, timer('db'):
+                    deleted, results = delete_ids(db, 'budgets', ids)
+                payload = {"success": True, "deleted": deleted, "results": results}
+            else:
+                date_from, date_to = parse_date_range(data.get('from'), data.get('to'))
+                with write_db('budgets') as db, timer('db'):
+                    deleted = delete_range(db, 'budgets', date_from, date_to)
+                payload = {"success": True, "deleted": deleted}
+        except BatchError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except ValueError:
+            self._send_json(400, {"error": "Parâmetros de data inválidos (use YYYY-MM-DD)"})
+            return
+        self._send_json(200, payload)
+
     # HTTP verbs ---------------------------------------------------------------
     def do_POST(self):
-        init_db()
+        # O corpo é lido antes do 429 para não fechar a conexão com dados pendentes
         data = self._read_json()
 
-        required = ['name', 'email', 'phone', 'service', 'details', 'city']
-        missing = [field for field in required if not (data.get(field) or '').strip()]
+        # Endpoint público: limita por cliente antes de tocar no banco
+        client = client_id(self.headers, self.client_address[0] if self.client_address else None)
+        retry_after = check_rate_limit('budgets', client)
+        if retry_after:
+            self._send_json(
+                429, {"error": "Muitas requisições. Tente novamente em instantes"},
+                [("Retry-After", retry_after_header(retry_after))]
+            )
+            return
+
+        init_db()
+
+        missing = _dal.missing_fields('budgets', data)
         if missing:
             self._send_json(400, {"error": f'Campos ausentes: {", ".join(missing)}'})
             return
 
-        db = get_db()
+        # Repetição com a mesma Idempotency-Key devolve a resposta original
         try:
-            cursor = db.execute(
-                'INSERT INTO budgets (name, email, phone, service, details, company, city, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                (
-                    data['name'].strip(),
-                    data['email'].strip(),
-                    data['phone'].strip(),
-                    data['service'].strip(),
-                    data['details'].strip(),
-                    (data.get('company') or '').strip(),
-                    data['city'].strip(),
-                    datetime.now(timezone.utc).isoformat()
-                )
-            )
-            db.commit()
-            new_id = cursor.lastrowid
-            row = db.execute(
-                'SELECT id, name, email, phone, service, details, company, city, created_at FROM budgets WHERE id = ?',
-                (new_id,)
-            ).fetchone()
-        finally:
-            db.close()
+            idempotency_key = get_key(self.headers)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        fingerprint = request_hash(data) if idempotency_key else None
 
-        self._send_json(201, {"success": True, "item": dict(row) if row else {"id": new_id}})
+        try:
+            replay = lookup('budgets', idempotency_key, fingerprint) if idempotency_key else None
+            if replay is None:
+                with write_db('budgets') as db, timer('db'):
+                    if idempotency_key:
+                        replay = claim(db, 'budgets', idempotency_key, fingerprint)
+                    if replay is None:
+                        payload = {"success": True, "item": _dal.insert(db, 'budgets', data)}
+                        if idempotency_key:
+                            store(db, 'budgets', idempotency_key, 201, payload)
+        except IdempotencyConflict as e:
+            self._send_json(422, {"error": str(e)})
+            return
+
+        if replay is not None:
+            status, payload = replay
+            self._send_json(status, payload, [("Idempotent-Replayed", "true")])
+            return
+
+        if idempotency_key:
+            remember('budgets', idempotency_key, fingerprint, 201, payload)
+        self._send_json(201, payload)
 
     def do_GET(self):
         init_db()
@@ -126,18 +185,16 @@ class handler(BaseHTTPRequestHandler):
         record_id = self._extract_id(parsed_url)
 
         if record_id is not None and parsed_url.path.rstrip('/').endswith(str(record_id)):
-            db = get_db()
-            try:
-                row = db.execute(
-                    'SELECT id, name, email, phone, service, details, company, city, created_at FROM budgets WHERE id = ?',
-                    (record_id,)
-                ).fetchone()
-            finally:
-                db.close()
-            if row is None:
+            with read_db('budgets') as db, timer('db'):
+                item = _dal.get(db, 'budgets', record_id)
+            if item is None:
+                # Linha movida para um arquivo mensal (somente leitura)
+                with timer('db'):
+                    item = get_archived('budgets', record_id)
+            if item is None:
                 self._send_json(404, {"error": "Registro não encontrado"})
             else:
-                self._send_json(200, {"item": dict(row)})
+                self._send_json(200, {"item": item})
             return
 
         query_params = parse_qs(parsed_url.query)
@@ -145,24 +202,72 @@ class handler(BaseHTTPRequestHandler):
             page = int(query_params.get('page', ['1'])[0])
             page_size = int(query_params.get('page_size', ['10'])[0])
             page = max(page, 1)
-            page_size = max(min(page_size, 100), 1)
+            page_size = max(min(page_size, _dal.MAX_PAGE_SIZE), 1)
         except ValueError:
             self._send_json(400, {"error": "Parâmetros de paginação inválidos"})
             return
 
-        offset = (page - 1) * page_size
-        db = get_db()
+        # Intervalo de datas opcional - meses arquivados só entram se o intervalo pedir
         try:
-            total = db.execute('SELECT COUNT(1) as c FROM budgets').fetchone()['c']
-            rows = db.execute(
-                'SELECT id, name, email, phone, service, details, company, city, created_at FROM budgets ORDER BY datetime(created_at) DESC LIMIT ? OFFSET ?',
-                (page_size, offset)
-            ).fetchall()
-        finally:
-            db.close()
+            date_from, date_to = parse_date_range(
+                query_params.get('from', [None])[0],
+                query_params.get('to', [None])[0]
+            )
+        except ValueError:
+            self._send_json(400, {"error": "Parâmetros de data inválidos (use YYYY-MM-DD)"})
+            return
 
-        items = [dict(r) for r in rows]
-        self._send_json(200, {"items": items, "total": total, "page": page, "page_size": page_size})
+        # Projeção: fields=a,b,c ou view=summary (servida pelo índice de cobertura)
+        # Formato: format=columnar envia os nomes das colunas uma vez e as linhas como arrays
+        try:
+            columns = _dal.list_columns(
+                'budgets',
+                query_params.get('fields', [None])[0],
+                query_params.get('view', [None])[0]
+            )
+            columnar = parse_format(query_params.get('format', [None])[0]) == 'columnar'
+        except (_dal.FieldsError, FormatError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        # Sincronização incremental: só o que mudou desde o token (since=<sync_token>)
+        since = query_params.get('since', [None])[0]
+        if since is not None:
+            limit = page_size if 'page_size' in query_params else _dal.MAX_PAGE_SIZE
+            try:
+                since_seq = parse_since(since, 'budgets')
+                with read_db('budgets') as db, timer('db'):
+                    result = delta(db, 'budgets', since_seq, columns, limit)
+            except SyncTokenExpired as e:
+                self._send_json(410, {"error": str(e), "resync": True})
+                return
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, result)
+            return
+
+        # Token lido antes das linhas: reaplicar uma alteração já vista é inofensivo
+        with read_db('budgets') as db:
+            token = sync_token(db, 'budgets')
+
+        # As linhas vão do cursor para o socket em blocos (memória constante por página)
+        records = iter_records(
+            'budgets', columns, page_size, (page - 1) * page_size, date_from, date_to, tuples=columnar
+        )
+        with timer('db'):
+            total = next(records)
+
+        # Leitura das linhas e codificação acontecem enquanto o corpo é enviado:
+        # cada etapa é medida pelo iterável (a escrita no socket, por send_stream)
+        rows = timed_iter(records, 'db')
+        extra = {"sync_token": token}
+        if columnar:
+            chunks = encode_columnar(rows, columns, total, page, page_size, extra)
+        else:
+            chunks = encode_page(rows, total, page, page_size, extra=extra)
+        chunks = timed_iter(chunks, 'json', exclude=rows)
+        send_stream(self, 200, chunks, "application/json", "GET, POST, PUT, PATCH, DELETE, OPTIONS")
 
     def do_PUT(self):
         init_db()
@@ -172,46 +277,55 @@ class handler(BaseHTTPRequestHandler):
 
         parsed_url = urlparse(self.path)
         record_id = self._extract_id(parsed_url)
+        data = self._read_json()
         if record_id is None:
-            self._send_json(400, {"error": "ID inválido"})
+            # PUT na coleção com {"items": [...]} atualiza vários registros de uma vez
+            if isinstance(data, dict) and 'items' in data:
+                self._batch_update(data['items'])
+            else:
+                self._send_json(400, {"error": "ID inválido"})
             return
 
-        data = self._read_json()
-        required = ['name', 'email', 'phone', 'service', 'details', 'city']
-        missing = [field for field in required if not (data.get(field) or '').strip()]
+        missing = _dal.missing_fields('budgets', data)
         if missing:
             self._send_json(400, {"error": f'Campos ausentes: {", ".join(missing)}'})
             return
 
-        db = get_db()
+        with write_db('budgets') as db, timer('db'):
+            item = _dal.update(db, 'budgets', record_id, data)
+
+        if item is None:
+            self._send_json(404, {"error": "Registro não encontrado"})
+            return
+
+        self._send_json(200, {"success": True, "item": item})
+
+    def do_PATCH(self):
+        """Atualização parcial: grava apenas os campos enviados (e nada se não mudaram)"""
+        init_db()
+        if not require_auth(self.headers):
+            self._send_json(401, {"error": "Não autorizado"})
+            return
+
+        record_id = self._extract_id()
+        if record_id is None:
+            self._send_json(400, {"error": "ID inválido"})
+            return
+
         try:
-            existing = db.execute('SELECT id FROM budgets WHERE id = ?', (record_id,)).fetchone()
-            if existing is None:
-                self._send_json(404, {"error": "Registro não encontrado"})
-                return
+            values = _dal.patch_values('budgets', self._read_json())
+        except _dal.PatchError as e:
+            self._send_json(400, {"error": str(e)})
+            return
 
-            db.execute(
-                'UPDATE budgets SET name = ?, email = ?, phone = ?, service = ?, details = ?, company = ?, city = ? WHERE id = ?',
-                (
-                    data['name'].strip(),
-                    data['email'].strip(),
-                    data['phone'].strip(),
-                    data['service'].strip(),
-                    data['details'].strip(),
-                    (data.get('company') or '').strip(),
-                    data['city'].strip(),
-                    record_id
-                )
-            )
-            db.commit()
-            row = db.execute(
-                'SELECT id, name, email, phone, service, details, company, city, created_at FROM budgets WHERE id = ?',
-                (record_id,)
-            ).fetchone()
-        finally:
-            db.close()
+        with write_db('budgets') as db, timer('db'):
+            item, changed = _dal.patch(db, 'budgets', record_id, values)
+
+        if item is None:
+            self._send_json(404, {"error": "Registro não encontrado"})
+            return
 
-        self._send_json(200, {"success": True, "item": dict(row) if row else {"id": record_id}})
+        self._send_json(200, {"success": True, "item": item, "changed": changed})
 
     def do_DELETE(self):
         init_db()
@@ -222,25 +336,26 @@ class handler(BaseHTTPRequestHandler):
         parsed_url = urlparse(self.path)
         record_id = self._extract_id(parsed_url)
         if record_id is None:
-            self._send_json(400, {"error": "ID inválido"})
+            # DELETE na coleção com {"ids": [...]} ou {"from", "to"} exclui em lote
+            data = self._read_json()
+            if not isinstance(data, dict):
+                self._send_json(400, {"error": "ID inválido"})
+                return
+            self._batch_delete(data)
             return
 
-        db = get_db()
-        try:
-            existing = db.execute('SELECT id FROM budgets WHERE id = ?', (record_id,)).fetchone()
-            if existing is None:
-                self._send_json(404, {"error": "Registro não encontrado"})
-                return
-            db.execute('DELETE FROM budgets WHERE id = ?', (record_id,))
-            db.commit()
-        finally:
-            db.close()
+        with write_db('budgets') as db, timer('db'):
+            deleted = _dal.delete(db, 'budgets', record_id)
+
+        if not deleted:
+            self._send_json(404, {"error": "Registro não encontrado"})
+            return
 
         self._send_json(200, {"success": True})
 
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, PATCH, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", ALLOW_HEADERS)
         self.end_headers()
@@ -3,7 +3,7 @@ import json
 import os
 import sys
 import base64
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 
 # Add api directory to path for imports
 try:
@@ -13,24 +13,37 @@ try:
 except:
     pass
 
-try:
-    from _db import get_db_info, backup_db, restore_db, init_db
-    from _jwt_helper import verify_token
-except ImportError:
-    def verify_token(token):
-        return None
-    
-    def get_db_info():
-        return {'error': 'Database module not available'}
-    
-    def backup_db():
-        return None
-    
-    def restore_db(data):
-        return False
-    
-    def init_db():
-        pass
+from _archive import archive_old_rows, get_archive_info
+from _backup import BackupChainError, backup_position, incremental_backup, restore_chain, verify_chain
+from _changes import SyncTokenExpired
+from _dal import (
+    TABLE_FIELDS, CompressionDisabled, compress_existing, compression_stats, start_background_compression
+)
+from _db import backup_db, get_db_info, get_slow_queries, init_db, read_db, restore_db
+from _http import send_json, send_stream
+from _idempotency import clear_cache as clear_idempotency_cache
+from _jwt_helper import verify_token
+from _metrics import instrument, timed_iter, timer
+
+
+# Bytes do backup por bloco de base64 (múltiplo de 3: sem padding no meio do texto)
+_BACKUP_CHUNK_BYTES = 3 * 64 * 1024
+
+
+def _backup_json_chunks(backup_data):
+    """Gera o JSON do backup em blocos, sem montar a string base64 inteira em memória"""
+    head = json.dumps({
+        "success": True,
+        "size": len(backup_data),
+        # Ponto de partida de GET /api/db-admin/backup?since=
+        "sync_token": backup_position(backup_data),
+        "message": "Use POST /api/db-admin/restore para restaurar"
+    })
+    yield head[:-1].encode() + b', "backup": "'
+    view = memoryview(backup_data)
+    for start in range(0, len(view), _BACKUP_CHUNK_BYTES):
+        yield base64.b64encode(view[start:start + _BACKUP_CHUNK_BYTES])
+    yield b'"}'
 
 
 def require_auth(headers):
@@ -43,20 +56,14 @@ def require_auth(headers):
     return payload is not None
 
 
+@instrument('db_admin')
 class handler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         pass
 
     def _send_json(self, status_code, payload):
         """Envia resposta JSON"""
-        self.send_response(status_code)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.end_headers()
-        if payload is not None:
-            self.wfile.write(json.dumps(payload).encode())
+        send_json(self, status_code, payload, "GET, POST, OPTIONS")
 
     def _read_json(self):
         """Lê e parseia o body JSON"""
@@ -75,7 +82,7 @@ class handler(BaseHTTPRequestHandler):
             return {}
 
     def do_GET(self):
-        """GET /api/db-admin - Retorna informações do banco ou faz download do backup"""
+        """GET /api/db-admin - Retorna informações do banco, consultas lentas ou faz download do backup"""
         if not require_auth(self.headers):
             self._send_json(401, {"error": "Não autorizado"})
             return
@@ -84,23 +91,51 @@ class handler(BaseHTTPRequestHandler):
         
         # Se o path termina com /backup, retorna o backup como download
         if parsed_url.path.endswith('/backup'):
-            backup_data = backup_db()
+            # Incremental: só as alterações desde o sync_token do backup anterior
+            since = parse_qs(parsed_url.query).get('since', [None])[0]
+            if since is not None:
+                try:
+                    with timer('db'):
+                        increment = incremental_backup(since)
+                except SyncTokenExpired as e:
+                    self._send_json(410, {"error": str(e), "full_backup_required": True})
+                    return
+                except ValueError as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                self._send_json(200, {"success": True, "increment": increment})
+                return
+
+            with timer('db'):
+                backup_data = backup_db()
             if backup_data is None:
                 self._send_json(404, {"error": "Banco de dados não encontrado ou erro ao criar backup"})
                 return
 
-            # Retorna o backup como base64 no JSON
-            backup_b64 = base64.b64encode(backup_data).decode('utf-8')
-            self._send_json(200, {
-                "success": True,
-                "backup": backup_b64,
-                "size": len(backup_data),
-                "message": "Use POST /api/db-admin/restore para restaurar"
-            })
+            # Retorna o backup como base64 no JSON, enviado (e comprimido) em blocos
+            send_stream(
+                self, 200, timed_iter(_backup_json_chunks(backup_data), 'json'),
+                "application/json", "GET, POST, OPTIONS"
+            )
+            return
+
+        # Consultas lentas registradas (top-N por pior tempo)
+        if parsed_url.path.endswith('/slow-queries'):
+            query_params = parse_qs(parsed_url.query)
+            try:
+                limit = max(min(int(query_params.get('limit', ['10'])[0]), 100), 1)
+            except ValueError:
+                self._send_json(400, {"error": "Parâmetro 'limit' inválido"})
+                return
+            self._send_json(200, {"success": True, "slow_queries": get_slow_queries(limit)})
             return
 
-        # Caso contrário, retorna informações do banco
-        info = get_db_info()
+        # Caso contrário, retorna informações do banco (em cache até o banco mudar;
+        # ?refresh=1 força o recálculo)
+        refresh = parse_qs(parsed_url.query).get('refresh', ['0'])[0] not in ('', '0', 'false')
+        with timer('db'):
+            info = get_db_info(refresh=refresh)
+            info['archive'] = get_archive_info()
         self._send_json(200, {"success": True, "info": info})
 
     def do_POST(self):
@@ -124,17 +159,111 @@ class handler(BaseHTTPRequestHandler):
                 self._send_json(400, {"error": "Backup inválido (deve ser base64)"})
                 return
 
+            # Base + cadeia de incrementos (GET /backup?since=), conferida antes de restaurar
+            if data.get('increments'):
+                if not isinstance(data['increments'], list):
+                    self._send_json(400, {"error": "Campo 'increments' deve ser uma lista"})
+                    return
+                try:
+                    with timer('db'):
+                        result = restore_chain(backup_data, data['increments'])
+                except BackupChainError as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                except Exception as e:
+                    self._send_json(500, {"error": f"Erro ao restaurar banco de dados: {str(e)}"})
+                    return
+                clear_idempotency_cache()
+                self._send_json(200, {
+                    "success": True,
+                    "message": "Banco de dados restaurado com sucesso",
+                    **result
+                })
+                return
+
             if restore_db(backup_data):
+                # Respostas em cache podem apontar para linhas que não existem no backup
+                clear_idempotency_cache()
                 self._send_json(200, {"success": True, "message": "Banco de dados restaurado com sucesso"})
             else:
                 self._send_json(500, {"error": "Erro ao restaurar banco de dados"})
             return
 
+        # Verify: confere uma cadeia de backup (base + incrementos) sem restaurar
+        if parsed_url.path.endswith('/verify'):
+            if 'backup' not in data:
+                self._send_json(400, {"error": "Campo 'backup' (base64) é obrigatório"})
+                return
+            try:
+                backup_data = base64.b64decode(data['backup'])
+            except Exception:
+                self._send_json(400, {"error": "Backup inválido (deve ser base64)"})
+                return
+            increments = data.get('increments') or []
+            if not isinstance(increments, list):
+                self._send_json(400, {"error": "Campo 'increments' deve ser uma lista"})
+                return
+            with timer('db'):
+                report = verify_chain(backup_data, increments, compare=bool(data.get('compare')))
+            self._send_json(200, {"success": True, "verification": report})
+            return
+
+        # Archive: move linhas antigas para os arquivos mensais
+        if parsed_url.path.endswith('/archive'):
+            max_age_days = data.get('max_age_days')
+            if max_age_days is not None:
+                try:
+                    max_age_days = int(max_age_days)
+                except (TypeError, ValueError):
+                    self._send_json(400, {"error": "Campo 'max_age_days' deve ser um inteiro"})
+                    return
+                if max_age_days < 0:
+                    self._send_json(400, {"error": "Campo 'max_age_days' deve ser um inteiro"})
+                    return
+            try:
+                result = archive_old_rows(max_age_days)
+                self._send_json(200, {"success": True, "archive": result})
+            except Exception as e:
+                self._send_json(500, {"error": f"Erro ao arquivar registros: {str(e)}"})
+            return
+
+        # Compress: comprime as colunas de texto livre das linhas antigas
+        if parsed_url.path.endswith('/compress'):
+            try:
+                batch_size = int(data.get('batch_size') or 200)
+                max_seconds = float(data.get('max_seconds') or 5)
+            except (TypeError, ValueError):
+                self._send_json(400, {"error": "Campos 'batch_size' e 'max_seconds' devem ser números"})
+                return
+            if batch_size < 1 or max_seconds <= 0:
+                self._send_json(400, {"error": "Campos 'batch_size' e 'max_seconds' devem ser positivos"})
+                return
+            try:
+                if data.get('background'):
+                    # Só em processos de longa duração (local_server.py, server.py)
+                    started = start_background_compression()
+                    self._send_json(202, {"success": True, "started": started})
+                    return
+                with timer('db'):
+                    result = compress_existing(batch_size=batch_size, max_seconds=max_seconds)
+                    stats = {}
+                    for table in TABLE_FIELDS:
+                        with read_db(table) as db:
+                            stats[table] = compression_stats(db, table)
+            except CompressionDisabled as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": f"Erro ao comprimir registros: {str(e)}"})
+                return
+            self._send_json(200, {"success": True, "compression": result, "rows": stats})
+            return
+
         # Initialize
         if parsed_url.path.endswith('/init'):
             try:
-                init_db()
-                info = get_db_info()
+                init_db(force=True)
+                info = get_db_info(refresh=True)
                 self._send_json(200, {
                     "success": True,
                     "message": "Banco de dados inicializado",
@@ -145,7 +274,7 @@ class handler(BaseHTTPRequestHandler):
             return
 
         # Se nenhuma ação específica, retorna erro
-        self._send_json(400, {"error": "Ação não especificada. Use /init ou /restore"})
+        self._send_json(400, {"error": "Ação não especificada. Use /init, /restore, /verify, /archive ou /compress"})
 
     def do_OPTIONS(self):
         """Suporte para CORS preflight"""
@@ -0,0 +1,65 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+from urllib.parse import urlparse, parse_qs
+
+# Add api directory to path for imports
+try:
+    api_dir = os.path.dirname(__file__)
+    if api_dir and api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+except:  # pragma: no cover - defensive path setup
+    pass
+
+try:
+    from _jwt_helper import verify_token
+except ImportError:  # pragma: no cover - fallback for local tools
+    def verify_token(token):
+        return None
+
+from _changes import event_stream
+from _db import init_db
+from _http import send_json, send_stream
+
+
+def require_auth(headers, query_params):
+    """Token no header Authorization ou em ?token= (EventSource não envia headers)"""
+    auth_header = headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        token = auth_header.split(' ', 1)[1].strip()
+    else:
+        token = query_params.get('token', [''])[0].strip()
+    if not token:
+        return False
+    return verify_token(token) is not None
+
+
+# Sem @instrument: a duração de um stream não é latência de request
+class handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        """GET /api/events - Stream (Server-Sent Events) de alterações em mensagens e orçamentos"""
+        query_params = parse_qs(urlparse(self.path).query)
+        if not require_auth(self.headers, query_params):
+            send_json(self, 401, {"error": "Não autorizado"}, "GET, OPTIONS")
+            return
+
+        init_db()
+        last_event_id = self.headers.get('Last-Event-ID') or query_params.get('last_event_id', [None])[0]
+        try:
+            send_stream(
+                self, 200, event_stream(last_event_id), "text/event-stream", "GET, OPTIONS",
+                [("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no")]
+            )
+        except (BrokenPipeError, ConnectionResetError):
+            # Cliente fechou a aba/conexão
+            pass
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization, Last-Event-ID")
+        self.end_headers()
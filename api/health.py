@@ -1,23 +1,68 @@
 from http.server import BaseHTTPRequestHandler
-import json
+import os
+import sys
+from urllib.parse import urlparse, parse_qs
 
+# Add api directory to path for imports
+try:
+    api_dir = os.path.dirname(__file__)
+    if api_dir and api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+except:
+    pass
+
+try:
+    from _db import get_wal_status
+    from _jwt_helper import verify_token
+except ImportError:
+    get_wal_status = None
+
+    def verify_token(token):
+        return None
+
+from _http import send_json
+from _metrics import instrument
+
+
+def require_auth(headers):
+    """Verifica se o request está autenticado"""
+    auth_header = headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    token = auth_header.split(' ', 1)[1].strip()
+    return verify_token(token) is not None
+
+
+@instrument('health')
 class handler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         # Suppress default logging
         pass
-    
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        
         data = {"status": "ok"}
-        self.wfile.write(json.dumps(data).encode())
-    
+        status_code = 200
+
+        # Modo profundo (?deep=1): inclui estado do WAL e atraso do checkpoint.
+        # Faz um checkpoint e expõe caminhos/tamanhos dos arquivos: só autenticado
+        query_params = parse_qs(urlparse(self.path).query)
+        if query_params.get('deep', ['0'])[0] in ('1', 'true'):
+            if not require_auth(self.headers):
+                send_json(self, 401, {"error": "Não autorizado"}, "GET, OPTIONS")
+                return
+            try:
+                if get_wal_status is None:
+                    raise RuntimeError('Database module not available')
+                data["database"] = get_wal_status(deep=True)
+            except Exception as e:
+                data = {"status": "degraded", "error": str(e)}
+                status_code = 503
+
+        send_json(self, status_code, data, "GET, OPTIONS")
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
         self.end_headers()
@@ -13,13 +13,20 @@ except:
     pass
 
 try:
-    from _jwt_helper import generate_token
+    from _jwt_helper import generate_token, revoke_token
 except ImportError:
     # Fallback - create simple token generator
     import secrets
     def generate_token(user_email='admin'):
         return secrets.token_hex(16)
 
+    def revoke_token(token):
+        return False
+
+from _metrics import instrument
+
+
+@instrument('login')
 class handler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         # Suppress default logging
@@ -63,8 +70,10 @@ class handler(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps(response).encode())
     
     def handle_logout(self):
-        # With JWT, logout is client-side (just remove token)
-        # Token will expire naturally
+        # Revoga o token até o exp (api/_revocation.py); o cliente também o descarta
+        auth_header = self.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer '):
+            revoke_token(auth_header.split(' ', 1)[1].strip())
         response = {"success": True}
         self.send_response(200)
         self.send_header("Content-type", "application/json")
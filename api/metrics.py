@@ -0,0 +1,52 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+# Add api directory to path for imports
+try:
+    api_dir = os.path.dirname(__file__)
+    if api_dir and api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+except:  # pragma: no cover - defensive path setup
+    pass
+
+try:
+    from _jwt_helper import verify_token
+except ImportError:  # pragma: no cover - fallback for local tools
+    def verify_token(token):
+        return None
+
+from _http import send_body, send_json
+from _metrics import instrument, render_prometheus
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def require_auth(headers):
+    auth_header = headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    token = auth_header.split(' ', 1)[1].strip()
+    payload = verify_token(token)
+    return payload is not None
+
+
+@instrument('metrics')
+class handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        """GET /api/metrics - Histogramas de latência no formato do Prometheus"""
+        if not require_auth(self.headers):
+            send_json(self, 401, {"error": "Não autorizado"}, "GET, OPTIONS")
+            return
+        body = render_prometheus().encode('utf-8')
+        send_body(self, 200, body, PROMETHEUS_CONTENT_TYPE, "GET, OPTIONS")
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        self.end_headers()
@@ -1,63 +1,170 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
-import sqlite3
 import os
-from datetime import datetime, timezone
-import secrets
+import sys
+import time
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'database.sqlite3')
+API_DIR = os.path.join(os.path.dirname(__file__), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
 
+import _dal
+from _archive import iter_records, parse_date_range
+from _changes import SyncTokenExpired, delta, event_stream, parse_since, sync_token
+from _db import init_db, read_db, write_db
+from _http import COMPRESS_MIN_BYTES, compressible, compress_body, compress_stream, negotiate_encoding
+from _idempotency import IdempotencyConflict, claim, get_key, lookup, remember, request_hash, store
+from _jsonstream import FormatError, encode_columnar, encode_page, parse_format
+from _jwt_helper import generate_token, revoke_token, verify_token
+from _metrics import observe, render_prometheus, timed_iter, timer
+from _ratelimit import check as check_rate_limit, client_id, retry_after_header
 
-def get_db():
-    if 'db' not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
-    return g.db
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
 
 
-def close_db(e=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
-
-
-def init_db():
-    db = get_db()
-    db.execute(
-        '''CREATE TABLE IF NOT EXISTS messages (
-               id INTEGER PRIMARY KEY AUTOINCREMENT,
-               name TEXT NOT NULL,
-               email TEXT NOT NULL,
-               subject TEXT NOT NULL,
-               message TEXT NOT NULL,
-               created_at TEXT NOT NULL
-           )'''
-    )
-    db.execute(
-        '''CREATE TABLE IF NOT EXISTS budgets (
-               id INTEGER PRIMARY KEY AUTOINCREMENT,
-               name TEXT NOT NULL,
-               email TEXT NOT NULL,
-               phone TEXT NOT NULL,
-               service TEXT NOT NULL,
-               details TEXT NOT NULL,
-               company TEXT,
-               city TEXT NOT NULL,
-               created_at TEXT NOT NULL
-           )'''
+def require_auth(allow_query=False):
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        token = auth_header.split(' ', 1)[1].strip()
+    elif allow_query:
+        # EventSource não envia headers: o token vem em ?token=
+        token = (request.args.get('token') or '').strip()
+    else:
+        return False
+    # Token assinado e com validade (api/_jwt_helper.py): qualquer worker verifica
+    return verify_token(token) is not None
+
+
+def rate_limited(scope):
+    """Resposta 429 se o cliente esgotou o limite do endpoint público, senão None"""
+    retry_after = check_rate_limit(scope, client_id(request.headers, request.remote_addr))
+    if not retry_after:
+        return None
+    return (
+        jsonify({ 'error': 'Muitas requisições. Tente novamente em instantes' }),
+        429,
+        { 'Retry-After': retry_after_header(retry_after) },
     )
-    db.commit()
-
-
-token_store = set()
 
 
-def require_auth():
-    auth_header = request.headers.get('Authorization', '')
-    if not auth_header.startswith('Bearer '):
-        return False
-    token = auth_header.split(' ', 1)[1].strip()
-    return token in token_store
+def compress_response(response):
+    """Comprime a resposta conforme o Accept-Encoding (mesma política dos handlers em api/)"""
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if not compressible(response.content_type or ''):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if response.is_streamed:
+        # Listagens em streaming: cada bloco passa pelo compressor incremental
+        if encoding:
+            response.response = compress_stream(response.response, encoding)
+            response.headers['Content-Encoding'] = encoding
+        return response
+    body = response.get_data()
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        with timer('compress'):
+            response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def json_response(payload, status=200):
+    with timer('json'):
+        return jsonify(payload), status
+
+
+def create_record(table):
+    """POST público de mensagens/orçamentos (limite por cliente + Idempotency-Key)"""
+    limited = rate_limited(table)
+    if limited:
+        return limited
+    data = request.get_json(force=True, silent=True) or {}
+    missing = _dal.missing_fields(table, data)
+    if missing:
+        return jsonify({ 'error': f'Campos ausentes: {", ".join(missing)}' }), 400
+
+    try:
+        idempotency_key = get_key(request.headers)
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+    fingerprint = request_hash(data) if idempotency_key else None
+
+    try:
+        replay = lookup(table, idempotency_key, fingerprint) if idempotency_key else None
+        if replay is None:
+            with write_db(table) as db, timer('db'):
+                if idempotency_key:
+                    replay = claim(db, table, idempotency_key, fingerprint)
+                if replay is None:
+                    payload = { 'success': True, 'item': _dal.insert(db, table, data) }
+                    if idempotency_key:
+                        store(db, table, idempotency_key, 201, payload)
+    except IdempotencyConflict as e:
+        return jsonify({ 'error': str(e) }), 422
+
+    if replay is not None:
+        status, payload = replay
+        return jsonify(payload), status, { 'Idempotent-Replayed': 'true' }
+    if idempotency_key:
+        remember(table, idempotency_key, fingerprint, 201, payload)
+    return jsonify(payload), 201
+
+
+def list_table(table):
+    """GET paginado de mensagens/orçamentos (requer autenticação)"""
+    if not require_auth():
+        return jsonify({ 'error': 'Não autorizado' }), 401
+    try:
+        page = int(request.args.get('page', '1'))
+        page_size = int(request.args.get('page_size', '10'))
+        page = max(page, 1)
+        page_size = max(min(page_size, _dal.MAX_PAGE_SIZE), 1)
+    except ValueError:
+        return jsonify({ 'error': 'Parâmetros de paginação inválidos' }), 400
+    try:
+        date_from, date_to = parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError:
+        return jsonify({ 'error': 'Parâmetros de data inválidos (use YYYY-MM-DD)' }), 400
+
+    try:
+        columns = _dal.list_columns(table, request.args.get('fields'), request.args.get('view'))
+        columnar = parse_format(request.args.get('format')) == 'columnar'
+    except (_dal.FieldsError, FormatError) as e:
+        return jsonify({ 'error': str(e) }), 400
+
+    # Sincronização incremental: só o que mudou desde o token (since=<sync_token>)
+    since = request.args.get('since')
+    if since is not None:
+        limit = page_size if 'page_size' in request.args else _dal.MAX_PAGE_SIZE
+        try:
+            since_seq = parse_since(since, table)
+            with read_db(table) as db, timer('db'):
+                result = delta(db, table, since_seq, columns, limit)
+        except SyncTokenExpired as e:
+            return jsonify({ 'error': str(e), 'resync': True }), 410
+        except ValueError as e:
+            return jsonify({ 'error': str(e) }), 400
+        return json_response(result)
+
+    # Token lido antes das linhas: reaplicar uma alteração já vista é inofensivo
+    with read_db(table) as db:
+        token = sync_token(db, table)
+
+    # As linhas vão do cursor para a resposta em blocos (memória constante por página)
+    records = iter_records(
+        table, columns, page_size, (page - 1) * page_size, date_from, date_to, tuples=columnar
+    )
+    with timer('db'):
+        total = next(records)
+    # Linhas e JSON são produzidos enquanto a resposta é enviada: medidos pelo iterável
+    rows = timed_iter(records, 'db')
+    extra = { 'sync_token': token }
+    if columnar:
+        chunks = encode_columnar(rows, columns, total, page, page_size, extra)
+    else:
+        chunks = encode_page(rows, total, page, page_size, extra=extra)
+    return Response(timed_iter(chunks, 'json', exclude=rows), mimetype='application/json')
 
 
 def create_app():
@@ -68,131 +175,78 @@ def create_app():
 
     @app.before_request
     def before_request():
-        init_db()
-
-    @app.teardown_appcontext
-    def teardown_db(exception):
-        close_db()
+        g.request_started = time.perf_counter()
+        with timer('schema'):
+            init_db()
+
+    @app.after_request
+    def after_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            observe('starke_request_seconds', time.perf_counter() - started,
+                    endpoint=request.endpoint or 'unknown', method=request.method)
+        return compress_response(response)
 
     @app.get('/api/health')
     def health():
         return jsonify({ 'status': 'ok' })
 
+    @app.get('/api/metrics')
+    def metrics():
+        if not require_auth():
+            return jsonify({ 'error': 'Não autorizado' }), 401
+        return render_prometheus(), 200, { 'Content-Type': PROMETHEUS_CONTENT_TYPE }
+
+    @app.get('/api/events')
+    def events():
+        if not require_auth(allow_query=True):
+            return jsonify({ 'error': 'Não autorizado' }), 401
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        return Response(
+            event_stream(last_event_id),
+            mimetype='text/event-stream',
+            headers={ 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no' },
+        )
+
     @app.post('/api/login')
     def login():
         data = request.get_json(force=True, silent=True) or {}
         email = (data.get('email') or '').strip()
         password = (data.get('password') or '').strip()
         if email.lower() == app.config['ADMIN_EMAIL'].lower() and password == app.config['ADMIN_PASSWORD']:
-            token = secrets.token_hex(16)
-            token_store.add(token)
-            return jsonify({ 'token': token })
+            return jsonify({ 'token': generate_token(email.lower()) })
         return jsonify({ 'error': 'Credenciais inválidas' }), 401
 
     @app.post('/api/logout')
     def logout():
         auth_header = request.headers.get('Authorization', '')
         if auth_header.startswith('Bearer '):
-            token = auth_header.split(' ', 1)[1].strip()
-            token_store.discard(token)
+            # Revogado para todos os workers até expirar (api/_revocation.py)
+            revoke_token(auth_header.split(' ', 1)[1].strip())
         return jsonify({ 'success': True })
 
     @app.post('/api/messages')
     def create_message():
-        data = request.get_json(force=True, silent=True) or {}
-        required = ['name', 'email', 'subject', 'message']
-        missing = [f for f in required if not data.get(f)]
-        if missing:
-            return jsonify({ 'error': f'Campos ausentes: {", ".join(missing)}' }), 400
-
-        db = get_db()
-        db.execute(
-            'INSERT INTO messages (name, email, subject, message, created_at) VALUES (?, ?, ?, ?, ?)',
-            (
-                data['name'].strip(),
-                data['email'].strip(),
-                data['subject'].strip(),
-                data['message'].strip(),
-                datetime.now(timezone.utc).isoformat()
-            )
-        )
-        db.commit()
-        return jsonify({ 'success': True }), 201
+        return create_record('messages')
 
     @app.get('/api/messages')
     def list_messages():
-        if not require_auth():
-            return jsonify({ 'error': 'Não autorizado' }), 401
-        try:
-            page = int(request.args.get('page', '1'))
-            page_size = int(request.args.get('page_size', '10'))
-            page = max(page, 1)
-            page_size = max(min(page_size, 100), 1)
-        except ValueError:
-            return jsonify({ 'error': 'Parâmetros de paginação inválidos' }), 400
-
-        offset = (page - 1) * page_size
-        db = get_db()
-        total = db.execute('SELECT COUNT(1) as c FROM messages').fetchone()['c']
-        rows = db.execute(
-            'SELECT id, name, email, subject, message, created_at FROM messages ORDER BY datetime(created_at) DESC LIMIT ? OFFSET ?',
-            (page_size, offset)
-        ).fetchall()
-        items = [dict(r) for r in rows]
-        return jsonify({ 'items': items, 'total': total, 'page': page, 'page_size': page_size })
+        return list_table('messages')
 
     @app.post('/api/budgets')
     def create_budget():
-        data = request.get_json(force=True, silent=True) or {}
-        required = ['name', 'email', 'phone', 'service', 'details', 'city']
-        missing = [f for f in required if not data.get(f)]
-        if missing:
-            return jsonify({ 'error': f'Campos ausentes: {", ".join(missing)}' }), 400
-
-        db = get_db()
-        db.execute(
-            'INSERT INTO budgets (name, email, phone, service, details, company, city, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (
-                data['name'].strip(),
-                data['email'].strip(),
-                data['phone'].strip(),
-                data['service'].strip(),
-                data['details'].strip(),
-                (data.get('company') or '').strip(),
-                data['city'].strip(),
-                datetime.now(timezone.utc).isoformat()
-            )
-        )
-        db.commit()
-        return jsonify({ 'success': True }), 201
+        return create_record('budgets')
 
     @app.get('/api/budgets')
     def list_budgets():
-        if not require_auth():
-            return jsonify({ 'error': 'Não autorizado' }), 401
-        try:
-            page = int(request.args.get('page', '1'))
-            page_size = int(request.args.get('page_size', '10'))
-            page = max(page, 1)
-            page_size = max(min(page_size, 100), 1)
-        except ValueError:
-            return jsonify({ 'error': 'Parâmetros de paginação inválidos' }), 400
-
-        offset = (page - 1) * page_size
-        db = get_db()
-        total = db.execute('SELECT COUNT(1) as c FROM budgets').fetchone()['c']
-        rows = db.execute(
-            'SELECT id, name, email, phone, service, details, company, city, created_at FROM budgets ORDER BY datetime(created_at) DESC LIMIT ? OFFSET ?',
-            (page_size, offset)
-        ).fetchall()
-        items = [dict(r) for r in rows]
-        return jsonify({ 'items': items, 'total': total, 'page': page, 'page_size': page_size })
+        return list_table('budgets')
 
     return app
 
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Debugger/reloader do Werkzeug só com STARKE_DEBUG=1 (executa código remoto: nunca em produção)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('STARKE_DEBUG', '0') == '1')
 
 
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark do JWT HS256 de api/_jwt_helper.py contra o PyJWT
+
+Mede, em µs por operação (melhor de --repeat rodadas):
+
+- encode: assinatura de um token com o mesmo payload do login
+- verify: decode + checagem de assinatura e claims, sem o cache de tokens
+- verify (cache): verify_token() com o token já no cache do processo
+- import: custo do primeiro import (processo Python novo)
+
+Uso:
+    python benchmark_jwt.py [--number 20000] [--repeat 5]
+
+Sem o PyJWT instalado só o helper é medido.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import timeit
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+
+def _best(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def _import_ms(statement):
+    """Tempo do import em um interpretador novo (cold start)"""
+    code = (f"import sys, time; sys.path.insert(0, {API_DIR!r}); "
+            f"start = time.perf_counter(); {statement}; print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return float(output.stdout) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark do JWT HS256')
+    parser.add_argument('--number', type=int, default=20000, help='Operações por rodada')
+    parser.add_argument('--repeat', type=int, default=5, help='Rodadas (vale a melhor)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, API_DIR)
+    import _jwt_helper as helper
+
+    try:
+        import jwt
+    except ImportError:
+        jwt = None
+
+    key = helper._get_secret_key()
+    now = int(time.time())
+    payload = {'email': 'superadm@starkest.com', 'exp': now + 3600, 'iat': now, 'jti': 'bench'}
+    token = helper.encode(payload)
+
+    if jwt is not None:
+        # Interoperabilidade: cada lado verifica o token do outro
+        assert jwt.decode(token, key, algorithms=['HS256']) == payload
+        assert helper.decode(jwt.encode(payload, key, algorithm='HS256')) == payload
+
+    rows = [
+        ('encode', lambda: helper.encode(payload),
+         (lambda: jwt.encode(payload, key, algorithm='HS256')) if jwt else None),
+        ('verify', lambda: helper.decode(token),
+         (lambda: jwt.decode(token, key, algorithms=['HS256'])) if jwt else None),
+    ]
+    helper.verify_token(token)
+    cached = _best(lambda: helper.verify_token(token), args.number, args.repeat)
+
+    print("=" * 60)
+    print(f"JWT HS256 - {args.number} operações x {args.repeat} rodadas")
+    print("=" * 60)
+    print(f"{'operação':<16} {'helper (µs)':>12} {'PyJWT (µs)':>12} {'ganho':>8}")
+    for name, ours, theirs in rows:
+        mine = _best(ours, args.number, args.repeat)
+        if theirs is None:
+            print(f"{name:<16} {mine:>12.2f} {'-':>12} {'-':>8}")
+            continue
+        other = _best(theirs, args.number, args.repeat)
+        print(f"{name:<16} {mine:>12.2f} {other:>12.2f} {other / mine:>7.1f}x")
+    print(f"{'verify (cache)':<16} {cached:>12.2f}")
+
+    print("-" * 60)
+    mine = _import_ms('import _jwt_helper')
+    line = f"import (ms): helper {mine:.1f}"
+    if jwt is not None:
+        line += f" | PyJWT {_import_ms('import jwt'):.1f}"
+    print(line)
+
+
+if __name__ == '__main__':
+    main()
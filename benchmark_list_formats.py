@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos formatos de resposta das listagens
+
+Compara, para uma página de orçamentos, o tempo de CPU e o tamanho da
+resposta (sem compressão e com gzip) de:
+
+- legado: fetchall() + dict por linha + json.dumps da página inteira
+- objects: streaming de objetos (formato padrão de GET /api/budgets)
+- columnar: streaming com format=columnar (tuplas do cursor, sem dict)
+
+Uso:
+    python benchmark_list_formats.py [--rows 5000] [--page-size 5000] [--repeat 5]
+
+O banco é criado em um diretório temporário; o banco real não é tocado.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+
+def _seed(rows):
+    from _db import init_db, write_db
+
+    init_db()
+    now = datetime.now(timezone.utc)
+    with write_db('budgets') as db:
+        db.executemany(
+            '''
+                INSERT INTO budgets (name, email, phone, service, details, company, city, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            [
+                (
+                    f'Cliente {i}', f'cliente{i}@exemplo.com', f'(11) 9{i:08d}',
+                    ('Residencial', 'Comercial', 'Industrial')[i % 3],
+                    f'Orçamento para instalação número {i}, com visita técnica.',
+                    f'Empresa {i % 50}' if i % 4 else '', ('São Paulo', 'Campinas', 'Santos')[i % 3],
+                    (now - timedelta(minutes=i)).isoformat(),
+                )
+                for i in range(rows)
+            ]
+        )
+
+
+def _legacy(columns, page_size):
+    from _archive import list_records
+    from _db import read_db
+
+    with read_db('budgets') as db:
+        total, rows = list_records(db, 'budgets', columns, page_size, 0)
+    items = [dict(r) for r in rows]
+    return json.dumps({"items": items, "total": total, "page": 1, "page_size": page_size}).encode()
+
+
+def _objects(columns, page_size):
+    from _archive import iter_records
+    from _jsonstream import encode_page
+
+    records = iter_records('budgets', columns, page_size, 0)
+    total = next(records)
+    return b''.join(encode_page(records, total, 1, page_size))
+
+
+def _columnar(columns, page_size):
+    from _archive import iter_records
+    from _jsonstream import encode_columnar
+
+    records = iter_records('budgets', columns, page_size, 0, tuples=True)
+    total = next(records)
+    return b''.join(encode_columnar(records, columns, total, 1, page_size))
+
+
+def _measure(func, columns, page_size, repeat):
+    best = None
+    body = b''
+    for _ in range(repeat):
+        start = time.process_time()
+        body = func(columns, page_size)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dos formatos de listagem')
+    parser.add_argument('--rows', type=int, default=5000, help='Linhas inseridas no banco temporário')
+    parser.add_argument('--page-size', type=int, default=5000, help='Itens por página')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetições (vale o melhor tempo)')
+    args = parser.parse_args()
+
+    os.environ['STARKE_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    sys.path.insert(0, API_DIR)
+
+    from _dal import MAX_PAGE_SIZE, columns as all_columns
+    from _jsonstream import orjson
+
+    page_size = max(1, min(args.page_size, MAX_PAGE_SIZE))
+    _seed(args.rows)
+    columns = all_columns('budgets')
+
+    print("=" * 60)
+    print(f"LISTAGEM DE ORÇAMENTOS - {args.rows} linhas, page_size={page_size}")
+    print(f"Serializador: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    print("=" * 60)
+    print(f"{'formato':<10} {'CPU (ms)':>10} {'bytes':>12} {'gzip':>10}")
+
+    results = {}
+    for name, func in (('legado', _legacy), ('objects', _objects), ('columnar', _columnar)):
+        elapsed, body = _measure(func, columns, page_size, args.repeat)
+        compressed = len(gzip.compress(body, 6))
+        results[name] = (elapsed, len(body), compressed)
+        print(f"{name:<10} {elapsed * 1000:>10.1f} {len(body):>12,} {compressed:>10,}")
+
+    base_cpu, base_bytes, base_gzip = results['legado']
+    cpu, size, compressed = results['columnar']
+    print("-" * 60)
+    print(f"columnar vs legado: CPU {cpu / base_cpu:.0%}, "
+          f"bytes {size / base_bytes:.0%}, gzip {compressed / base_gzip:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,6 @@ def check_imports():
     
     dependencies = {
         'requests': 'requests',
-        'PyJWT': 'jwt',
         'cryptography': 'cryptography'
     }
     
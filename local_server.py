@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Servidor local único para os handlers de api/*.py
+
+Monta os `handler` de health, login, messages, budgets, db_admin, events e
+metrics em um só ThreadingHTTPServer, com roteamento por prefixo do path
+(o mesmo mapeamento de arquivos do Vercel), mais o admin.html e o
+favicon.svg. Tudo roda em um processo: pools de conexão SQLite, cache de
+tokens verificados, métricas e feed de eventos ficam aquecidos entre os
+requests, sem o cold start de cada função serverless.
+
+Uso:
+    python local_server.py --port 3000 --threads 32
+
+- As conexões são atendidas por um número fixo de threads (--threads);
+  as excedentes esperam na fila. Cada stream do /api/events ocupa uma
+  thread enquanto estiver aberto
+- /admin e /admin.html servem o admin.html; /favicon.svg o favicon.svg
+  (relidos quando o arquivo muda)
+"""
+import argparse
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(ROOT_DIR, 'api')
+
+# Prefixo do path -> módulo em api/ com a classe `handler`
+ROUTES = (
+    ('/api/health', 'health'),
+    ('/api/login', 'login'),
+    ('/api/logout', 'login'),
+    ('/api/messages', 'messages'),
+    ('/api/budgets', 'budgets'),
+    ('/api/db-admin', 'db_admin'),
+    ('/api/events', 'events'),
+    ('/api/metrics', 'metrics'),
+)
+
+# Arquivos estáticos da raiz do projeto (inclui a rota /admin do vercel.json)
+STATIC_FILES = {
+    '/admin': ('admin.html', 'text/html; charset=utf-8'),
+    '/admin.html': ('admin.html', 'text/html; charset=utf-8'),
+    '/favicon.svg': ('favicon.svg', 'image/svg+xml'),
+}
+
+log = logging.getLogger('starke.local')
+
+
+def load_routes():
+    """Importa os módulos de api/ uma vez e retorna [(prefixo, classe handler)]"""
+    import importlib
+
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    return [(prefix, importlib.import_module(module).handler) for prefix, module in ROUTES]
+
+
+def resolve(routes, path):
+    """Classe handler do prefixo que casa com o path (None se nenhum)"""
+    for prefix, handler_class in routes:
+        if path == prefix or path.startswith(prefix + '/'):
+            return handler_class
+    return None
+
+
+class _StaticCache:
+    """Conteúdo dos arquivos estáticos em memória, relido quando o mtime muda"""
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Retorna (corpo, etag) ou None se o arquivo não existir"""
+        path = os.path.join(ROOT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        with self._lock:
+            cached = self._files.get(name)
+            if cached is not None and cached[1] == etag:
+                return cached
+        with open(path, 'rb') as f:
+            cached = (f.read(), etag)
+        with self._lock:
+            self._files[name] = cached
+        return cached
+
+
+_STATIC = _StaticCache()
+
+
+class StaticHandler(BaseHTTPRequestHandler):
+    """admin.html, favicon.svg e 404 para qualquer outro path"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        from _http import send_body, send_json
+
+        entry = STATIC_FILES.get(urlparse(self.path).path)
+        cached = _STATIC.get(entry[0]) if entry else None
+        if cached is None:
+            send_json(self, 404, {"error": "Not found"}, "GET, OPTIONS")
+            return
+        body, etag = cached
+        headers = [("ETag", etag), ("Cache-Control", "no-cache")]
+        if self.headers.get('If-None-Match') == etag:
+            send_body(self, 304, None, entry[1], "GET, HEAD, OPTIONS", headers)
+            return
+        if self.command == 'HEAD':
+            # Só os headers (o Content-Length é o do corpo sem compressão)
+            self.send_response(200)
+            self.send_header("Content-type", entry[1])
+            self.send_header("Content-Length", str(len(body)))
+            for header, value in headers:
+                self.send_header(header, value)
+            self.end_headers()
+            return
+        send_body(self, 200, body, entry[1], "GET, HEAD, OPTIONS", headers)
+
+    do_HEAD = do_GET
+
+    def _not_found(self):
+        from _http import send_json
+
+        send_json(self, 404, {"error": "Not found"}, "GET, OPTIONS")
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = _not_found
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
+        self.end_headers()
+
+
+class Router(BaseHTTPRequestHandler):
+    """
+    Lê a linha de request e os headers e passa a conexão para o handler da
+    rota: a instância troca de classe, então o handler do módulo roda sem
+    nenhuma alteração, como no Vercel.
+    """
+    routes = ()
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            # Keep-alive: cada request é roteado de novo
+            self.__class__ = Router
+            self.handle_one_request()
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.__class__ = resolve(self.routes, urlparse(self.path).path) or StaticHandler
+        return True
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer com um número fixo de threads atendendo uma fila de conexões"""
+
+    def __init__(self, server_address, handler_class, threads, backlog=128):
+        self.request_queue_size = backlog
+        self._queue = queue.Queue()
+        super().__init__(server_address, handler_class)
+        for number in range(threads):
+            threading.Thread(target=self._serve_queue, name=f'starke-http-{number}', daemon=True).start()
+
+    def _serve_queue(self):
+        while True:
+            request, client_address = self._queue.get()
+            self.process_request_thread(request, client_address)
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address))
+
+    def server_close(self):
+        super().server_close()
+        # Conexões que ainda esperavam uma thread
+        while True:
+            try:
+                request, _ = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.shutdown_request(request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local com todos os handlers de api/')
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço (padrão: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=3000, help='Porta (padrão: 3000)')
+    parser.add_argument('--threads', type=int, default=32,
+                        help='Threads que atendem as conexões (padrão: 32)')
+    parser.add_argument('--backlog', type=int, default=128, help='Fila de conexões do socket')
+    parser.add_argument('--warm-connections', type=int, default=2,
+                        help='Conexões de leitura abertas ao subir (padrão: 2)')
+    args = parser.parse_args()
+    if args.threads < 1:
+        parser.error('--threads deve ser pelo menos 1')
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
+
+    Router.routes = load_routes()
+    from _db import close_pools, warm_pools
+    warm_pools(args.warm_connections)
+
+    server = PooledHTTPServer((args.host, args.port), Router, args.threads, args.backlog)
+
+    def stop(*_):
+        # shutdown() espera o serve_forever sair: não pode rodar na thread dele
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    log.info('Servidor local em http://%s:%s (%s threads) - admin em /admin',
+             args.host, args.port, args.threads)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close_pools()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Servidor de produção pre-fork para o app.py
+
+O processo mestre abre o socket e cria N workers com fork(); cada worker
+atende com o servidor WSGI com threads do Werkzeug (dependência do Flask),
+com os próprios pools de conexão SQLite já abertos antes do primeiro
+request. Com --reuse-port cada worker abre o próprio socket com
+SO_REUSEPORT e o kernel distribui as conexões.
+
+Uso:
+    python server.py --workers 8 --port 5000 --max-requests 5000
+
+Sinais do mestre:
+- SIGHUP: reload gracioso - sobe uma nova geração de workers (que
+  importam o app de novo, pegando código novo) e encerra a anterior
+- SIGTERM / SIGINT: parada graciosa - os workers param de aceitar
+  conexões e terminam os requests em andamento (até --graceful-timeout)
+- SIGTTIN / SIGTTOU: mais um / menos um worker
+
+Com --max-requests cada worker é reciclado (sai e é substituído) após
+atender esse número de requests, mais um valor aleatório de até
+--max-requests-jitter para que os workers não reciclem todos juntos.
+
+Cada worker avisa o mestre, por um pipe, quando está pronto para atender
+("ready <pid>"); no reload, e na reciclagem com --reuse-port, o worker
+antigo só recebe SIGTERM depois que o próprio substituto está pronto, então
+sempre há um socket escutando. Os sinais (SIGUSR1/SIGUSR2) só acordam o
+mestre: sinais iguais pendentes se fundem em um, as mensagens do pipe não.
+"""
+import argparse
+import errno
+import logging
+import os
+import random
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+# Sinais tratados pelo mestre (SIGUSR1/SIGUSR2: há mensagem de um worker no pipe)
+MASTER_SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU,
+                  signal.SIGUSR1, signal.SIGUSR2, signal.SIGCHLD)
+
+log = logging.getLogger('starke.server')
+
+
+class _RequestCounter:
+    """
+    Middleware WSGI: conta requests atendidos e em andamento (inclui streams)
+    e as conexões já aceitas que ainda não chegaram ao app.
+    """
+
+    def __init__(self, app, on_limit=None, limit=0):
+        self.app = app
+        self.on_limit = on_limit
+        self.limit = limit
+        self.served = 0
+        self.active = 0
+        self.pending = set()
+        self._lock = threading.Lock()
+
+    def track(self, server):
+        """Registra as conexões aceitas pelo servidor até o primeiro request ou o fechamento"""
+        process_request, shutdown_request = server.process_request, server.shutdown_request
+
+        def accepted(request, client_address):
+            with self._lock:
+                self.pending.add(request)
+            process_request(request, client_address)
+
+        def closed(request):
+            with self._lock:
+                self.pending.discard(request)
+            shutdown_request(request)
+
+        server.process_request, server.shutdown_request = accepted, closed
+
+    def busy(self) -> bool:
+        with self._lock:
+            return self.active > 0 or bool(self.pending)
+
+    def _done(self):
+        with self._lock:
+            self.active -= 1
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.pending.discard(environ.get('werkzeug.socket'))
+            self.served += 1
+            self.active += 1
+            reached = self.limit and self.served == self.limit
+        if reached and self.on_limit:
+            self.on_limit()
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return _ClosingIterator(body, self._done)
+
+
+class _ClosingIterator:
+    """Repassa o corpo da resposta e avisa quando o servidor o fecha"""
+
+    def __init__(self, body, callback):
+        self._body = body
+        self._iter = iter(body)
+        self._callback = callback
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._callback()
+
+
+def _listen(host, port, backlog, reuse_port=False):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _drain_accept_queue(server):
+    """
+    Atende as conexões que já estão na fila do socket deste worker.
+
+    Com SO_REUSEPORT cada worker tem a própria fila: fechar o socket com
+    conexões pendentes faria o kernel resetá-las.
+    """
+    server.socket.setblocking(False)
+    while True:
+        try:
+            request, client_address = server.socket.accept()
+        except OSError:
+            return
+        request.setblocking(True)
+        server.process_request(request, client_address)
+
+
+def _notify_master(master_pid, status_fd, message, signum):
+    """Envia "<message> <pid>" pelo pipe de status e acorda o mestre com `signum`"""
+    try:
+        # Linhas menores que PIPE_BUF: a escrita é atômica entre os workers
+        os.write(status_fd, f'{message} {os.getpid()}\n'.encode())
+        os.kill(master_pid, signum)
+    except (BrokenPipeError, ProcessLookupError):
+        pass  # mestre já saiu: o watch_master encerra o worker
+
+
+def _load_app(preloaded=None):
+    if preloaded is not None:
+        return preloaded
+    import app as app_module
+    return app_module.create_app()
+
+
+def _run_worker(args, sock, master_pid, status_fd, preloaded=None):
+    """Loop de um worker (processo filho); retorna o código de saída"""
+    from werkzeug.serving import make_server
+
+    if args.reuse_port:
+        sock = _listen(args.host, args.port, args.backlog, reuse_port=True)
+
+    stopping = threading.Event()
+    server = None
+
+    def stop(*_):
+        if stopping.is_set():
+            return
+        stopping.set()
+        # shutdown() espera o serve_forever sair: não pode rodar na thread dele
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def replace():
+        # Com SO_REUSEPORT o socket deste worker só fecha quando o substituto
+        # já escuta: o mestre manda SIGTERM quando ele estiver pronto
+        _notify_master(master_pid, status_fd, 'limit', signal.SIGUSR1)
+
+    limit = 0
+    if args.max_requests:
+        limit = args.max_requests + random.randint(0, max(args.max_requests_jitter, 0))
+
+    application = _load_app(preloaded)
+    counter = _RequestCounter(application, on_limit=replace if args.reuse_port else stop, limit=limit)
+    server = make_server(args.host, args.port, counter, threaded=True, fd=sock.fileno())
+    counter.track(server)
+    if args.reuse_port:
+        sock.close()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Pools de conexão abertos antes do primeiro request deste processo
+    from _db import warm_pools
+    warm_pools(args.warm_connections)
+
+    def watch_master():
+        while not stopping.wait(1.0):
+            if os.getppid() != master_pid:
+                log.warning('Mestre encerrado; worker %s saindo', os.getpid())
+                stop()
+
+    threading.Thread(target=watch_master, name='watch-master', daemon=True).start()
+    log.info('Worker %s pronto (recicla após %s requests)', os.getpid(), limit or '-')
+    _notify_master(master_pid, status_fd, 'ready', signal.SIGUSR2)
+    # Loop do socketserver: o serve_forever do Werkzeug fecha o socket ao
+    # sair, antes de a fila de conexões ser atendida
+    socketserver.BaseServer.serve_forever(server)
+    if args.reuse_port:
+        _drain_accept_queue(server)
+    # Fecha o socket de escuta logo: conexões novas vão para os outros workers
+    server.server_close()
+
+    # Espera os requests em andamento e as conexões aceitas chegarem ao app
+    # (keep-alive ocioso depois disso não segura o worker)
+    deadline = time.monotonic() + args.graceful_timeout
+    while counter.busy() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if counter.busy():
+        log.warning('Worker %s saindo com %s requests em andamento', os.getpid(), counter.active)
+    log.info('Worker %s encerrado após %s requests', os.getpid(), counter.served)
+    return 0
+
+
+class Master:
+    """Processo mestre: cria, recicla e recarrega os workers"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}
+        self.target = args.workers
+        self.sock = None
+        self.preloaded = None
+        # Workers que saem quando o substituto avisar que está pronto
+        self.retiring = []
+        # pid do substituto -> pid do worker que ele substitui
+        self.replacing = {}
+        # Pipe de status dos workers ("ready <pid>", "limit <pid>")
+        self.status_r = self.status_w = None
+        self._status_buffer = b''
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+        # Processo filho
+        code = 1
+        try:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+            os.close(self.status_r)
+            code = _run_worker(self.args, self.sock, os.getppid(), self.status_w, self.preloaded)
+        except Exception:
+            log.exception('Falha no worker %s', os.getpid())
+        finally:
+            logging.shutdown()
+            os._exit(code)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            started = self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.remove(pid)
+            if started is not None and os.waitstatus_to_exitcode(status) != 0:
+                log.warning('Worker %s saiu com status %s', pid, os.waitstatus_to_exitcode(status))
+                # Falha logo ao subir (ex: erro de import): evita loop de fork
+                if time.monotonic() - started < 1.0:
+                    time.sleep(1.0)
+            old = self.replacing.pop(pid, None)
+            if old is not None and old in self.retiring:
+                # Substituto saiu antes de ficar pronto: o antigo continua
+                # atendendo até um novo substituto subir
+                self.retiring.remove(old)
+                self._retire([old])
+
+    def _kill(self, pids, signum=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _retire(self, pids):
+        """Sobe um substituto para cada worker; o antigo sai quando o novo estiver pronto"""
+        for pid in pids:
+            if pid in self.workers and pid not in self.retiring:
+                self.retiring.append(pid)
+                self.replacing[self._spawn()] = pid
+
+    def _ready(self, pid):
+        old = self.replacing.pop(pid, None)
+        if old is not None and old in self.retiring:
+            self._kill([old])
+
+    def _read_status(self):
+        """Processa as mensagens dos workers que chegaram pelo pipe"""
+        while True:
+            try:
+                chunk = os.read(self.status_r, 4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            self._status_buffer += chunk
+        *lines, self._status_buffer = self._status_buffer.split(b'\n')
+        for line in lines:
+            message, _, pid = line.decode().partition(' ')
+            if not pid.isdigit():
+                continue
+            if message == 'ready':
+                self._ready(int(pid))
+            elif message == 'limit':
+                self._retire([int(pid)])
+
+    def _reload(self):
+        log.info('Reload: nova geração de %s workers', self.target)
+        self._retire([pid for pid in self.workers if pid not in self.retiring])
+
+    def _stop(self):
+        log.info('Parando %s workers', len(self.workers))
+        # Substitutos que saírem agora não devem gerar outros
+        self.replacing.clear()
+        self._kill(list(self.workers))
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        self._kill(list(self.workers), signal.SIGKILL)
+        self._reap()
+
+    def run(self):
+        if not self.args.reuse_port:
+            self.sock = _listen(self.args.host, self.args.port, self.args.backlog)
+        self.status_r, self.status_w = os.pipe()
+        os.set_blocking(self.status_r, False)
+        if self.args.preload:
+            # Carrega o app uma vez no mestre (memória compartilhada por copy-on-write);
+            # o reload (SIGHUP) passa a não pegar código novo
+            self.preloaded = _load_app()
+
+        # Sinais bloqueados e lidos com sigtimedwait: dá o pid de quem enviou
+        signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+
+        log.info('Mestre %s em http://%s:%s com %s workers', os.getpid(),
+                 self.args.host, self.args.port, self.target)
+        while True:
+            # Workers que faltam (recicladas ou que caíram) são repostos
+            self._reap()
+            while len(self.workers) - len(self.retiring) < self.target:
+                self._spawn()
+
+            info = signal.sigtimedwait(MASTER_SIGNALS, 1.0)
+            # Lido a cada volta: SIGUSR1/SIGUSR2 de vários workers viram um só sinal
+            self._read_status()
+            if info is None or info.si_signo in (signal.SIGCHLD, signal.SIGUSR1, signal.SIGUSR2):
+                continue
+            signum = info.si_signo
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                self._stop()
+                return 0
+            if signum == signal.SIGHUP:
+                self._reload()
+            elif signum == signal.SIGTTIN:
+                self.target += 1
+            elif signum == signal.SIGTTOU and self.target > 1:
+                self.target -= 1
+                self._kill([pid for pid in self.workers if pid not in self.retiring][:1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor pre-fork do app.py')
+    parser.add_argument('--host', default='0.0.0.0', help='Endereço (padrão: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5000, help='Porta (padrão: 5000)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processos worker (padrão: número de CPUs)')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='Recicla cada worker após N requests (padrão: 0, nunca)')
+    parser.add_argument('--max-requests-jitter', type=int, default=0,
+                        help='Soma até N requests aleatórios ao limite de cada worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='Segundos para terminar os requests em andamento ao parar (padrão: 30)')
+    parser.add_argument('--backlog', type=int, default=2048, help='Fila de conexões do socket')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='Um socket por worker com SO_REUSEPORT (o kernel distribui as conexões)')
+    parser.add_argument('--preload', action='store_true',
+                        help='Importa o app no mestre antes do fork')
+    parser.add_argument('--warm-connections', type=int, default=2,
+                        help='Conexões de leitura abertas por worker ao subir (padrão: 2)')
+    parser.add_argument('--access-log', action='store_true', help='Loga cada request')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        parser.error('O servidor pre-fork precisa de fork() (Linux/macOS)')
+    if args.reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('SO_REUSEPORT não disponível nesta plataforma')
+    if args.workers < 1:
+        parser.error('--workers deve ser pelo menos 1')
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] %(message)s')
+    logging.getLogger('werkzeug').setLevel(logging.INFO if args.access_log else logging.WARNING)
+    sys.path.insert(0, API_DIR)
+    return Master(args).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
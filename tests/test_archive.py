@@ -0,0 +1,100 @@
+"""
+Arquivamento: intervalos com mais meses do que cabem em uma conexão e busca por id
+
+Uso:
+    python -m unittest tests.test_archive
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ.setdefault('STARKE_DB_PATH', os.path.join(_TMP, 'database.sqlite3'))
+os.environ.setdefault('STARKE_ARCHIVE_DIR', os.path.join(_TMP, 'archive'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _dal  # noqa: E402
+from _archive import (  # noqa: E402
+    MAX_ATTACHED_ARCHIVES, archive_old_rows, get_archived, list_archive_months, open_records,
+    parse_date_range,
+)
+from _db import init_db, read_db, write_db  # noqa: E402
+
+MONTHS = MAX_ATTACHED_ARCHIVES + 6
+
+
+class ArchiveRangeTest(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree(os.environ['STARKE_ARCHIVE_DIR'], ignore_errors=True)
+        init_db()
+        with write_db('messages') as db:
+            db.execute('DELETE FROM messages')
+            # Duas linhas por mês em 2020-2021 e duas recentes
+            for index in range(MONTHS):
+                year, month = 2020 + index // 12, index % 12 + 1
+                for day in (5, 20):
+                    row = _dal.insert(db, 'messages', {
+                        'name': f'{year}-{month:02d}-{day:02d}', 'email': 'a@example.com',
+                        'subject': 'Teste', 'message': 'Olá',
+                    })
+                    db.execute('UPDATE messages SET created_at = ? WHERE id = ?',
+                               (f'{year}-{month:02d}-{day:02d}T12:00:00+00:00', row['id']))
+            for index in range(2):
+                _dal.insert(db, 'messages', {'name': f'recente{index}', 'email': 'a@example.com',
+                                             'subject': 'Teste', 'message': 'Olá'})
+        archive_old_rows(30)
+        self.assertEqual(len(list_archive_months()), MONTHS)
+
+    def _page(self, page_size, offset, tuples=False):
+        with read_db('messages') as db:
+            with open_records(db, 'messages', 'id, name', page_size, offset,
+                              '2019-01-01', '2100-01-01', tuples) as (total, cursor):
+                return total, [tuple(row) for row in cursor]
+
+    def test_range_wider_than_attach_limit_lists_every_row_in_order(self):
+        total, rows = self._page(1000, 0)
+        self.assertEqual(total, MONTHS * 2 + 2)
+        names = [row[1] for row in rows]
+        self.assertEqual(names[:2], ['recente1', 'recente0'] if names[0] == 'recente1' else ['recente0', 'recente1'])
+        archived = names[2:]
+        self.assertEqual(archived, sorted(archived, reverse=True))
+        self.assertEqual(len(archived), MONTHS * 2)
+
+    def test_pages_across_batches_match_the_full_listing(self):
+        _, full = self._page(1000, 0)
+        paged = []
+        for offset in range(0, len(full), 7):
+            paged.extend(self._page(7, offset, tuples=True)[1])
+        self.assertEqual(paged, full)
+
+    def test_archived_row_is_found_by_id(self):
+        with read_db('messages') as db:
+            self.assertIsNone(db.execute("SELECT id FROM messages WHERE name = '2020-03-05'").fetchone())
+        _, rows = self._page(1000, 0)
+        record_id = next(row[0] for row in rows if row[1] == '2020-03-05')
+        item = get_archived('messages', record_id)
+        self.assertEqual(item['name'], '2020-03-05')
+        self.assertEqual(item['message'], 'Olá')
+        self.assertIsNone(get_archived('messages', 10 ** 9))
+
+
+class ParseDateRangeTest(unittest.TestCase):
+    def test_date_without_time_includes_the_whole_day(self):
+        for value in ('2024-01-01', '20240101'):
+            self.assertEqual(parse_date_range(None, value), (None, '2024-01-02'))
+
+    def test_date_with_time_is_an_exclusive_bound(self):
+        self.assertEqual(parse_date_range(None, '2024-01-01T10:00'), (None, '2024-01-01T10:00:00'))
+
+    def test_non_string_values_raise_value_error(self):
+        for bad in (20240101, ['2024-01-01'], {'y': 2024}):
+            with self.assertRaises(ValueError):
+                parse_date_range(bad, None)
+            with self.assertRaises(ValueError):
+                parse_date_range(None, bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Cadeia de backup incremental com arquivamento entre a base e o incremento
+
+Uso:
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _dal  # noqa: E402
+from _archive import archive_old_rows, open_records  # noqa: E402
+from _backup import _checksum, backup_position, incremental_backup, restore_chain, verify_chain  # noqa: E402
+from _changes import delta  # noqa: E402
+from _db import backup_db, init_db, read_db, write_db  # noqa: E402
+
+
+def _message(name):
+    return {'name': name, 'email': f'{name}@example.com', 'subject': 'Teste', 'message': 'Olá'}
+
+
+def _ids(db):
+    return [row[0] for row in db.execute('SELECT id FROM messages ORDER BY id')]
+
+
+class ArchiveBackupChainTest(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree(os.environ['STARKE_ARCHIVE_DIR'], ignore_errors=True)
+        init_db()
+        with write_db('messages') as db:
+            db.execute('DELETE FROM messages')
+            old = [_dal.insert(db, 'messages', _message(f'antigo{n}'))['id'] for n in range(2)]
+            for n in range(2):
+                _dal.insert(db, 'messages', _message(f'recente{n}'))
+            db.execute(
+                f'UPDATE messages SET created_at = ? WHERE id IN ({", ".join("?" * len(old))})',
+                ['2020-01-15T00:00:00+00:00'] + old
+            )
+        self.archived = old
+        self.base = backup_db()
+        self.since = backup_position(self.base)
+
+    def test_archived_rows_are_deleted_in_increment_and_restore(self):
+        result = archive_old_rows(30)
+        self.assertEqual(sum(result['moved']['messages'].values()), 2)
+        with write_db('messages') as db:
+            _dal.insert(db, 'messages', _message('novo'))
+
+        increment = incremental_backup(self.since)
+        self.assertEqual(increment['tables']['messages']['deleted'], self.archived)
+
+        report = verify_chain(self.base, [increment], compare=True)
+        self.assertTrue(report['valid'], report['errors'])
+
+        restore_chain(self.base, [increment])
+        with read_db('messages') as db:
+            hot = _ids(db)
+            self.assertEqual(len(hot), 3)
+            self.assertFalse(set(hot) & set(self.archived))
+            # Listagem que inclui os meses arquivados: cada linha uma única vez
+            with open_records(db, 'messages', 'id', 100, 0, '2020-01-01', '2100-01-01') as (total, cursor):
+                listed = [row['id'] for row in cursor]
+        self.assertEqual(total, 5)
+        self.assertEqual(len(listed), len(set(listed)))
+
+    def test_delta_reports_archived_rows_as_deleted(self):
+        since = int(self.since.split(':')[1])
+        archive_old_rows(30)
+        with read_db('messages') as db:
+            changes = delta(db, 'messages', since, 'id, name', 100)
+        self.assertEqual(changes['deleted'], self.archived)
+
+    def test_compare_mismatch_invalidates_chain(self):
+        with write_db('messages') as db:
+            _dal.insert(db, 'messages', _message('fora-da-cadeia'))
+        report = verify_chain(self.base, [], compare=True)
+        self.assertFalse(report['valid'])
+        self.assertFalse(report['tables']['messages']['matches_live'])
+
+    def test_malformed_increment_is_reported_not_raised(self):
+        increment = incremental_backup(self.since)
+        for field, value in (('from', 1), ('to', ['x']), ('tables', 'x')):
+            broken = dict(increment, **{field: value})
+            broken['checksum'] = _checksum(broken)
+            report = verify_chain(self.base, [broken])
+            self.assertFalse(report['valid'], field)
+            self.assertTrue(report['errors'], field)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+Sincronização incremental (since=) e token expirado após a compactação
+
+Uso:
+    python -m unittest discover tests
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from urllib.parse import quote
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _dal  # noqa: E402
+import messages  # noqa: E402
+from _changes import SyncTokenExpired, compact, delta, horizon, parse_since, sync_token  # noqa: E402
+from _db import init_db, read_db, write_db  # noqa: E402
+from _jwt_helper import generate_token  # noqa: E402
+
+_COLUMNS = 'id, name, message'
+
+
+def _message(name):
+    return {'name': name, 'email': f'{name}@example.com', 'subject': 'Teste', 'message': 'Olá'}
+
+
+def _since():
+    with read_db('messages') as db:
+        return parse_since(sync_token(db, 'messages'), 'messages')
+
+
+def _delta(since, limit=100):
+    with read_db('messages') as db:
+        return delta(db, 'messages', since, _COLUMNS, limit)
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        init_db()
+
+    def test_changes_since_token(self):
+        with write_db('messages') as db:
+            kept = _dal.insert(db, 'messages', _message('ana'))
+            removed = _dal.insert(db, 'messages', _message('bia'))
+        since = _since()
+        unchanged = _delta(since)
+        self.assertEqual((unchanged['items'], unchanged['deleted']), ([], []))
+
+        with write_db('messages') as db:
+            _dal.patch(db, 'messages', kept['id'], {'name': 'ana2'})
+            _dal.patch(db, 'messages', kept['id'], {'name': 'ana3'})
+            _dal.delete(db, 'messages', removed['id'])
+            added = _dal.insert(db, 'messages', _message('caio'))
+
+        result = _delta(since)
+        # Várias alterações do mesmo registro viram o estado atual da linha
+        self.assertEqual(
+            [(item['id'], item['name']) for item in result['items']],
+            [(kept['id'], 'ana3'), (added['id'], 'caio')]
+        )
+        self.assertEqual(result['deleted'], [removed['id']])
+        self.assertFalse(result['has_more'])
+
+        # O novo token não repete nada
+        next_since = parse_since(result['sync_token'], 'messages')
+        self.assertEqual(_delta(next_since)['items'], [])
+
+    def test_has_more_pages(self):
+        since = _since()
+        with write_db('messages') as db:
+            ids = [_dal.insert(db, 'messages', _message(f'lote{n}'))['id'] for n in range(5)]
+
+        seen = []
+        result = {'has_more': True, 'sync_token': None}
+        while result['has_more']:
+            result = _delta(since, limit=2)
+            seen.extend(item['id'] for item in result['items'])
+            since = parse_since(result['sync_token'], 'messages')
+        self.assertEqual(seen, ids)
+
+    def test_token_before_horizon_is_expired(self):
+        since = _since()
+        with write_db('messages') as db:
+            _dal.insert(db, 'messages', _message('davi'))
+        with write_db('messages') as db:
+            # Retenção negativa: tudo o que já está no log fica antes do corte
+            self.assertGreater(compact(db, retention_days=-1)['expired'], 0)
+
+        with read_db('messages') as db:
+            self.assertGreater(horizon(db), since)
+        with self.assertRaises(SyncTokenExpired):
+            _delta(since)
+        # Token do futuro (ex: banco restaurado) também exige ressincronizar
+        with self.assertRaises(SyncTokenExpired):
+            _delta(_since() + 1000)
+        self.assertEqual(_delta(_since())['items'], [])
+
+    def test_invalid_tokens(self):
+        for token in ('', 'abc', 'outro:5', 'main:x'):
+            with self.assertRaises(ValueError):
+                parse_since(token, 'messages')
+        self.assertEqual(parse_since('42', 'messages'), 42)
+
+
+class MessagesSinceEndpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), messages.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.token = generate_token()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _get(self, path):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            conn.request('GET', path, headers={'Authorization': f'Bearer {self.token}'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_since_then_410_after_compaction(self):
+        status, body = self._get('/api/messages?page_size=1')
+        self.assertEqual(status, 200)
+        token = body['sync_token']
+
+        with write_db('messages') as db:
+            item = _dal.insert(db, 'messages', _message('eva'))
+        status, body = self._get(f'/api/messages?since={quote(token)}')
+        self.assertEqual(status, 200)
+        self.assertEqual([row['id'] for row in body['items']], [item['id']])
+
+        with write_db('messages') as db:
+            compact(db, retention_days=-1)
+        status, body = self._get(f'/api/messages?since={quote(token)}')
+        self.assertEqual(status, 410)
+        self.assertTrue(body['resync'])
+
+        self.assertEqual(self._get('/api/messages?since=invalido')[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Idempotency-Key: repetição devolve a resposta original, outro corpo é conflito
+
+Uso:
+    python -m unittest discover tests
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _idempotency  # noqa: E402
+import _ratelimit  # noqa: E402
+import messages  # noqa: E402
+from _db import init_db, read_db, write_db  # noqa: E402
+from _idempotency import IdempotencyConflict, claim, lookup, remember, request_hash, store  # noqa: E402
+
+
+def _message(name):
+    return {'name': name, 'email': f'{name}@example.com', 'subject': 'Teste', 'message': 'Olá'}
+
+
+class ClaimTest(unittest.TestCase):
+    def setUp(self):
+        init_db()
+        _idempotency.clear_cache()
+
+    def test_replay_returns_stored_response(self):
+        fingerprint = request_hash(_message('ana'))
+        with write_db('messages') as db:
+            self.assertIsNone(claim(db, 'messages', 'chave-replay', fingerprint))
+            store(db, 'messages', 'chave-replay', 201, {'id': 7})
+
+        with write_db('messages') as db:
+            self.assertEqual(claim(db, 'messages', 'chave-replay', fingerprint), (201, {'id': 7}))
+        # O replay pelo banco também aquece o LRU
+        self.assertEqual(lookup('messages', 'chave-replay', fingerprint), (201, {'id': 7}))
+
+    def test_other_body_is_a_conflict(self):
+        with write_db('messages') as db:
+            claim(db, 'messages', 'chave-conflito', request_hash(_message('ana')))
+            store(db, 'messages', 'chave-conflito', 201, {'id': 1})
+        remember('messages', 'chave-conflito', request_hash(_message('ana')), 201, {'id': 1})
+
+        other = request_hash(_message('bia'))
+        with self.assertRaises(IdempotencyConflict):
+            lookup('messages', 'chave-conflito', other)
+        _idempotency.clear_cache()
+        with self.assertRaises(IdempotencyConflict), write_db('messages') as db:
+            claim(db, 'messages', 'chave-conflito', other)
+
+    def test_key_order_does_not_change_fingerprint(self):
+        self.assertEqual(request_hash({'a': 1, 'b': 2}), request_hash({'b': 2, 'a': 1}))
+
+    def test_scopes_are_independent(self):
+        fingerprint = request_hash(_message('ana'))
+        with write_db('messages') as db:
+            claim(db, 'messages', 'chave-escopo', fingerprint)
+            store(db, 'messages', 'chave-escopo', 201, {'id': 1})
+            self.assertIsNone(claim(db, 'budgets', 'chave-escopo', fingerprint))
+
+
+class MessagesEndpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), messages.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _ratelimit.reset()
+        _idempotency.clear_cache()
+
+    def _post(self, data, key):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            conn.request('POST', '/api/messages', json.dumps(data), {
+                'Content-Type': 'application/json', 'Idempotency-Key': key
+            })
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), json.loads(response.read())
+        finally:
+            conn.close()
+
+    def _count(self, name):
+        with read_db('messages') as db:
+            return db.execute('SELECT COUNT(*) FROM messages WHERE name = ?', (name,)).fetchone()[0]
+
+    def test_repeated_post_is_replayed(self):
+        status, headers, first = self._post(_message('carla'), 'post-1')
+        self.assertEqual(status, 201)
+        self.assertNotIn('Idempotent-Replayed', headers)
+
+        status, headers, second = self._post(_message('carla'), 'post-1')
+        self.assertEqual(status, 201)
+        self.assertEqual(headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(second, first)
+        self.assertEqual(self._count('carla'), 1)
+
+        # Sem o LRU (outro worker) a resposta vem do banco
+        _idempotency.clear_cache()
+        status, headers, third = self._post(_message('carla'), 'post-1')
+        self.assertEqual((status, headers['Idempotent-Replayed'], third), (201, 'true', first))
+        self.assertEqual(self._count('carla'), 1)
+
+    def test_same_key_with_other_body_is_422(self):
+        self.assertEqual(self._post(_message('davi'), 'post-2')[0], 201)
+        status, _, body = self._post(_message('edu'), 'post-2')
+        self.assertEqual(status, 422)
+        self.assertIn('error', body)
+        self.assertEqual(self._count('edu'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+JWT HS256 próprio: assinatura, exp/nbf/iat com tolerância e tokens adulterados
+
+Uso:
+    python -m unittest discover tests
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _jwt_helper  # noqa: E402
+from _jwt_helper import ExpiredToken, InvalidToken, decode, encode, generate_token, verify_token  # noqa: E402
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+
+def _segment(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b'=').decode()
+
+
+class EncodeDecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        payload = {'email': 'admin', 'exp': int(time.time()) + 60, 'jti': 'abc'}
+        token = encode(payload)
+        self.assertEqual(token.count('.'), 2)
+        self.assertEqual(decode(token), payload)
+        self.assertEqual(decode(token.encode('ascii')), payload)
+
+    def test_generated_token_verifies(self):
+        payload = verify_token(generate_token('ana@example.com'))
+        self.assertEqual(payload['email'], 'ana@example.com')
+        self.assertGreater(payload['exp'], time.time())
+        self.assertTrue(payload['jti'])
+
+    def test_expired_token(self):
+        exp = time.time() - 10
+        token = encode({'exp': exp})
+        with self.assertRaises(ExpiredToken):
+            decode(token)
+        # ExpiredToken é um InvalidToken: verify_token só devolve None
+        self.assertIsNone(verify_token(token))
+        # Dentro da tolerância de relógio ainda vale
+        self.assertEqual(decode(token, leeway=30), {'exp': exp})
+        with self.assertRaises(ExpiredToken):
+            decode(token, leeway=5)
+
+    def test_not_before_and_issued_at(self):
+        future = time.time() + 10
+        for claim in ('nbf', 'iat'):
+            token = encode({'exp': future + 60, claim: future})
+            with self.assertRaises(InvalidToken) as ctx:
+                decode(token)
+            self.assertNotIsInstance(ctx.exception, ExpiredToken)
+            self.assertEqual(decode(token, leeway=30)[claim], future)
+
+    def test_invalid_claims(self):
+        for payload in ({}, {'exp': 'amanhã'}, {'exp': True}, {'exp': time.time() + 60, 'jti': ''}):
+            with self.assertRaises(InvalidToken):
+                decode(encode(payload))
+        with self.assertRaises(InvalidToken):
+            decode(encode([1, 2]))
+
+    def test_bad_signature_and_tampering(self):
+        token = encode({'email': 'admin', 'exp': time.time() + 60})
+        header, body, signature = token.split('.')
+        tampered = _segment({'email': 'root', 'exp': time.time() + 60})
+        flipped = ('A' if signature[0] != 'A' else 'B') + signature[1:]
+        for bad in (f'{header}.{tampered}.{signature}', f'{header}.{body}.{flipped}', f'{header}.{body}.'):
+            with self.assertRaises(InvalidToken):
+                decode(bad)
+            self.assertIsNone(verify_token(bad))
+
+    def test_malformed_tokens(self):
+        for bad in ('', 'a.b', 'a.b.c.d', '!!!.@@@.###', 'só.texto.ç'):
+            with self.assertRaises(InvalidToken):
+                decode(bad)
+
+    def test_other_algorithms_are_rejected(self):
+        body = _segment({'email': 'admin', 'exp': time.time() + 60})
+        with self.assertRaises(InvalidToken):
+            decode(f'{_segment({"alg": "none", "typ": "JWT"})}.{body}.')
+        with self.assertRaises(InvalidToken):
+            decode(f'{_segment({"alg": "HS512", "typ": "JWT"})}.{body}.x')
+
+    @unittest.skipIf(jwt is None, 'PyJWT não instalado')
+    def test_compatible_with_pyjwt(self):
+        payload = {'email': 'admin', 'exp': int(time.time()) + 60}
+        key = _jwt_helper._get_secret_key()
+        self.assertEqual(jwt.decode(encode(payload), key, algorithms=['HS256']), payload)
+        self.assertEqual(decode(jwt.encode(payload, key, algorithm='HS256', headers={'kid': '1'})), payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Etapas medidas nas listagens em streaming (db, json, compress, write)
+
+Uso:
+    python -m unittest discover tests
+"""
+import gzip
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _dal  # noqa: E402
+import _metrics  # noqa: E402
+import messages  # noqa: E402
+from _db import init_db, write_db  # noqa: E402
+from _jwt_helper import generate_token  # noqa: E402
+from _metrics import timed_iter  # noqa: E402
+
+
+def _stage(stage):
+    """(count, sum) do histograma starke_stage_seconds da etapa"""
+    with _metrics._LOCK:
+        hist = _metrics._HISTOGRAMS.get(_metrics._key('starke_stage_seconds', {'stage': stage}))
+        return (hist.count, hist.sum) if hist is not None else (0, 0.0)
+
+
+def _wait_for_write(count):
+    """O cliente pode ler o fim do corpo antes de send_stream registrar a escrita"""
+    deadline = time.monotonic() + 5
+    while _stage('write')[0] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _slow(items, seconds):
+    for item in items:
+        time.sleep(seconds)
+        yield item
+
+
+@unittest.skipUnless(_metrics.ENABLED, 'STARKE_METRICS=0')
+class TimedIterTest(unittest.TestCase):
+    def test_records_once_when_exhausted(self):
+        before = _stage('teste-unico')
+        items = timed_iter(_slow([1, 2, 3], 0.01), 'teste-unico')
+        self.assertEqual(_stage('teste-unico'), before)
+        self.assertEqual(list(items), [1, 2, 3])
+        count, total = _stage('teste-unico')
+        self.assertEqual(count, before[0] + 1)
+        self.assertGreaterEqual(total - before[1], 0.03)
+        items.close()
+        self.assertEqual(_stage('teste-unico')[0], count)
+
+    def test_exclude_discounts_inner_stage(self):
+        inner = timed_iter(_slow(range(3), 0.02), 'teste-interno')
+        outer = timed_iter(_slow(inner, 0.005), 'teste-externo', exclude=inner)
+        list(outer)
+        self.assertGreaterEqual(_stage('teste-interno')[1], 0.06)
+        outer_time = _stage('teste-externo')[1]
+        self.assertGreaterEqual(outer_time, 0.015)
+        self.assertLess(outer_time, 0.06)
+
+    def test_close_records_interrupted_stream(self):
+        before = _stage('teste-fechado')[0]
+        items = timed_iter(_slow(range(10), 0), 'teste-fechado')
+        next(items)
+        items.close()
+        self.assertEqual(_stage('teste-fechado')[0], before + 1)
+
+    def test_error_is_recorded_and_raised(self):
+        def failing():
+            yield 1
+            raise RuntimeError('falhou')
+
+        before = _stage('teste-erro')[0]
+        with self.assertRaises(RuntimeError):
+            list(timed_iter(failing(), 'teste-erro'))
+        self.assertEqual(_stage('teste-erro')[0], before + 1)
+
+
+@unittest.skipUnless(_metrics.ENABLED, 'STARKE_METRICS=0')
+class StreamingListStagesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        with write_db('messages') as db:
+            for n in range(30):
+                _dal.insert(db, 'messages', {
+                    'name': f'lista{n}', 'email': f'lista{n}@example.com', 'subject': 'Teste', 'message': 'Olá ' * 50
+                })
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), messages.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.token = generate_token()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _get(self, path, headers=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            conn.request('GET', path, headers={'Authorization': f'Bearer {self.token}', **(headers or {})})
+            response = conn.getresponse()
+            return response.getheader('Content-Encoding'), response.read()
+        finally:
+            conn.close()
+
+    def test_list_records_json_and_write_stages(self):
+        before = {stage: _stage(stage)[0] for stage in ('db', 'json', 'write', 'compress')}
+        encoding, body = self._get('/api/messages?page_size=20')
+        self.assertIsNone(encoding)
+        self.assertEqual(len(json.loads(body)['items']), 20)
+        # db/json/compress terminam antes do último bloco; write é registrado por último
+        _wait_for_write(before['write'] + 1)
+        after = {stage: _stage(stage)[0] for stage in before}
+        self.assertEqual(after['json'], before['json'] + 1)
+        self.assertEqual(after['write'], before['write'] + 1)
+        # Contagem total + linhas em streaming
+        self.assertGreaterEqual(after['db'], before['db'] + 2)
+        self.assertEqual(after['compress'], before['compress'])
+
+    def test_compressed_list_records_compress_stage(self):
+        before = _stage('compress')[0]
+        writes = _stage('write')[0]
+        encoding, body = self._get('/api/messages?page_size=20', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(body))['items']), 20)
+        _wait_for_write(writes + 1)
+        self.assertEqual(_stage('compress')[0], before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Compressão transparente de messages.message / budgets.details
+
+Uso:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _dal  # noqa: E402
+import _packing  # noqa: E402
+from _db import init_db, read_db, write_db  # noqa: E402
+from _packing import MARKER_ZLIB, MARKER_ZSTD, PackedValueError, pack, unpack  # noqa: E402
+
+_LONG = ' '.join(['Olá, gostaria de um orçamento para a reforma da cozinha.'] * 20)
+
+
+def _message(name, text=_LONG):
+    return {'name': name, 'email': f'{name}@example.com', 'subject': 'Teste', 'message': text}
+
+
+class PackTest(unittest.TestCase):
+    def test_zlib_round_trip(self):
+        with mock.patch.object(_packing, 'ALGORITHM', 'zlib'):
+            packed = pack(_LONG)
+        self.assertIsInstance(packed, bytes)
+        self.assertEqual(packed[0], MARKER_ZLIB)
+        self.assertLess(len(packed), len(_LONG.encode('utf-8')))
+        self.assertEqual(unpack(packed), _LONG)
+
+    @unittest.skipIf(_packing.zstandard is None, 'zstandard não instalado')
+    def test_zstd_round_trip(self):
+        with mock.patch.object(_packing, 'ALGORITHM', 'zstd'):
+            packed = pack(_LONG)
+        self.assertEqual(packed[0], MARKER_ZSTD)
+        self.assertEqual(unpack(packed), _LONG)
+
+    def test_values_kept_as_text(self):
+        with mock.patch.object(_packing, 'ALGORITHM', 'zlib'):
+            # Abaixo de MIN_BYTES e valores que não são texto
+            self.assertEqual(pack('oi'), 'oi')
+            self.assertIsNone(pack(None))
+            # Comprimido + marcador não ficaria menor
+            with mock.patch.object(_packing, 'MIN_BYTES', 1):
+                self.assertEqual(pack('xyz'), 'xyz')
+        with mock.patch.object(_packing, 'ALGORITHM', ''):
+            self.assertEqual(pack(_LONG), _LONG)
+        self.assertEqual(unpack('texto'), 'texto')
+        self.assertIsNone(unpack(None))
+
+    def test_unknown_marker(self):
+        with self.assertRaises(PackedValueError):
+            unpack(b'\x7fdados')
+        with mock.patch.object(_packing, 'zstandard', None), self.assertRaises(PackedValueError):
+            unpack(bytes((MARKER_ZSTD,)) + b'dados')
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        init_db()
+        patcher = mock.patch.object(_packing, 'ALGORITHM', 'zlib')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stored_type(self, record_id):
+        with read_db('messages') as db:
+            return db.execute('SELECT typeof(message) FROM messages WHERE id = ?', (record_id,)).fetchone()[0]
+
+    def test_insert_stores_blob_and_reads_text(self):
+        with write_db('messages') as db:
+            item = _dal.insert(db, 'messages', _message('ana'))
+            short = _dal.insert(db, 'messages', _message('bia', 'Curta'))
+        self.assertEqual(item['message'], _LONG)
+        self.assertEqual(self._stored_type(item['id']), 'blob')
+        self.assertEqual(self._stored_type(short['id']), 'text')
+        with read_db('messages') as db:
+            self.assertEqual(_dal.get(db, 'messages', item['id'])['message'], _LONG)
+            row = _packing.unpack_cursor(
+                db.execute('SELECT id, message FROM messages WHERE id = ?', (item['id'],)),
+                'messages', 'id, message', tuples=True
+            ).fetchone()
+        self.assertEqual(row, (item['id'], _LONG))
+
+    def test_compress_existing_migrates_plain_rows(self):
+        with mock.patch.object(_packing, 'ALGORITHM', ''), write_db('messages') as db:
+            item = _dal.insert(db, 'messages', _message('caio'))
+        self.assertEqual(self._stored_type(item['id']), 'text')
+
+        result = _dal.compress_existing(tables=['messages'], batch_size=2)
+        self.assertTrue(result['messages']['done'])
+        self.assertGreaterEqual(result['messages']['compressed'], 1)
+        self.assertEqual(self._stored_type(item['id']), 'blob')
+        with read_db('messages') as db:
+            self.assertEqual(_dal.get(db, 'messages', item['id'])['message'], _LONG)
+            self.assertGreaterEqual(_dal.compression_stats(db, 'messages')['compressed'], 1)
+
+    def test_disabled_compression_still_reads_blobs(self):
+        with write_db('messages') as db:
+            item = _dal.insert(db, 'messages', _message('davi'))
+        with mock.patch.object(_packing, 'ALGORITHM', ''):
+            with read_db('messages') as db:
+                self.assertEqual(_dal.get(db, 'messages', item['id'])['message'], _LONG)
+            with self.assertRaises(_dal.CompressionDisabled):
+                _dal.compress_existing()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Limite de requisições por cliente (token bucket) e resposta 429 com Retry-After
+
+Uso:
+    python -m unittest discover tests
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _ratelimit  # noqa: E402
+import messages  # noqa: E402
+from _db import init_db  # noqa: E402
+from _ratelimit import check, client_id, retry_after_header  # noqa: E402
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        _ratelimit.reset()
+        patcher = mock.patch.multiple(_ratelimit, ENABLED=True, PER_MINUTE=60.0, BURST=3.0, SHARED_PATH=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(_ratelimit.reset)
+
+    def test_burst_then_retry_after(self):
+        with mock.patch.object(_ratelimit.time, 'time', return_value=1000.0):
+            self.assertEqual([check('messages', '10.0.0.1') for _ in range(3)], [0.0, 0.0, 0.0])
+            self.assertAlmostEqual(check('messages', '10.0.0.1'), 1.0)
+            # Outro cliente e outro escopo têm baldes próprios
+            self.assertEqual(check('messages', '10.0.0.2'), 0.0)
+            self.assertEqual(check('budgets', '10.0.0.1'), 0.0)
+
+        # Uma ficha por segundo (60/min)
+        with mock.patch.object(_ratelimit.time, 'time', return_value=1001.0):
+            self.assertEqual(check('messages', '10.0.0.1'), 0.0)
+            self.assertGreater(check('messages', '10.0.0.1'), 0.0)
+
+    def test_disabled_never_limits(self):
+        with mock.patch.object(_ratelimit, 'ENABLED', False):
+            self.assertEqual([check('messages', 'x') for _ in range(10)], [0.0] * 10)
+
+    def test_shared_bucket_counts_every_worker(self):
+        with mock.patch.object(_ratelimit, 'SHARED_PATH', os.path.join(_TMP, 'rate-limits.sqlite3')):
+            self.addCleanup(_ratelimit._close_shared)
+            with mock.patch.object(_ratelimit.time, 'time', return_value=2000.0):
+                for _ in range(3):
+                    self.assertEqual(check('messages', '10.0.0.3'), 0.0)
+                # Outro worker: balde local cheio, mas o compartilhado está vazio
+                _ratelimit.reset()
+                self.assertGreater(check('messages', '10.0.0.3'), 0.0)
+
+    def test_retry_after_header_rounds_up(self):
+        self.assertEqual(retry_after_header(0.2), '1')
+        self.assertEqual(retry_after_header(1.0), '1')
+        self.assertEqual(retry_after_header(1.01), '2')
+
+    def test_forwarded_headers_only_when_trusted(self):
+        headers = {'X-Forwarded-For': '1.1.1.1, 2.2.2.2'}
+        with mock.patch.object(_ratelimit, 'TRUST_FORWARDED', False):
+            self.assertEqual(client_id(headers, '9.9.9.9'), '9.9.9.9')
+        with mock.patch.object(_ratelimit, 'TRUST_FORWARDED', True):
+            # O último endereço é o que o proxy acrescentou
+            self.assertEqual(client_id(headers, '9.9.9.9'), '2.2.2.2')
+            self.assertEqual(client_id({'X-Real-IP': '3.3.3.3'}, '9.9.9.9'), '3.3.3.3')
+            self.assertEqual(client_id({}, None), 'unknown')
+
+
+class MessagesEndpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), messages.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _ratelimit.reset()
+        patcher = mock.patch.multiple(
+            _ratelimit, ENABLED=True, PER_MINUTE=1.0, BURST=2.0, SHARED_PATH=None, TRUST_FORWARDED=False
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(_ratelimit.reset)
+
+    def _post(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            conn.request('POST', '/api/messages', json.dumps({
+                'name': 'rita', 'email': 'rita@example.com', 'subject': 'Teste', 'message': 'Olá'
+            }), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, response.getheader('Retry-After'), json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_post_over_the_limit_is_429(self):
+        self.assertEqual(self._post()[0], 201)
+        self.assertEqual(self._post()[0], 201)
+        status, retry_after, body = self._post()
+        self.assertEqual(status, 429)
+        # Uma ficha por minuto: a próxima em até 60 s
+        self.assertTrue(1 <= int(retry_after) <= 60)
+        self.assertIn('error', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
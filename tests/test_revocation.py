@@ -0,0 +1,111 @@
+"""
+Logout: token revogado até o exp, também para os outros processos
+
+Uso:
+    python -m unittest discover tests
+"""
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+
+_TMP = tempfile.mkdtemp(prefix='starke-test-')
+os.environ['STARKE_DB_PATH'] = os.path.join(_TMP, 'database.sqlite3')
+os.environ['STARKE_ARCHIVE_DIR'] = os.path.join(_TMP, 'archive')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _revocation  # noqa: E402
+import login  # noqa: E402
+import messages  # noqa: E402
+from _db import init_db, read_db  # noqa: E402
+from _jwt_helper import encode, generate_token, revoke_token, verify_token  # noqa: E402
+
+
+def _forget_local_state():
+    """Simula outro worker: nada em memória, só o que está no banco"""
+    with _revocation._LOCK:
+        _revocation._REVOKED.clear()
+        _revocation._LOADED['at'] = None
+
+
+class RevocationTest(unittest.TestCase):
+    def setUp(self):
+        init_db()
+        self.addCleanup(_forget_local_state)
+
+    def test_revoked_token_stops_verifying(self):
+        token = generate_token()
+        self.assertIsNotNone(verify_token(token))
+        self.assertTrue(revoke_token(token))
+        self.assertIsNone(verify_token(token))
+        # Já revogado: não é mais um token válido
+        self.assertFalse(revoke_token(token))
+
+    def test_other_workers_see_the_revocation(self):
+        token = generate_token()
+        other = generate_token()
+        self.assertTrue(revoke_token(token))
+        _forget_local_state()
+        self.assertIsNone(verify_token(token))
+        self.assertIsNotNone(verify_token(other))
+
+    def test_invalid_token_is_not_revoked(self):
+        self.assertFalse(revoke_token('nao.e.token'))
+        self.assertFalse(revoke_token(''))
+
+    def test_token_without_jti_uses_its_hash(self):
+        token = encode({'email': 'admin', 'exp': time.time() + 60})
+        self.assertTrue(_revocation.token_id(token, {}).startswith('sha256:'))
+        self.assertTrue(revoke_token(token))
+        _forget_local_state()
+        self.assertIsNone(verify_token(token))
+
+    def test_expired_rows_are_purged(self):
+        payload = {'jti': 'antigo', 'exp': time.time() - 1}
+        _revocation.revoke('antigo', payload)
+        self.assertTrue(revoke_token(generate_token()))
+        with read_db() as db:
+            jtis = [row[0] for row in db.execute('SELECT jti FROM revoked_tokens')]
+        self.assertNotIn('antigo', jtis)
+
+
+class LogoutEndpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        cls.servers = []
+        for handler in (login.handler, messages.handler):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            cls.servers.append(server)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def _request(self, server, method, path, token):
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+        try:
+            conn.request(method, path, b'', {'Authorization': f'Bearer {token}', 'Content-Length': '0'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def test_logout_revokes_the_bearer_token(self):
+        login_server, messages_server = self.servers
+        token = generate_token()
+        self.assertEqual(self._request(messages_server, 'GET', '/api/messages', token), 200)
+        self.assertEqual(self._request(login_server, 'POST', '/api/logout', token), 200)
+        self.assertEqual(self._request(messages_server, 'GET', '/api/messages', token), 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Servidor pre-fork (server.py): reload com SIGHUP troca todos os workers
+
+Uso:
+    python -m unittest tests.test_server
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import flask  # noqa: F401
+except ImportError:
+    flask = None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid):
+    """pids dos processos filhos vivos (lidos de /proc)"""
+    children = set()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields[0] = estado, fields[1] = ppid
+        if fields[1] == str(pid) and fields[0] != 'Z':
+            children.add(int(entry))
+    return children
+
+
+def _wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    return condition()
+
+
+@unittest.skipUnless(flask and hasattr(os, 'fork') and os.path.isdir('/proc'), 'requer Flask, fork() e /proc')
+class ReloadTest(unittest.TestCase):
+    WORKERS = 16
+
+    def _start(self, *extra):
+        env = dict(os.environ, STARKE_DB_PATH=os.path.join(tempfile.mkdtemp(), 'database.sqlite3'))
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+             '--port', str(_free_port()), '--workers', str(self.WORKERS),
+             '--graceful-timeout', '2', *extra],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.addCleanup(self._stop, process)
+        return process
+
+    def _stop(self, process):
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def _assert_reload_replaces_generation(self, *extra):
+        process = self._start(*extra)
+        first = _wait_for(lambda: len(_children(process.pid)) == self.WORKERS and _children(process.pid), 30)
+        self.assertEqual(len(first), self.WORKERS)
+
+        process.send_signal(signal.SIGHUP)
+        replaced = _wait_for(
+            lambda: (lambda now: len(now) == self.WORKERS and not now & first and now)(_children(process.pid)),
+            30
+        )
+        now = _children(process.pid)
+        self.assertFalse(now & first, f'{len(now & first)} workers da geração anterior ainda vivos')
+        self.assertEqual(len(now), self.WORKERS)
+        self.assertTrue(replaced)
+
+    def test_reload_replaces_all_workers_preloaded(self):
+        self._assert_reload_replaces_generation('--preload')
+
+    def test_reload_replaces_all_workers(self):
+        self._assert_reload_replaces_generation()
+
+    def test_reload_replaces_all_workers_with_reuse_port(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.skipTest('SO_REUSEPORT não disponível')
+        self._assert_reload_replaces_generation('--reuse-port')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Adapter req/res -> WSGI de _vercel_helper.make_handler
+
+Uso:
+    python -m unittest discover tests
+"""
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import _vercel_helper  # noqa: E402
+from _metrics import render_prometheus  # noqa: E402
+from _vercel_helper import make_handler  # noqa: E402
+
+
+class _Req:
+    def __init__(self, method='GET', url='/', body=b'', headers=None):
+        self.method = method
+        self.url = url
+        self.path = url.split('?', 1)[0]
+        self.body = body
+        self.headers = headers or {}
+
+
+class _Res:
+    """Resposta no estilo Node: setHeader/write/send/end"""
+
+    def __init__(self):
+        self.statusCode = None
+        self.header_map = {}
+        self.sent = []
+        self.written = []
+        self.ended = False
+
+    def setHeader(self, name, value):
+        self.header_map[name] = value
+
+    def write(self, chunk):
+        self.written.append(bytes(chunk))
+
+    def send(self, body):
+        self.sent.append(bytes(body))
+
+    def end(self, body=None):
+        if body is not None:
+            self.sent.append(bytes(body))
+        self.ended = True
+
+
+class _Closing:
+    """Iterável com close(), como o ClosingIterator do werkzeug"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self.closed = True
+
+
+def _errors_total():
+    for line in render_prometheus().splitlines():
+        if line.startswith('starke_wsgi_adapter_errors_total'):
+            return float(line.split()[-1])
+    return 0.0
+
+
+class MakeHandlerTest(unittest.TestCase):
+    def test_single_chunk_is_sent_once(self):
+        seen = {}
+
+        def app(environ, start_response):
+            seen['body'] = environ['wsgi.input'].read()
+            seen['query'] = environ['QUERY_STRING']
+            start_response('201 Created', [('Content-Type', 'application/json')])
+            return _Closing([b'{"ok": true}'])
+
+        res = _Res()
+        make_handler(app)(_Req('POST', '/api/messages?x=1', b'{"a": 1}'), res)
+        self.assertEqual(seen, {'body': b'{"a": 1}', 'query': 'x=1'})
+        self.assertEqual(res.statusCode, 201)
+        self.assertEqual(res.header_map['Content-Type'], 'application/json')
+        self.assertEqual(res.sent, [b'{"ok": true}'])
+        self.assertEqual(res.written, [])
+
+    def test_stream_is_written_chunk_by_chunk(self):
+        result = _Closing([b'[', b'1', b',2', b']'])
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return result
+
+        res = _Res()
+        make_handler(app)(_Req(), res)
+        self.assertEqual(res.written, [b'[', b'1', b',2', b']'])
+        self.assertTrue(res.ended)
+        self.assertTrue(result.closed)
+
+    def test_host_without_write_gets_joined_body(self):
+        class _BufferedRes:
+            def __init__(self):
+                self.sent = []
+
+            def send(self, body):
+                self.sent.append(body)
+
+        def app(environ, start_response):
+            write = start_response('200 OK', [])
+            write(b'a')
+            return [b'b', b'c']
+
+        res = _BufferedRes()
+        make_handler(app)(_Req(), res)
+        self.assertEqual(res.sent, [b'abc'])
+
+    def test_error_before_start_becomes_500(self):
+        def app(environ, start_response):
+            raise RuntimeError('falhou')
+
+        class _StatusRes:
+            def __init__(self):
+                self.status_code = 200
+                self.headers = {}
+
+        errors = io.StringIO()
+        before = _errors_total()
+        original = _vercel_helper._ENVIRON_TEMPLATE['wsgi.errors']
+        _vercel_helper._ENVIRON_TEMPLATE['wsgi.errors'] = errors
+        try:
+            res = _StatusRes()
+            body = make_handler(app)(_Req(), res)
+        finally:
+            _vercel_helper._ENVIRON_TEMPLATE['wsgi.errors'] = original
+
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(res.headers['Content-Type'], 'application/json')
+        self.assertIn('falhou', body)
+        self.assertIn('RuntimeError: falhou', errors.getvalue())
+        self.assertEqual(_errors_total(), before + 1)
+
+    def test_error_after_start_keeps_status(self):
+        def chunks():
+            yield b'['
+            yield b'1'
+            raise RuntimeError('no meio do stream')
+
+        result = _Closing(chunks())
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return result
+
+        res = _Res()
+        before = _errors_total()
+        self.assertIsNone(make_handler(app)(_Req(), res))
+        self.assertEqual(res.statusCode, 200)
+        self.assertEqual(res.header_map, {'Content-Type': 'application/json'})
+        self.assertEqual(res.written, [b'[', b'1'])
+        self.assertTrue(res.ended)
+        self.assertTrue(result.closed)
+        self.assertEqual(_errors_total(), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
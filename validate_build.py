@@ -27,9 +27,23 @@ python_files = [
     'login.py', 
     'messages.py',
     'budgets.py',
+    'metrics.py',
+    'events.py',
     '_db.py',
     '_jwt_helper.py',
-    '_shared.py'
+    '_shared.py',
+    '_http.py',
+    '_metrics.py',
+    '_archive.py',
+    '_backup.py',
+    '_batch.py',
+    '_changes.py',
+    '_dal.py',
+    '_idempotency.py',
+    '_jsonstream.py',
+    '_packing.py',
+    '_ratelimit.py',
+    '_revocation.py'
 ]
 
 for filename in python_files:
@@ -58,7 +72,7 @@ for filename in python_files:
         continue
     
     # 3. Verificar se tem handler (para arquivos de endpoint)
-    if filename in ['health.py', 'login.py', 'messages.py', 'budgets.py']:
+    if filename in ['health.py', 'login.py', 'messages.py', 'budgets.py', 'metrics.py']:
         try:
             # Tenta importar
             module_name = filename.replace('.py', '')
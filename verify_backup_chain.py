@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Verificação offline de uma cadeia de backup (base + incrementos)
+
+Lê os arquivos baixados de GET /api/db-admin/backup (base) e de
+GET /api/db-admin/backup?since=<token> (incrementos), confere formato,
+checksum e continuidade de cada incremento, aplica a cadeia em memória e
+roda PRAGMA integrity_check no resultado. O banco não é alterado.
+
+Uso:
+    python verify_backup_chain.py backup.json inc1.json inc2.json [--compare] [--output restaurado.sqlite3]
+
+- A base pode ser o JSON do endpoint ou o próprio arquivo .sqlite3
+- --compare compara quantidade e sha256 das linhas com o banco local
+  (STARKE_DB_PATH ou o caminho padrão)
+- --output grava o banco resultante da cadeia em um arquivo SQLite
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+
+def _read_base(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(b'SQLite format 3\x00'):
+        return data
+    return base64.b64decode(json.loads(data)['backup'])
+
+
+def _read_increment(path):
+    with open(path, encoding='utf-8') as f:
+        payload = json.load(f)
+    # Aceita a resposta do endpoint ({"success": true, "increment": {...}}) ou o incremento puro
+    return payload.get('increment', payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica uma cadeia de backup incremental')
+    parser.add_argument('base', help='Backup completo (JSON do endpoint ou arquivo .sqlite3)')
+    parser.add_argument('increments', nargs='*', help='Incrementos em ordem (JSON)')
+    parser.add_argument('--compare', action='store_true', help='Compara o resultado com o banco local')
+    parser.add_argument('--output', help='Grava o banco resultante neste arquivo')
+    args = parser.parse_args()
+
+    sys.path.insert(0, API_DIR)
+    from _backup import build_snapshot, verify_chain
+
+    base = _read_base(args.base)
+    increments = [_read_increment(path) for path in args.increments]
+    report = verify_chain(base, increments, compare=args.compare)
+
+    print("=" * 60)
+    print("VERIFICAÇÃO DA CADEIA DE BACKUP")
+    print("=" * 60)
+    print(f"Base: {args.base}" + (f" (posição {report['base']})" if report['base'] else ''))
+    for number, step in enumerate(report['increments'], 1):
+        counts = ', '.join(
+            f"{table}: {data['rows']} linhas, {data['deleted']} excluídas"
+            for table, data in step['tables'].items()
+        )
+        print(f"✅ Incremento {number}: {step['from']} -> {step['to']} ({counts})")
+    for error in report['errors']:
+        print(f"❌ {error}")
+
+    if report['position'] is not None:
+        print(f"Posição final: {report['position']} | integrity_check: {report.get('integrity')}")
+        for table, data in report.get('tables', {}).items():
+            line = f"   {table}: {data['count']} linhas, sha256 {data['sha256'][:16]}"
+            if 'matches_live' in data:
+                line += ' | banco local: ' + ('igual' if data['matches_live'] else
+                                              f"DIFERENTE ({data['live']['count']} linhas)")
+            print(line)
+
+    if report['valid'] and args.output:
+        with open(args.output, 'wb') as f:
+            f.write(build_snapshot(base, increments))
+        print(f"Banco resultante gravado em {args.output}")
+
+    print("=" * 60)
+    print("✅ Cadeia válida" if report['valid'] else "❌ Cadeia inválida")
+    return 0 if report['valid'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())